@@ -0,0 +1,118 @@
+"""
+管理 API
+运行时剖析等仅限管理员的操作，需在请求头 X-Admin-Token 中携带 ADMIN_TOKEN
+"""
+import secrets
+import time
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field
+
+from app.config import settings
+from app.services.host_health import host_health
+from app.services.profiler import profiler
+from app.startup import startup_report
+
+router = APIRouter()
+
+
+def require_admin(x_admin_token: Optional[str] = Header(default=None)):
+    """校验管理员令牌"""
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="未配置 ADMIN_TOKEN，管理接口不可用")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="管理员令牌无效")
+
+
+class RequestProfileRequest(BaseModel):
+    """请求剖析参数"""
+    route: str = Field(..., description="路由路径或模板，如 /api/chat/stream、/api/knowledge/datasets/{dataset_id}/retrieve")
+    count: int = Field(default=10, ge=1, le=1000, description="剖析的请求数")
+    timeout: float = Field(default=300, gt=0, le=3600, description="最长等待时间（秒）")
+    interval_ms: Optional[float] = Field(default=None, ge=1, le=1000, description="采样间隔")
+
+
+def _collapsed_response(content: str, name: str) -> PlainTextResponse:
+    filename = f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.collapsed"
+    return PlainTextResponse(content, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+
+@router.post("/profile/process", dependencies=[Depends(require_admin)])
+async def profile_process(
+    seconds: float = Query(default=10, gt=0),
+    interval_ms: Optional[float] = Query(default=None, ge=1, le=1000),
+    idle: bool = Query(default=False, description="是否包含阻塞等待中的线程"),
+):
+    """
+    进程剖析
+
+    在指定时长内采样所有线程，返回折叠栈文件（可用 flamegraph.pl 或 speedscope 打开）
+    """
+    if seconds > settings.PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"剖析时长不能超过 {settings.PROFILE_MAX_SECONDS} 秒")
+    interval = (interval_ms or settings.PROFILE_INTERVAL_MS) / 1000
+    try:
+        sampler = await profiler.profile_process(seconds, interval, idle)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return _collapsed_response(sampler.collapsed(), "process")
+
+
+@router.post("/profile/requests", status_code=202, dependencies=[Depends(require_admin)])
+async def start_request_profile(request: RequestProfileRequest):
+    """
+    请求剖析
+
+    剖析匹配路由的后续 N 个请求，完成或超时后通过 GET /profile/requests/collapsed 下载结果
+    """
+    interval = (request.interval_ms or settings.PROFILE_INTERVAL_MS) / 1000
+    try:
+        session = profiler.start_requests(request.route, request.count, request.timeout, interval)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return session.status()
+
+
+@router.get("/profile/requests", dependencies=[Depends(require_admin)])
+async def get_request_profile():
+    """查询最近一次请求剖析的状态"""
+    if profiler.last is None:
+        raise HTTPException(status_code=404, detail="没有请求剖析记录")
+    return profiler.last.status()
+
+
+@router.get("/profile/requests/collapsed", dependencies=[Depends(require_admin)])
+async def download_request_profile():
+    """下载最近一次请求剖析的折叠栈（进行中时返回已采集部分）"""
+    if profiler.last is None:
+        raise HTTPException(status_code=404, detail="没有请求剖析记录")
+    return _collapsed_response(profiler.last.collapsed(), "requests")
+
+
+@router.delete("/profile/requests", dependencies=[Depends(require_admin)])
+async def stop_request_profile():
+    """提前结束请求剖析"""
+    session = profiler.stop_requests()
+    if session is None:
+        raise HTTPException(status_code=404, detail="没有请求剖析记录")
+    return session.status()
+
+
+@router.get("/startup", dependencies=[Depends(require_admin)])
+async def get_startup_report():
+    """启动各阶段与预热步骤耗时"""
+    return startup_report.to_dict()
+
+
+@router.get("/ssh-hosts", dependencies=[Depends(require_admin)])
+async def get_ssh_hosts():
+    """各 SSH 主机的连接耗时均值、当前连接超时与失败退避状态（本 worker）"""
+    return {"hosts": host_health.snapshot()}
+
+
+@router.delete("/ssh-hosts", dependencies=[Depends(require_admin)])
+async def reset_ssh_hosts(host: Optional[str] = None):
+    """清除主机健康记录（如主机已修复，不等待退避结束）；不指定 host 时清除全部"""
+    return {"cleared": host_health.reset(host)}
@@ -1,15 +1,25 @@
 """
 对话 API - 与 Dify 平台交互
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from pydantic import BaseModel, Field, ValidationError
+from typing import Optional, List, Dict, Any, Set, AsyncIterator
+from contextlib import aclosing
+import asyncio
 import httpx
 import json
+import random
+import time
 from loguru import logger
 
 from app.config import settings
+from app.responses import NDJSON_MEDIA_TYPE, ndjson_line, upstream_json
+from app.services import history_service
+from app.services.answer_cache import answer_cache
+from app.services.admission import HIGH, LOW, OverloadedError, StreamSlot, admission, admit_dify
+from app.services.dify_client import CircuitOpenError, dify_request, dify_stream
+from app.services.metrics import DIFY_FIRST_TOKEN
 
 router = APIRouter()
 
@@ -36,49 +46,188 @@ class ChatResponse(BaseModel):
     metadata: Optional[Dict[str, Any]] = None
 
 
-@router.post("/send", response_model=ChatResponse)
+class BatchChatRequest(BaseModel):
+    """批量对话请求（用于提示词回归评测）"""
+    requests: List[ChatRequest]
+    concurrency: int = 4
+    max_retries: int = 2
+
+
+class StreamStats:
+    """
+    流式对话统计
+
+    客户端断开时上游 Dify 流会被立即中止，这里记录中止次数和节省的流量估算。
+    节省字节数按「已完成流的平均大小 - 中止前已转发字节数」估算。
+    """
+
+    def __init__(self):
+        self.completed_streams = 0
+        self.completed_bytes = 0
+        self.aborted_streams = 0
+        self.aborted_bytes_relayed = 0
+        self.estimated_bytes_saved = 0
+        self.stop_requests_sent = 0
+        self.stop_requests_failed = 0
+
+    def record_completed(self, relayed: int):
+        self.completed_streams += 1
+        self.completed_bytes += relayed
+
+    def record_aborted(self, relayed: int):
+        self.aborted_streams += 1
+        self.aborted_bytes_relayed += relayed
+        if self.completed_streams:
+            average = self.completed_bytes // self.completed_streams
+            self.estimated_bytes_saved += max(0, average - relayed)
+
+    def snapshot(self) -> Dict[str, int]:
+        return dict(vars(self))
+
+
+stream_stats = StreamStats()
+
+# 保存后台 stop 任务的引用，避免被垃圾回收
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def _parse_event(data: str) -> Dict[str, Any]:
+    """解析 Dify 事件 JSON，无法解析时返回空字典"""
+    try:
+        event = json.loads(data)
+    except ValueError:
+        return {}
+    return event if isinstance(event, dict) else {}
+
+
+async def _stop_dify_task(task_id: str, user_id: str):
+    """调用 Dify 停止生成接口，释放上游 LLM 资源"""
+    try:
+        response = await dify_request(
+            "POST",
+            f"/chat-messages/{task_id}/stop",
+            endpoint="chat",
+            timeout=10.0,
+            json={"user": user_id},
+        )
+        if response.status_code != 200:
+            stream_stats.stop_requests_failed += 1
+            logger.warning(f"停止 Dify 任务失败: {task_id} | {response.text}")
+            return
+        stream_stats.stop_requests_sent += 1
+    except Exception as e:
+        stream_stats.stop_requests_failed += 1
+        logger.warning(f"停止 Dify 任务失败: {task_id} | {e}")
+
+
+def _run_in_background(coro):
+    task = asyncio.get_running_loop().create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+def _on_stream_aborted(task_id: Optional[str], user_id: str, relayed: int):
+    """客户端断开后的清理：记录统计并异步通知 Dify 停止生成"""
+    stream_stats.record_aborted(relayed)
+    logger.info(f"客户端已断开，中止上游流 | task_id: {task_id} | 已转发: {relayed} bytes")
+
+    if not (task_id and settings.DIFY_STOP_ON_DISCONNECT):
+        return
+
+    # 当前协程正在被取消，stop 请求需要在独立任务中完成
+    _run_in_background(_stop_dify_task(task_id, user_id))
+
+
+async def _send_blocking(request: ChatRequest) -> ChatResponse:
+    """以阻塞模式调用 Dify 并镜像本轮对话"""
+    payload = {
+        "inputs": request.inputs or {},
+        "query": request.message,
+        "response_mode": "blocking",
+        "user": request.user_id,
+    }
+    
+    if request.conversation_id:
+        payload["conversation_id"] = request.conversation_id
+    
+    response = await dify_request(
+        "POST",
+        "/chat-messages",
+        endpoint="chat",
+        timeout=120.0,
+        json=payload,
+    )
+    
+    if response.status_code != 200:
+        logger.error(f"Dify API error: {response.text}")
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=f"Dify API 错误: {response.text}"
+        )
+    
+    data = response.json()
+    
+    result = ChatResponse(
+        answer=data.get("answer", ""),
+        conversation_id=data.get("conversation_id", ""),
+        message_id=data.get("message_id", ""),
+        metadata=data.get("metadata"),
+    )
+    
+    if settings.CHAT_HISTORY_MIRROR:
+        await history_service.record_message(
+            conversation_id=result.conversation_id,
+            message_id=result.message_id,
+            user_id=request.user_id,
+            query=request.message,
+            answer=result.answer,
+            new_conversation=not request.conversation_id,
+        )
+    
+    return result
+
+
+async def _send_cached(request: ChatRequest) -> ChatResponse:
+    """
+    带答案缓存的发送
+
+    Dify 会话归属于用户，缓存答案来自其他用户时不返回原会话 ID，
+    后续追问会开启新会话
+    """
+    key = answer_cache.make_key(request.message, request.inputs, settings.DIFY_APP_ID)
+    
+    async def fetch():
+        # 缓存值需可 JSON 序列化（多 worker 时存放在 Redis）
+        return request.user_id, (await _send_blocking(request)).model_dump()
+    
+    (origin_user, data), hit = await answer_cache.get_or_fetch(key, fetch)
+    response = ChatResponse(**data)
+    if not hit and origin_user == request.user_id:
+        return response
+    
+    metadata = dict(response.metadata or {})
+    metadata["cached"] = True
+    return response.model_copy(update={
+        "conversation_id": response.conversation_id if origin_user == request.user_id else "",
+        "metadata": metadata,
+    })
+
+
+@router.post("/send", response_model=ChatResponse, dependencies=[Depends(admit_dify(HIGH))])
 async def send_message(request: ChatRequest):
     """
     发送消息到 Dify Agent
     非流式响应
+
+    开启 ANSWER_CACHE_ENABLED 后，新会话的首轮问题会走答案缓存
     """
     try:
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            payload = {
-                "inputs": request.inputs or {},
-                "query": request.message,
-                "response_mode": "blocking",
-                "user": request.user_id,
-            }
-            
-            if request.conversation_id:
-                payload["conversation_id"] = request.conversation_id
-            
-            response = await client.post(
-                f"{settings.DIFY_API_BASE_URL}/chat-messages",
-                headers={
-                    "Authorization": f"Bearer {settings.DIFY_API_KEY}",
-                    "Content-Type": "application/json",
-                },
-                json=payload,
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"Dify API error: {response.text}")
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Dify API 错误: {response.text}"
-                )
-            
-            data = response.json()
-            
-            return ChatResponse(
-                answer=data.get("answer", ""),
-                conversation_id=data.get("conversation_id", ""),
-                message_id=data.get("message_id", ""),
-                metadata=data.get("metadata"),
-            )
+        if settings.ANSWER_CACHE_ENABLED and not request.conversation_id:
+            return await _send_cached(request)
+        return await _send_blocking(request)
             
+    except CircuitOpenError:
+        raise
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="请求超时")
     except Exception as e:
@@ -86,44 +235,124 @@ async def send_message(request: ChatRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _relay_dify_stream(request: ChatRequest) -> AsyncIterator[str]:
+    """
+    代理 Dify 流式对话，逐条产出事件 JSON（SSE 与 WebSocket 共用）
+
+    生成器被取消或关闭时视为客户端中止：上游连接随之关闭，并调用 Dify stop 接口。
+    正常结束后记录统计并写入本地历史镜像；中止或出错时 Dify 仍会保存本轮消息，本地镜像标记为不完整
+    """
+    task_id = None
+    relayed = 0
+    # 用于本地历史镜像
+    conversation_id = request.conversation_id
+    message_id = None
+    answer_parts: List[str] = []
+    finished = False
+    
+    payload = {
+        "inputs": request.inputs or {},
+        "query": request.message,
+        "response_mode": "streaming",
+        "user": request.user_id,
+    }
+    
+    if request.conversation_id:
+        payload["conversation_id"] = request.conversation_id
+    
+    started = time.perf_counter()
+    try:
+        async with dify_stream(
+            "POST",
+            "/chat-messages",
+            endpoint="chat",
+            timeout=120.0,
+            json=payload,
+        ) as response:
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                data = line[len("data: "):]
+                if not relayed:
+                    DIFY_FIRST_TOKEN.observe(time.perf_counter() - started, "chat")
+                if task_id is None or settings.CHAT_HISTORY_MIRROR:
+                    event = _parse_event(data)
+                    task_id = task_id or event.get("task_id")
+                    conversation_id = event.get("conversation_id") or conversation_id
+                    message_id = event.get("message_id") or message_id
+                    if event.get("event") in ("message", "agent_message"):
+                        answer_parts.append(event.get("answer") or "")
+                    elif event.get("event") == "message_end":
+                        finished = True
+                relayed += len(data.encode("utf-8"))
+                yield data
+    except (asyncio.CancelledError, GeneratorExit):
+        _on_stream_aborted(task_id, request.user_id, relayed)
+        if settings.CHAT_HISTORY_MIRROR:
+            _run_in_background(history_service.mark_incomplete(conversation_id))
+        raise
+    except Exception:
+        if settings.CHAT_HISTORY_MIRROR:
+            await history_service.mark_incomplete(conversation_id)
+        raise
+    
+    stream_stats.record_completed(relayed)
+    
+    if not settings.CHAT_HISTORY_MIRROR:
+        return
+    if finished:
+        await history_service.record_message(
+            conversation_id=conversation_id,
+            message_id=message_id,
+            user_id=request.user_id,
+            query=request.message,
+            answer="".join(answer_parts),
+            new_conversation=not request.conversation_id,
+        )
+    else:
+        # 上游以 error 事件结束等情况
+        await history_service.mark_incomplete(conversation_id)
+
+
+class _SlotStreamingResponse(StreamingResponse):
+    """响应结束时释放流式会话名额（生成器从未开始时其 finally 不会执行）"""
+
+    def __init__(self, slot: StreamSlot, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.slot = slot
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.slot.release()
+
+
 @router.post("/stream")
 async def stream_message(request: ChatRequest):
     """
     发送消息到 Dify Agent
     流式响应 (SSE)
+
+    客户端断开时 StreamingResponse 会取消生成器，此时立即关闭上游连接，
+    并调用 Dify stop 接口终止该任务的生成。
     """
+    slot = admission.admit_stream(HIGH)
+    
     async def generate():
         try:
-            async with httpx.AsyncClient(timeout=120.0) as client:
-                payload = {
-                    "inputs": request.inputs or {},
-                    "query": request.message,
-                    "response_mode": "streaming",
-                    "user": request.user_id,
-                }
-                
-                if request.conversation_id:
-                    payload["conversation_id"] = request.conversation_id
-                
-                async with client.stream(
-                    "POST",
-                    f"{settings.DIFY_API_BASE_URL}/chat-messages",
-                    headers={
-                        "Authorization": f"Bearer {settings.DIFY_API_KEY}",
-                        "Content-Type": "application/json",
-                    },
-                    json=payload,
-                ) as response:
-                    async for line in response.aiter_lines():
-                        if line.startswith("data: "):
-                            yield f"{line}\n\n"
-                            
+            async with aclosing(_relay_dify_stream(request)) as events:
+                async for data in events:
+                    yield f"data: {data}\n\n"
         except Exception as e:
             logger.exception("流式消息失败")
             error_data = {"event": "error", "message": str(e)}
             yield f"data: {json.dumps(error_data)}\n\n"
+        finally:
+            slot.release()
     
-    return StreamingResponse(
+    return _SlotStreamingResponse(
+        slot,
         generate(),
         media_type="text/event-stream",
         headers={
@@ -133,61 +362,414 @@ async def stream_message(request: ChatRequest):
     )
 
 
-@router.get("/conversations/{conversation_id}/messages")
+# 单个 window / ack credits 的上限（帧数）
+_MAX_STREAM_CREDITS = 65536
+
+
+class _WindowFrame(BaseModel):
+    """chat 帧的发送窗口"""
+    window: Optional[int] = Field(default=None, gt=0, le=_MAX_STREAM_CREDITS)
+
+
+class _AckFrame(BaseModel):
+    """ack 帧补充的 credits"""
+    credits: int = Field(default=1, gt=0, le=_MAX_STREAM_CREDITS)
+
+
+class _StreamWindow:
+    """WebSocket 单个会话流的发送窗口（基于 credit 的流控）"""
+
+    def __init__(self, credits: int):
+        self.credits = credits
+        self._available = asyncio.Event()
+        if credits > 0:
+            self._available.set()
+
+    async def acquire(self):
+        while self.credits <= 0:
+            self._available.clear()
+            await self._available.wait()
+        self.credits -= 1
+
+    def grant(self, credits: int):
+        self.credits += credits
+        if self.credits > 0:
+            self._available.set()
+
+
+class _ChatSocket:
+    """
+    一个 WebSocket 连接上的多路对话
+
+    每个会话流由客户端指定的 id 标识，各自运行在独立任务中；
+    所有出站帧经同一个有界队列由单独的写任务发送，慢客户端会反压到上游
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.streams: Dict[str, asyncio.Task] = {}
+        self.windows: Dict[str, _StreamWindow] = {}
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=settings.WS_OUTBOX_SIZE)
+
+    async def send(self, frame: Dict[str, Any]):
+        await self.outbox.put(json.dumps(frame, ensure_ascii=False))
+
+    async def _writer(self):
+        while True:
+            text = await self.outbox.get()
+            await self.websocket.send_text(text)
+
+    async def _run_stream(self, stream_id: str, request: ChatRequest):
+        window = self.windows[stream_id]
+        # Dify 事件本身就是 JSON，直接拼接进帧，避免重复解析与序列化
+        prefix = f'{{"id":{json.dumps(stream_id)},"type":"event","data":'
+        try:
+            async with aclosing(_relay_dify_stream(request)) as events:
+                async for data in events:
+                    await window.acquire()
+                    await self.outbox.put(f"{prefix}{data}}}")
+            await self.send({"id": stream_id, "type": "done"})
+        except asyncio.CancelledError:
+            if not self.outbox.full():
+                self.outbox.put_nowait(json.dumps({"id": stream_id, "type": "cancelled"}))
+            raise
+        except Exception as e:
+            logger.exception(f"WebSocket 会话流失败: {stream_id}")
+            await self.send({"id": stream_id, "type": "error", "message": str(e)})
+        finally:
+            self.streams.pop(stream_id, None)
+            self.windows.pop(stream_id, None)
+
+    async def _handle(self, frame: Dict[str, Any]):
+        frame_type = frame.get("type")
+        stream_id = str(frame.get("id", ""))
+        
+        if frame_type == "chat":
+            if not stream_id or stream_id in self.streams:
+                await self.send({"id": stream_id, "type": "error", "message": "会话流 id 为空或重复"})
+                return
+            if len(self.streams) >= settings.WS_MAX_STREAMS:
+                await self.send({
+                    "id": stream_id,
+                    "type": "error",
+                    "message": f"单个连接最多 {settings.WS_MAX_STREAMS} 个并发会话流",
+                })
+                return
+            try:
+                window = _WindowFrame(window=frame.get("window")).window or settings.WS_STREAM_WINDOW
+                request = ChatRequest(**{k: v for k, v in frame.items() if k not in ("type", "id", "window")})
+                slot = admission.admit_stream(HIGH)
+            except (ValidationError, OverloadedError) as e:
+                await self.send({"id": stream_id, "type": "error", "message": str(e)})
+                return
+            self.windows[stream_id] = _StreamWindow(window)
+            task = asyncio.create_task(self._run_stream(stream_id, request))
+            # 任务在开始运行前被取消时协程的 finally 不会执行，在完成回调中释放名额
+            task.add_done_callback(lambda _: slot.release())
+            self.streams[stream_id] = task
+        
+        elif frame_type == "cancel":
+            task = self.streams.get(stream_id)
+            if task:
+                task.cancel()
+        
+        elif frame_type == "ack":
+            window = self.windows.get(stream_id)
+            if window:
+                try:
+                    credits = _AckFrame(**{k: v for k, v in frame.items() if k == "credits"}).credits
+                except ValidationError as e:
+                    await self.send({"id": stream_id, "type": "error", "message": str(e)})
+                    return
+                window.grant(credits)
+        
+        elif frame_type == "ping":
+            await self.send({"type": "pong"})
+        
+        else:
+            await self.send({"id": stream_id, "type": "error", "message": f"未知的帧类型: {frame_type}"})
+
+    async def run(self):
+        writer = asyncio.create_task(self._writer())
+        try:
+            while True:
+                try:
+                    frame = await self.websocket.receive_json()
+                except ValueError:
+                    await self.send({"type": "error", "message": "帧必须是 JSON"})
+                    continue
+                if isinstance(frame, dict):
+                    await self._handle(frame)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            # 连接断开：取消所有会话流（触发上游中止与 Dify stop）
+            for task in list(self.streams.values()):
+                task.cancel()
+            await asyncio.gather(*self.streams.values(), return_exceptions=True)
+            writer.cancel()
+
+
+@router.websocket("/ws")
+async def chat_websocket(websocket: WebSocket):
+    """
+    WebSocket 对话通道
+
+    一个连接承载多个并发会话流，帧格式见 docs/api.md
+    """
+    await websocket.accept()
+    await _ChatSocket(websocket).run()
+
+
+# 可重试的 Dify 状态码：限流与网关/服务端错误
+_RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def _percentile(sorted_values: List[float], percent: float) -> float:
+    """最近秩百分位数"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(percent / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+async def _run_batch_item(
+    semaphore: asyncio.Semaphore,
+    index: int,
+    request: ChatRequest,
+    max_retries: int,
+) -> Dict[str, Any]:
+    """执行单条评测请求，失败时指数退避 + 抖动重试"""
+    payload = {
+        "inputs": request.inputs or {},
+        "query": request.message,
+        "response_mode": "blocking",
+        "user": request.user_id,
+    }
+    if request.conversation_id:
+        payload["conversation_id"] = request.conversation_id
+        if settings.CHAT_HISTORY_MIRROR:
+            # 评测请求不写入镜像，追加到已有会话后该会话的本地历史不再完整
+            await history_service.mark_incomplete(request.conversation_id)
+    
+    result: Dict[str, Any] = {"event": "result", "index": index, "query": request.message}
+    error = None
+    
+    try:
+        for attempt in range(1, max_retries + 2):
+            result["attempts"] = attempt
+            if attempt > 1:
+                # 退避期间不占用并发名额
+                await asyncio.sleep(min(8.0, 0.5 * 2 ** (attempt - 2)) * random.uniform(0.5, 1.5))
+            
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await dify_request(
+                        "POST",
+                        "/chat-messages",
+                        endpoint="chat",
+                        timeout=120.0,
+                        json=payload,
+                    )
+                except (httpx.TransportError, CircuitOpenError) as e:
+                    error = f"{type(e).__name__}: {e}"
+                    continue
+                latency_ms = (time.perf_counter() - start) * 1000
+            
+            if response.status_code == 200:
+                try:
+                    data = response.json()
+                    if not isinstance(data, dict):
+                        raise ValueError("响应不是 JSON 对象")
+                except ValueError as e:
+                    error = f"Dify 响应无法解析: {e}"
+                    break
+                usage = (data.get("metadata") or {}).get("usage")
+                result.update(
+                    status="ok",
+                    latency_ms=round(latency_ms, 2),
+                    answer=data.get("answer", ""),
+                    conversation_id=data.get("conversation_id", ""),
+                    message_id=data.get("message_id", ""),
+                    usage=usage if isinstance(usage, dict) else None,
+                )
+                return result
+            
+            error = f"Dify API 错误 {response.status_code}: {response.text}"
+            if response.status_code not in _RETRYABLE_STATUS:
+                break
+    except Exception as e:
+        # 上游返回结构异常等意外错误只影响本条结果，不中断整批输出
+        logger.exception(f"评测请求失败: #{index}")
+        error = f"{type(e).__name__}: {e}"
+    
+    result.update(status="error", error=error)
+    return result
+
+
+@router.post("/batch")
+async def batch_messages(batch: BatchChatRequest):
+    """
+    批量发送消息（评测用）
+
+    以有限并发调用 Dify 阻塞接口，按完成顺序以 NDJSON 流式返回每条结果，
+    最后一行为汇总（延迟分布与 token 用量）。
+    评测请求不走答案缓存，也不写入本地历史镜像。
+    """
+    if not batch.requests:
+        raise HTTPException(status_code=400, detail="请求列表为空")
+    if len(batch.requests) > settings.BATCH_MAX_REQUESTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"单批最多 {settings.BATCH_MAX_REQUESTS} 条请求"
+        )
+    admission.admit("chat_batch", LOW)
+    
+    concurrency = max(1, min(batch.concurrency, settings.BATCH_MAX_CONCURRENCY))
+    max_retries = max(0, min(batch.max_retries, 5))
+    
+    async def generate():
+        started = time.perf_counter()
+        latencies: List[float] = []
+        total_tokens = 0
+        failed = 0
+        
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = [
+            asyncio.create_task(_run_batch_item(semaphore, i, req, max_retries))
+            for i, req in enumerate(batch.requests)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                if result["status"] == "ok":
+                    latencies.append(result["latency_ms"])
+                    total_tokens += (result.get("usage") or {}).get("total_tokens") or 0
+                else:
+                    failed += 1
+                yield ndjson_line(result)
+        finally:
+            # 客户端断开时取消尚未完成的请求
+            for task in tasks:
+                task.cancel()
+        
+        latencies.sort()
+        summary = {
+            "event": "summary",
+            "total": len(batch.requests),
+            "succeeded": len(latencies),
+            "failed": failed,
+            "concurrency": concurrency,
+            "wall_time_ms": round((time.perf_counter() - started) * 1000, 2),
+            "latency_ms": {
+                "mean": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+                "p50": _percentile(latencies, 50),
+                "p90": _percentile(latencies, 90),
+                "p99": _percentile(latencies, 99),
+                "max": latencies[-1] if latencies else 0.0,
+            },
+            "total_tokens": total_tokens,
+        }
+        yield ndjson_line(summary)
+    
+    return StreamingResponse(generate(), media_type=NDJSON_MEDIA_TYPE)
+
+
+@router.get("/stream/stats")
+async def get_stream_stats():
+    """获取流式对话统计（中止次数、节省流量估算等）"""
+    return stream_stats.snapshot()
+
+
+@router.get("/cache/stats")
+async def get_answer_cache_stats():
+    """获取答案缓存统计"""
+    return answer_cache.stats()
+
+
+@router.delete("/cache")
+async def clear_answer_cache():
+    """清空答案缓存"""
+    await answer_cache.clear()
+    return {"status": "cleared"}
+
+
+@router.get("/conversations/{conversation_id}/messages", dependencies=[Depends(admit_dify(LOW))])
 async def get_conversation_messages(
     conversation_id: str,
     user_id: str = "default_user",
     limit: int = 20,
+    first_id: Optional[str] = None,
 ):
-    """获取对话历史"""
+    """
+    获取对话历史
+
+    完整镜像在本地的会话直接从本地数据库读取，其余会话代理到 Dify。
+    first_id 为游标：返回比该消息更早的记录
+    """
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(
-                f"{settings.DIFY_API_BASE_URL}/messages",
-                headers={
-                    "Authorization": f"Bearer {settings.DIFY_API_KEY}",
-                },
-                params={
-                    "conversation_id": conversation_id,
-                    "user": user_id,
-                    "limit": limit,
-                }
+        if settings.CHAT_HISTORY_MIRROR:
+            try:
+                if await history_service.is_mirrored(conversation_id, user_id):
+                    return await history_service.list_messages(conversation_id, limit=limit, first_id=first_id)
+            except Exception as e:
+                logger.warning(f"读取本地对话镜像失败，改为查询 Dify: {conversation_id} | {e}")
+        
+        params = {
+            "conversation_id": conversation_id,
+            "user": user_id,
+            "limit": limit,
+        }
+        if first_id:
+            params["first_id"] = first_id
+        
+        response = await dify_request(
+            "GET",
+            "/messages",
+            endpoint="conversations",
+            idempotent=True,
+            params=params,
+        )
+        
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=response.text
             )
+        
+        return upstream_json(response)
             
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=response.text
-                )
-            
-            return response.json()
-            
+    except CircuitOpenError:
+        raise
     except Exception as e:
         logger.exception("获取对话历史失败")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.delete("/conversations/{conversation_id}")
+@router.delete("/conversations/{conversation_id}", dependencies=[Depends(admit_dify(LOW))])
 async def delete_conversation(conversation_id: str, user_id: str = "default_user"):
     """删除对话"""
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.delete(
-                f"{settings.DIFY_API_BASE_URL}/conversations/{conversation_id}",
-                headers={
-                    "Authorization": f"Bearer {settings.DIFY_API_KEY}",
-                },
-                params={"user": user_id}
+        response = await dify_request(
+            "DELETE",
+            f"/conversations/{conversation_id}",
+            endpoint="conversations",
+            params={"user": user_id},
+        )
+        
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=response.text
             )
+        
+        await history_service.delete_conversation(conversation_id)
+        
+        return {"status": "deleted", "conversation_id": conversation_id}
             
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=response.text
-                )
-            
-            return {"status": "deleted", "conversation_id": conversation_id}
-            
+    except CircuitOpenError:
+        raise
     except Exception as e:
         logger.exception("删除对话失败")
         raise HTTPException(status_code=500, detail=str(e))
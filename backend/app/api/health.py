@@ -2,8 +2,14 @@
 健康检查 API
 """
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse, PlainTextResponse
 from datetime import datetime
 
+from app.services import shared_state
+from app.services.admission import admission
+from app.services.dify_client import any_breaker_open, breaker_states
+from app.services.metrics import render
+
 router = APIRouter()
 
 
@@ -18,8 +24,26 @@ async def health_check():
 
 @router.get("/ready")
 async def readiness_check():
-    """就绪检查接口"""
-    return {
-        "status": "ready",
-        "timestamp": datetime.now().isoformat(),
-    }
+    """
+    就绪检查接口
+
+    任一 Dify 熔断器打开或准入控制判定过载时返回 503，让负载均衡摘除本实例而不是继续排队。
+    Redis 不可用时共享缓存降级为未命中，不影响就绪
+    """
+    ready = not any_breaker_open() and not admission.overloaded()
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "status": "ready" if ready else "not_ready",
+            "timestamp": datetime.now().isoformat(),
+            "dify_breakers": breaker_states(),
+            "admission": admission.snapshot(),
+            "shared_state": await shared_state.ping(),
+        },
+    )
+
+
+@router.get("/metrics")
+async def metrics():
+    """运行指标（Prometheus 文本格式）"""
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
@@ -2,13 +2,50 @@
 知识库 API
 与 Dify 知识库功能交互
 """
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Dict, Any
 import httpx
+import asyncio
+import heapq
+import json
+import time
+import uuid
 from loguru import logger
 
 from app.config import settings
+from app.responses import NDJSON_MEDIA_TYPE, ndjson_line, ndjson_lines, upstream_json
+from app.services.admission import HIGH, LOW, admit_dify
+from app.services.answer_cache import answer_cache
+from app.services.indexing_tracker import indexing_tracker
+from app.services.lexical_index import lexical_index
+from app.services.listing_service import (
+    DATASET_FIELDS,
+    DOCUMENT_FIELDS,
+    Listing,
+    listing_cache,
+    parse_fields,
+    project,
+)
+from app.services.retrieval_cache import retrieval_cache
+from app.services.dify_client import CircuitOpenError, dify_request
+from app.services.upload_service import (
+    ALLOWED_CONTENT_TYPES,
+    UploadProgress,
+    upload_file_to_dify,
+    upload_tracker,
+)
+from app.services import document_service, extract_service
+from app.services.document_service import DocumentDeleteError
+from app.services.ingest_service import (
+    IngestSource,
+    ingest_jobs,
+    is_archive,
+    plan_sync,
+    start_ingest_job,
+    take_ownership,
+)
 
 router = APIRouter()
 
@@ -23,6 +60,26 @@ class DocumentInfo(BaseModel):
     created_at: str
 
 
+class SyncPlanRequest(BaseModel):
+    """增量同步计划请求"""
+    files: Dict[str, str]  # 源文件路径 -> SHA-256
+    delete_missing: bool = True
+
+
+class SyncDeleteRequest(BaseModel):
+    """执行同步计划中的删除"""
+    document_ids: List[str]
+
+
+class MultiRetrieveRequest(BaseModel):
+    """多知识库检索请求"""
+    dataset_ids: List[str]
+    query: str
+    top_k: int = 5
+    score_threshold: float = 0.5
+    timeout_ms: Optional[int] = None  # 整体截止时间，默认 RETRIEVE_FANOUT_TIMEOUT_MS
+
+
 class KnowledgeBaseInfo(BaseModel):
     """知识库信息"""
     id: str
@@ -32,27 +89,28 @@ class KnowledgeBaseInfo(BaseModel):
     word_count: int
 
 
-@router.get("/datasets")
-async def list_datasets():
+@router.get("/datasets", dependencies=[Depends(admit_dify(LOW))])
+async def list_datasets(page: int = 1, limit: int = 20):
     """获取知识库列表"""
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(
-                f"{settings.DIFY_API_BASE_URL}/datasets",
-                headers={
-                    "Authorization": f"Bearer {settings.DIFY_API_KEY}",
-                },
-                params={"page": 1, "limit": 20}
+        response = await dify_request(
+            "GET",
+            "/datasets",
+            endpoint="datasets",
+            idempotent=True,
+            params={"page": page, "limit": limit},
+        )
+        
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=response.text
             )
+        
+        return upstream_json(response)
             
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=response.text
-                )
-            
-            return response.json()
-            
+    except CircuitOpenError:
+        raise
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="请求超时")
     except Exception as e:
@@ -60,154 +118,606 @@ async def list_datasets():
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.get("/datasets/{dataset_id}/documents")
+@router.get("/datasets/{dataset_id}/documents", dependencies=[Depends(admit_dify(LOW))])
 async def list_documents(dataset_id: str, page: int = 1, limit: int = 20):
     """获取知识库中的文档列表"""
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(
-                f"{settings.DIFY_API_BASE_URL}/datasets/{dataset_id}/documents",
-                headers={
-                    "Authorization": f"Bearer {settings.DIFY_API_KEY}",
-                },
-                params={"page": page, "limit": limit}
+        response = await dify_request(
+            "GET",
+            f"/datasets/{dataset_id}/documents",
+            endpoint="datasets",
+            idempotent=True,
+            params={"page": page, "limit": limit},
+        )
+        
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=response.text
             )
+        
+        return upstream_json(response)
             
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=response.text
-                )
-            
-            return response.json()
-            
+    except CircuitOpenError:
+        raise
     except Exception as e:
         logger.exception("获取文档列表失败")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/datasets/{dataset_id}/documents/upload")
+async def _stream_listing(
+    path: str,
+    params: Dict[str, Any],
+    scope: str,
+    fields: Optional[List[str]],
+) -> StreamingResponse:
+    """以 NDJSON 输出完整列表，每行一个对象，最后一行为汇总"""
+    listing = Listing(path, params, scope)
+    try:
+        await listing.start()
+    except (CircuitOpenError, HTTPException):
+        raise
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=504, detail="请求超时")
+    except Exception as e:
+        logger.exception("获取列表失败")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    async def generate():
+        started = time.perf_counter()
+        total = 0
+        try:
+            async for items in listing:
+                total += len(items)
+                yield ndjson_lines(project(item, fields) for item in items)
+        except Exception as e:
+            # 已开始输出，错误以独立的一行返回
+            logger.warning(f"列表遍历中断 | {path} | 已输出 {total} 条 | {e}")
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            yield ndjson_line({"event": "error", "detail": detail, "total": total})
+            return
+        
+        yield ndjson_line({
+            "event": "summary",
+            "total": total,
+            "pages": listing.pages,
+            "cached": listing.cached,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+        })
+    
+    return StreamingResponse(generate(), media_type=NDJSON_MEDIA_TYPE)
+
+
+@router.get("/datasets/stream", dependencies=[Depends(admit_dify(LOW))])
+async def stream_datasets(fields: Optional[str] = None):
+    """
+    流式获取全部知识库（NDJSON）
+    
+    服务端遍历所有分页并预取下一页；fields 为逗号分隔的输出字段，* 表示完整对象
+    """
+    return await _stream_listing("/datasets", {}, "", parse_fields(fields, DATASET_FIELDS))
+
+
+@router.get("/datasets/{dataset_id}/documents/stream", dependencies=[Depends(admit_dify(LOW))])
+async def stream_documents(
+    dataset_id: str,
+    fields: Optional[str] = None,
+    keyword: Optional[str] = None,
+):
+    """流式获取知识库中的全部文档（NDJSON）"""
+    params = {"keyword": keyword} if keyword else {}
+    return await _stream_listing(
+        f"/datasets/{dataset_id}/documents",
+        params,
+        dataset_id,
+        parse_fields(fields, DOCUMENT_FIELDS),
+    )
+
+
+@router.get("/datasets/{dataset_id}/indexing/events")
+async def watch_indexing_status(dataset_id: str):
+    """
+    订阅知识库的文档索引进度 (SSE)
+    
+    首个事件为当前未完成批次的快照，之后推送状态变化；
+    同一知识库的所有订阅者共享一个后台轮询任务
+    """
+    watcher = indexing_tracker.subscribe(dataset_id)
+    
+    async def generate():
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        watcher.queue.get(),
+                        timeout=settings.INDEXING_SSE_HEARTBEAT,
+                    )
+                except asyncio.TimeoutError:
+                    if watcher.overflowed:
+                        yield f"data: {json.dumps({'event': 'overflow'})}\n\n"
+                        return
+                    # 心跳注释，防止代理断开空闲连接
+                    yield ": ping\n\n"
+                    continue
+                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+                if watcher.overflowed and watcher.queue.empty():
+                    yield f"data: {json.dumps({'event': 'overflow'})}\n\n"
+                    return
+        finally:
+            indexing_tracker.unsubscribe(dataset_id, watcher)
+    
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+        }
+    )
+
+
+@router.get("/datasets/{dataset_id}/indexing")
+async def get_indexing_status(dataset_id: str):
+    """当前跟踪中的索引批次（与 SSE 快照相同）"""
+    return indexing_tracker.snapshot(dataset_id)
+
+
+@router.get("/indexing/stats")
+async def get_indexing_tracker_stats():
+    """索引状态跟踪统计（上游轮询次数、状态变化数、订阅者数）"""
+    return indexing_tracker.overview()
+
+
+@router.post("/datasets/{dataset_id}/documents/upload", dependencies=[Depends(admit_dify(LOW))])
 async def upload_document(
     dataset_id: str,
     file: UploadFile = File(...),
     indexing_technique: str = Form(default="high_quality"),
+    upload_id: Optional[str] = Form(default=None),
+    local_extract: Optional[bool] = Form(default=None),
 ):
     """
     上传文档到知识库
     
     支持格式: PDF, DOCX, TXT, MD
-    """
-    allowed_types = [
-        "application/pdf",
-        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-        "text/plain",
-        "text/markdown",
-    ]
     
-    if file.content_type not in allowed_types:
+    文件从临时文件按块流式转发给 Dify，不会整体读入内存。
+    提供 upload_id 时可通过 GET /uploads/{upload_id} 查询上传进度
+    
+    local_extract 为 true（默认取 KNOWLEDGE_LOCAL_EXTRACT）时，PDF/DOCX/MD 在本地进程池中
+    提取为纯文本并分段，再通过 create_by_text 提交给 Dify
+    """
+    if file.content_type not in ALLOWED_CONTENT_TYPES:
         raise HTTPException(
             status_code=400,
             detail=f"不支持的文件类型: {file.content_type}"
         )
     
+    # 上传内容已由 multipart 解析器写入临时文件，这里只取大小
+    file.file.seek(0, 2)
+    size = file.file.tell()
+    file.file.seek(0)
+    
+    max_bytes = settings.KNOWLEDGE_UPLOAD_MAX_MB * 1024 * 1024
+    if size > max_bytes:
+        raise HTTPException(
+            status_code=413,
+            detail=f"文件超过大小限制: {settings.KNOWLEDGE_UPLOAD_MAX_MB} MB"
+        )
+    
+    progress = UploadProgress(upload_id or uuid.uuid4().hex, file.filename, size)
+    upload_tracker.register(progress.upload_id, progress)
+    
+    if local_extract is None:
+        local_extract = settings.KNOWLEDGE_LOCAL_EXTRACT
+    
+    # 本地提取的分段，供关键词索引复用；None 表示未在本地提取
+    chunks: Optional[List[str]] = None
     try:
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            # 读取文件内容
-            file_content = await file.read()
-            
-            # 构建 multipart 请求
-            files = {
-                "file": (file.filename, file_content, file.content_type)
-            }
-            
-            data = {
-                "indexing_technique": indexing_technique,
-                "process_rule": {
-                    "mode": "automatic"
-                }
-            }
-            
-            response = await client.post(
-                f"{settings.DIFY_API_BASE_URL}/datasets/{dataset_id}/document/create_by_file",
-                headers={
-                    "Authorization": f"Bearer {settings.DIFY_API_KEY}",
-                },
-                files=files,
-                data={"data": str(data)}
+        if local_extract and extract_service.is_extractable(file.content_type):
+            response, chunks = await extract_service.upload_extracted(
+                dataset_id,
+                filename=file.filename,
+                content_type=file.content_type,
+                fileobj=file.file,
+                size=size,
+                indexing_technique=indexing_technique,
+                progress=progress,
             )
-            
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=response.text
+        else:
+            response = await upload_file_to_dify(
+                dataset_id,
+                filename=file.filename,
+                content_type=file.content_type,
+                reader=file.read,
+                size=size,
+                indexing_technique=indexing_technique,
+                progress=progress,
+            )
+        
+        if response.status_code != 200:
+            progress.finish("failed", response.text)
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=response.text
+            )
+        
+        progress.finish("completed")
+        
+        # 知识库内容已变化，缓存的答案与检索结果可能过期
+        await answer_cache.invalidate()
+        await retrieval_cache.invalidate(dataset_id)
+        await listing_cache.invalidate(dataset_id)
+        
+        result = response.json()
+        document_id = (result.get("document") or {}).get("id")
+        indexing_tracker.track(dataset_id, result.get("batch"), [document_id])
+        if settings.LEXICAL_INDEX_ENABLED and document_id:
+            if chunks is None:
+                await lexical_index.index_upload(
+                    dataset_id, document_id, file.filename, file.content_type, file.file
                 )
+            elif chunks:
+                lexical_index.index_chunks(dataset_id, document_id, file.filename, chunks)
+        
+        return result
             
-            return response.json()
-            
+    except CircuitOpenError:
+        progress.finish("failed", "Dify 熔断中")
+        raise
     except Exception as e:
+        if progress.finished_at is None:
+            progress.finish("failed", str(e))
         logger.exception("上传文档失败")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.delete("/datasets/{dataset_id}/documents/{document_id}")
+async def _ingest_sources(files: List[UploadFile], paths: List[str]) -> List[IngestSource]:
+    """
+    复制上传文件（请求结束后表单文件会被关闭，任务需要持有自己的副本）
+
+    paths 与 files 一一对应时作为源文件相对路径（清单键），否则使用上传文件名
+    """
+    if paths and len(paths) != len(files):
+        raise HTTPException(status_code=400, detail="paths 的数量必须与 files 一致")
+    sources = []
+    for i, upload in enumerate(files):
+        owned = await asyncio.to_thread(take_ownership, upload.file)
+        name = paths[i] if paths else upload.filename or "unnamed"
+        sources.append(IngestSource(name, upload.content_type, owned))
+    return sources
+
+
+@router.post("/datasets/{dataset_id}/documents/bulk", status_code=202)
+async def bulk_upload_documents(
+    dataset_id: str,
+    files: List[UploadFile] = File(...),
+    indexing_technique: str = Form(default="high_quality"),
+    paths: List[str] = Form(default=[]),
+):
+    """
+    批量导入文档
+    
+    接收多个文档或 zip/tar(.gz) 归档，归档在后台流式解包，
+    按支持的文档类型过滤后以有限并发上传到 Dify。
+    立即返回任务信息，通过 GET /jobs/{job_id} 查询每个文件的进度与错误
+    """
+    sources = await _ingest_sources(files, paths)
+    
+    job = start_ingest_job(dataset_id, sources, indexing_technique)
+    logger.info(
+        f"批量导入任务已创建 | {job.job_id} | 数据集: {dataset_id} | "
+        f"文件: {len(sources)} | 归档: {sum(is_archive(s.filename) for s in sources)}"
+    )
+    return job.snapshot()
+
+
+@router.post("/datasets/{dataset_id}/sync", status_code=202)
+async def sync_documents(
+    dataset_id: str,
+    files: List[UploadFile] = File(...),
+    indexing_technique: str = Form(default="high_quality"),
+    delete_missing: bool = Form(default=True),
+    paths: List[str] = Form(default=[]),
+    unchanged: List[str] = Form(default=[]),
+):
+    """
+    增量同步文档
+    
+    与批量导入相同，接收文档或归档；按内容哈希与本地清单比对，
+    只上传新增或变化的文档（变化的文档会删除旧版本），内容相同的记为 unchanged，
+    delete_missing 为 true 时删除源中已不存在的文档。
+    按同步计划只上传部分文件时，需把计划中的 unchanged 一并提交，否则这些文档会被视为已删除
+    """
+    sources = await _ingest_sources(files, paths)
+    
+    job = start_ingest_job(
+        dataset_id,
+        sources,
+        indexing_technique,
+        sync=True,
+        delete_missing=delete_missing,
+        unchanged=unchanged,
+    )
+    logger.info(f"增量同步任务已创建 | {job.job_id} | 数据集: {dataset_id} | 文件: {len(sources)}")
+    return job.snapshot()
+
+
+@router.post("/datasets/{dataset_id}/sync/plan")
+async def plan_document_sync(dataset_id: str, request: SyncPlanRequest):
+    """
+    生成增量同步计划
+    
+    客户端先提交源文件路径与 SHA-256，只需上传返回的 upload 列表中的文件（连同 unchanged 提交到 /sync），
+    delete 中的文档通过 /sync/delete 删除
+    """
+    return await plan_sync(dataset_id, request.files, request.delete_missing)
+
+
+@router.post("/datasets/{dataset_id}/sync/delete", dependencies=[Depends(admit_dify(LOW))])
+async def delete_planned_documents(dataset_id: str, request: SyncDeleteRequest):
+    """执行同步计划中的删除（同时移除清单记录）"""
+    deleted: List[str] = []
+    failed: List[Dict[str, str]] = []
+    for document_id in request.document_ids:
+        try:
+            await document_service.delete_document(dataset_id, document_id)
+            deleted.append(document_id)
+        except DocumentDeleteError as e:
+            failed.append({"document_id": document_id, "error": str(e)})
+        except (httpx.TransportError, CircuitOpenError) as e:
+            failed.append({"document_id": document_id, "error": f"{type(e).__name__}: {e}"})
+    return {"deleted": deleted, "failed": failed}
+
+
+@router.get("/jobs/{job_id}")
+async def get_ingest_job(job_id: str, include_files: bool = True):
+    """查询批量导入任务进度"""
+    snapshot = await ingest_jobs.snapshot(job_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    if not include_files:
+        snapshot.pop("files", None)
+    return snapshot
+
+
+@router.get("/retrieve/cache/stats")
+async def get_retrieval_cache_stats():
+    """检索缓存统计（命中率、节省的上游耗时）"""
+    return retrieval_cache.stats()
+
+
+@router.delete("/retrieve/cache")
+async def clear_retrieval_cache():
+    """清空检索缓存"""
+    await retrieval_cache.clear()
+    return {"status": "cleared"}
+
+
+@router.get("/extract/stats")
+async def get_extract_stats():
+    """本地文本提取统计"""
+    stats = dict(extract_service.stats)
+    if stats["source_bytes"]:
+        stats["bytes_reduction"] = round(1 - stats["text_bytes"] / stats["source_bytes"], 4)
+    return stats
+
+
+@router.get("/uploads/{upload_id}")
+async def get_upload_progress(upload_id: str):
+    """查询文档上传进度"""
+    snapshot = await upload_tracker.snapshot(upload_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail=f"上传记录不存在: {upload_id}")
+    return snapshot
+
+
+@router.delete("/datasets/{dataset_id}/documents/{document_id}", dependencies=[Depends(admit_dify(LOW))])
 async def delete_document(dataset_id: str, document_id: str):
     """删除知识库中的文档"""
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.delete(
-                f"{settings.DIFY_API_BASE_URL}/datasets/{dataset_id}/documents/{document_id}",
-                headers={
-                    "Authorization": f"Bearer {settings.DIFY_API_KEY}",
-                },
-            )
-            
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=response.text
-                )
-            
-            return {"status": "deleted", "document_id": document_id}
+        await document_service.delete_document(dataset_id, document_id)
+        return {"status": "deleted", "document_id": document_id}
             
+    except DocumentDeleteError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except CircuitOpenError:
+        raise
     except Exception as e:
         logger.exception("删除文档失败")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/datasets/{dataset_id}/retrieve")
+async def _retrieve(dataset_id: str, query: str, top_k: int, score_threshold: float) -> Dict[str, Any]:
+    """检索单个知识库（开启 RETRIEVAL_CACHE_ENABLED 时经过检索缓存）"""
+    async def fetch():
+        response = await dify_request(
+            "POST",
+            f"/datasets/{dataset_id}/retrieve",
+            endpoint="retrieve",
+            idempotent=True,
+            hedge=True,
+            json={
+                "query": query,
+                "top_k": top_k,
+                "score_threshold": score_threshold,
+            },
+        )
+        
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=response.text
+            )
+        
+        return response.json()
+    
+    try:
+        if not settings.RETRIEVAL_CACHE_ENABLED:
+            return await fetch()
+        
+        result, hit = await retrieval_cache.get_or_fetch(
+            dataset_id, query, top_k, score_threshold, fetch
+        )
+        if hit:
+            logger.debug(f"检索缓存命中 | 数据集: {dataset_id}")
+        return result
+    except (httpx.TimeoutException, CircuitOpenError) as e:
+        if not _can_fallback(dataset_id):
+            raise
+        logger.warning(f"Dify 检索不可用，使用本地关键词索引 | 数据集: {dataset_id} | {type(e).__name__}")
+        return lexical_index.fallback(dataset_id, query, top_k)
+
+
+def _can_fallback(dataset_id: str) -> bool:
+    return (
+        settings.LEXICAL_INDEX_ENABLED
+        and settings.LEXICAL_FALLBACK_ENABLED
+        and lexical_index.has_dataset(dataset_id)
+    )
+
+
+@router.post("/datasets/{dataset_id}/retrieve", dependencies=[Depends(admit_dify(HIGH))])
 async def retrieve_from_knowledge(
     dataset_id: str,
     query: str,
     top_k: int = 5,
+    score_threshold: float = 0.5,
 ):
     """
     从知识库检索相关内容
     
-    用于 RAG 场景的内容召回
+    用于 RAG 场景的内容召回。检索是只读操作，失败时可重试，
+    开启 DIFY_HEDGE_ENABLED 后对慢请求发出对冲请求。
+    开启 RETRIEVAL_CACHE_ENABLED 时相同检索直接返回缓存结果；
+    Dify 超时或熔断时使用本地关键词索引兜底（响应带 fallback 字段）
     """
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{settings.DIFY_API_BASE_URL}/datasets/{dataset_id}/retrieve",
-                headers={
-                    "Authorization": f"Bearer {settings.DIFY_API_KEY}",
-                    "Content-Type": "application/json",
-                },
-                json={
-                    "query": query,
-                    "top_k": top_k,
-                    "score_threshold": 0.5,
-                }
-            )
-            
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=response.text
-                )
-            
-            return response.json()
+        return await _retrieve(dataset_id, query, top_k, score_threshold)
             
+    except CircuitOpenError:
+        raise
     except Exception as e:
         logger.exception("知识库检索失败")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/retrieve", dependencies=[Depends(admit_dify(HIGH))])
+async def retrieve_from_datasets(request: MultiRetrieveRequest):
+    """
+    同时检索多个知识库，按分数合并为全局 top_k
+    
+    各知识库并发检索，共享同一截止时间；超时或失败的知识库不影响其他结果，
+    此时返回部分结果（partial=true），耗时约等于最慢的单个知识库。
+    超时的知识库若已建立本地关键词索引，则以本地检索结果补充：其分数与 Dify 不可比，
+    只填充 Dify 结果不足 top_k 的名额，且未应用 score_threshold
+    """
+    dataset_ids = list(dict.fromkeys(request.dataset_ids))
+    if not dataset_ids:
+        raise HTTPException(status_code=400, detail="dataset_ids 不能为空")
+    if len(dataset_ids) > settings.RETRIEVE_MAX_DATASETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"单次最多检索 {settings.RETRIEVE_MAX_DATASETS} 个知识库"
+        )
+    
+    timeout = (request.timeout_ms or settings.RETRIEVE_FANOUT_TIMEOUT_MS) / 1000
+    started = time.perf_counter()
+    
+    async def timed(dataset_id: str):
+        result = await _retrieve(dataset_id, request.query, request.top_k, request.score_threshold)
+        return result, time.perf_counter() - started
+    
+    tasks = {
+        asyncio.ensure_future(timed(dataset_id)): dataset_id
+        for dataset_id in dataset_ids
+    }
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    
+    datasets: Dict[str, Dict[str, Any]] = {}
+    candidates: List[Dict[str, Any]] = []
+    # 本地关键词兜底结果的分数与 Dify 不可比，单独排序后排在 Dify 结果之后
+    fallback_candidates: List[Dict[str, Any]] = []
+    circuit_errors: List[CircuitOpenError] = []
+    for task, dataset_id in tasks.items():
+        if task in pending:
+            if _can_fallback(dataset_id):
+                records = lexical_index.fallback(dataset_id, request.query, request.top_k)["records"]
+                fallback_candidates.extend({**record, "dataset_id": dataset_id} for record in records)
+                datasets[dataset_id] = {"status": "fallback", "count": len(records), "score_threshold_applied": False}
+            else:
+                datasets[dataset_id] = {"status": "timeout"}
+            continue
+        
+        error = task.exception()
+        if error is None:
+            result, elapsed = task.result()
+            records = result.get("records") or []
+            # 缓存中的结果为共享对象，复制后再标注来源
+            (fallback_candidates if result.get("fallback") else candidates).extend(
+                {**record, "dataset_id": dataset_id} for record in records
+            )
+            datasets[dataset_id] = {
+                "status": "fallback" if result.get("fallback") else "ok",
+                "count": len(records),
+                "latency_ms": round(elapsed * 1000, 1),
+            }
+            if result.get("fallback"):
+                datasets[dataset_id]["score_threshold_applied"] = False
+        else:
+            if isinstance(error, CircuitOpenError):
+                circuit_errors.append(error)
+            detail = error.detail if isinstance(error, HTTPException) else str(error)
+            datasets[dataset_id] = {"status": "error", "error": detail}
+            logger.warning(f"知识库检索失败 | 数据集: {dataset_id} | {detail}")
+    
+    succeeded = sum(1 for info in datasets.values() if info["status"] == "ok")
+    answered = sum(1 for info in datasets.values() if info["status"] in ("ok", "fallback"))
+    if not answered:
+        if len(circuit_errors) == len(dataset_ids):
+            raise circuit_errors[0]
+        timed_out = any(info["status"] == "timeout" for info in datasets.values())
+        raise HTTPException(
+            status_code=504 if timed_out else 502,
+            detail={"message": "所有知识库检索均未成功", "datasets": datasets},
+        )
+    
+    records = heapq.nlargest(request.top_k, candidates, key=lambda record: record.get("score") or 0.0)
+    if len(records) < request.top_k:
+        records += heapq.nlargest(
+            request.top_k - len(records), fallback_candidates, key=lambda record: record.get("score") or 0.0
+        )
+    return {
+        "query": {"content": request.query},
+        "records": records,
+        "partial": succeeded < len(dataset_ids),
+        "datasets": datasets,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+@router.post("/datasets/{dataset_id}/keyword_search")
+async def keyword_search(
+    dataset_id: str,
+    query: str,
+    top_k: int = 5,
+):
+    """
+    本地关键词检索（BM25）
+    
+    只检索通过本服务上传的文档，不依赖 Dify，适合命令、配置项、错误码等精确关键词查找
+    """
+    if not settings.LEXICAL_INDEX_ENABLED:
+        raise HTTPException(status_code=404, detail="本地关键词索引未启用")
+    return {
+        "query": {"content": query},
+        "records": lexical_index.search(dataset_id, query, top_k),
+    }
+
+
+@router.get("/keyword_search/stats")
+async def get_lexical_index_stats():
+    """本地关键词索引统计"""
+    return lexical_index.stats()
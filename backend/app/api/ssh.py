@@ -2,16 +2,21 @@
 SSH 操作 API
 提供远程服务器连接和命令执行功能
 """
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Header, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, field_validator
-from typing import Optional, List
-import asyncio
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional, List, Tuple
 from datetime import datetime
 from loguru import logger
+import asyncio
 import re
 
 from app.config import settings
-from app.services.ssh_service import SSHService, SSHConnectionError, CommandExecutionError
+from app.responses import NDJSON_MEDIA_TYPE, model_response, ndjson_line, wants_ndjson
+from app.services import tracing
+from app.services.admission import HIGH, LOW, OverloadedError, admission
+from app.services.host_health import HostUnavailableError, host_health
+from app.services.ssh_service import SSHService, SSHConnectionError, CommandExecutionError, CommandCancelledError
 
 router = APIRouter()
 
@@ -74,12 +79,64 @@ class CommandRequest(BaseModel):
         return v
 
 
+async def _wait_disconnect(request: Request):
+    """等待客户端断开（请求体读取完毕后 receive() 只会返回 http.disconnect）"""
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+async def _run_ssh(
+    request: Optional[Request],
+    ssh_service: SSHService,
+    priority: str,
+    func: Callable[..., Any],
+    deadline: float,
+    **kwargs,
+) -> Any:
+    """
+    执行 SSH 操作，与请求生命周期绑定
+    
+    客户端断开、超过 deadline 秒或请求任务被取消（如流式响应的客户端断开）时取消远程命令：
+    发送 TERM 信号并关闭通道，工作线程随即释放。request 为 None 时不监听断开
+    
+    已知不可达的主机在进入线程池之前直接抛出 HostUnavailableError
+    """
+    host_health.check(kwargs["host"], kwargs["port"], probe=False)
+    operation = asyncio.ensure_future(admission.run_ssh(priority, func, **kwargs))
+    watchers = {asyncio.ensure_future(_wait_disconnect(request))} if request is not None else set()
+    try:
+        done, _ = await asyncio.wait(
+            {operation, *watchers}, timeout=deadline, return_when=asyncio.FIRST_COMPLETED
+        )
+    except asyncio.CancelledError:
+        ssh_service.cancel("cancelled")
+        operation.cancel()
+        raise
+    finally:
+        for watcher in watchers:
+            watcher.cancel()
+    
+    if operation in done:
+        return operation.result()
+    reason = "disconnect" if done else "deadline"
+    ssh_service.cancel(reason)
+    operation.cancel()
+    raise CommandCancelledError(reason)
+
+
+def _cancelled_error(e: CommandCancelledError) -> HTTPException:
+    # 客户端已断开时响应不会送达，499 仅用于访问日志与指标
+    return HTTPException(status_code=504 if e.reason == "deadline" else 499, detail=str(e))
+
+
 class SSHTestResponse(BaseModel):
     """SSH 连接测试响应"""
     success: bool
     message: str
     host: str
     latency_ms: Optional[float] = None
+    # 主机处于连接失败退避期，未发起连接
+    host_down: bool = False
 
 
 class CommandResponse(BaseModel):
@@ -90,6 +147,8 @@ class CommandResponse(BaseModel):
     stderr: str
     exit_code: int
     execution_time_ms: float
+    # 分阶段耗时（毫秒）：connect=TCP 连接，auth=握手与认证，exec=发送命令，read=读取输出，total=总耗时
+    timing: Dict[str, float] = {}
     timestamp: str
 
 
@@ -102,10 +161,12 @@ class ServerStatusResponse(BaseModel):
     disk_usage: Optional[str] = None
     load_average: Optional[str] = None
     uptime: Optional[str] = None
+    # 主机处于连接失败退避期，未发起连接
+    host_down: bool = False
 
 
 @router.post("/test-connection", response_model=SSHTestResponse)
-async def test_ssh_connection(request: SSHConnectionRequest):
+async def test_ssh_connection(request: SSHConnectionRequest, http_request: Request):
     """测试 SSH 连接"""
     ssh_service = SSHService()
     
@@ -113,8 +174,12 @@ async def test_ssh_connection(request: SSHConnectionRequest):
         start_time = datetime.now()
         password = request.password or settings.SSH_DEFAULT_PASSWORD
         
-        success = await asyncio.to_thread(
+        success = await _run_ssh(
+            http_request,
+            ssh_service,
+            LOW,
             ssh_service.test_connection,
+            settings.SSH_OPERATION_DEADLINE,
             host=request.host,
             port=request.port,
             username=request.username,
@@ -136,13 +201,56 @@ async def test_ssh_connection(request: SSHConnectionRequest):
             message=str(e),
             host=request.host,
         )
+    except HostUnavailableError as e:
+        return SSHTestResponse(
+            success=False,
+            message=str(e),
+            host=request.host,
+            host_down=True,
+        )
+    except CommandCancelledError as e:
+        raise _cancelled_error(e)
+    except OverloadedError:
+        raise
     except Exception as e:
         logger.exception(f"SSH 连接测试失败: {request.host}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _split_output(text: str, limit: int) -> Iterator[str]:
+    """按行切分输出，每段不超过 limit 个字符（单行超长时再截断）"""
+    start = 0
+    while start < len(text):
+        end = start + limit
+        if end < len(text):
+            newline = text.rfind("\n", start, end)
+            if newline >= start:
+                end = newline + 1
+        yield text[start:end]
+        start = end
+
+
+def _command_ndjson(response: CommandResponse) -> StreamingResponse:
+    """NDJSON 分段输出：首行为命令，随后是 stdout / stderr 片段，最后一行为执行结果"""
+    async def generate():
+        yield ndjson_line({"event": "start", "command": response.command})
+        for stream in ("stdout", "stderr"):
+            for chunk in _split_output(getattr(response, stream), settings.NDJSON_CHUNK_CHARS):
+                yield ndjson_line({"event": stream, "data": chunk})
+        yield ndjson_line({
+            "event": "end",
+            **response.model_dump(include={"success", "exit_code", "execution_time_ms", "timing", "timestamp"}),
+        })
+
+    return StreamingResponse(generate(), media_type=NDJSON_MEDIA_TYPE)
+
+
 @router.post("/execute", response_model=CommandResponse)
-async def execute_command(request: CommandRequest):
+async def execute_command(
+    request: CommandRequest,
+    http_request: Request,
+    accept: Optional[str] = Header(default=None),
+):
     """
     执行远程命令
     
@@ -150,6 +258,10 @@ async def execute_command(request: CommandRequest):
     - 命令需要在白名单中
     - 禁止危险操作字符
     - 所有操作会被记录审计日志
+    
+    请求头 Accept: application/x-ndjson 时以 NDJSON 分段返回输出，客户端可边接收边渲染
+    
+    命令最长执行 timeout 秒（另加 SSH_TIMEOUT 的连接时间），超时或客户端断开时终止远程命令
     """
     ssh_service = SSHService()
     
@@ -157,8 +269,12 @@ async def execute_command(request: CommandRequest):
         password = request.password or settings.SSH_DEFAULT_PASSWORD
         start_time = datetime.now()
         
-        result = await asyncio.to_thread(
+        result = await _run_ssh(
+            http_request,
+            ssh_service,
+            HIGH,
             ssh_service.execute_command,
+            request.timeout + settings.SSH_TIMEOUT,
             host=request.host,
             port=request.port,
             username=request.username,
@@ -168,6 +284,9 @@ async def execute_command(request: CommandRequest):
         )
         
         execution_time = (datetime.now() - start_time).total_seconds() * 1000
+        trace = tracing.current()
+        timing = trace.breakdown() if trace else {}
+        timing["total"] = round(execution_time, 2)
         
         # 记录审计日志
         logger.info(
@@ -176,35 +295,51 @@ async def execute_command(request: CommandRequest):
             f"Exit Code: {result['exit_code']}"
         )
         
-        return CommandResponse(
+        response = CommandResponse(
             success=result['exit_code'] == 0,
             command=request.command,
             stdout=result['stdout'],
             stderr=result['stderr'],
             exit_code=result['exit_code'],
             execution_time_ms=execution_time,
+            timing=timing,
             timestamp=datetime.now().isoformat(),
         )
+        if wants_ndjson(accept):
+            return _command_ndjson(response)
+        # 输出可能有数 MB，直接由 pydantic-core 序列化
+        return model_response(response)
         
     except CommandExecutionError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except SSHConnectionError as e:
         raise HTTPException(status_code=503, detail=str(e))
+    except HostUnavailableError:
+        raise
+    except CommandCancelledError as e:
+        logger.warning(f"命令已取消 | Host: {request.host} | Command: {request.command} | 原因: {e.reason}")
+        raise _cancelled_error(e)
+    except OverloadedError:
+        raise
     except Exception as e:
         logger.exception(f"命令执行失败: {request.command}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/server-status", response_model=ServerStatusResponse)
-async def get_server_status(request: SSHConnectionRequest):
+async def get_server_status(request: SSHConnectionRequest, http_request: Request):
     """获取服务器状态摘要"""
     ssh_service = SSHService()
     
     try:
         password = request.password or settings.SSH_DEFAULT_PASSWORD
         
-        status = await asyncio.to_thread(
+        status = await _run_ssh(
+            http_request,
+            ssh_service,
+            LOW,
             ssh_service.get_server_status,
+            settings.SSH_OPERATION_DEADLINE,
             host=request.host,
             port=request.port,
             username=request.username,
@@ -222,24 +357,84 @@ async def get_server_status(request: SSHConnectionRequest):
             host=request.host,
             online=False,
         )
+    except HostUnavailableError:
+        return ServerStatusResponse(
+            host=request.host,
+            online=False,
+            host_down=True,
+        )
+    except CommandCancelledError as e:
+        raise _cancelled_error(e)
+    except OverloadedError:
+        raise
     except Exception as e:
         logger.exception(f"获取服务器状态失败: {request.host}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _run_diagnostics(
+    request: Optional[Request],
+    ssh_service: SSHService,
+    commands: Dict[str, str],
+    host: str,
+    port: int,
+    username: str,
+    password: Optional[str],
+) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """依次执行诊断命令，逐项返回结果"""
+    for check_name, command in commands.items():
+        try:
+            result = await _run_ssh(
+                request,
+                ssh_service,
+                LOW,
+                ssh_service.execute_command,
+                30 + settings.SSH_TIMEOUT,
+                host=host,
+                port=port,
+                username=username,
+                password=password,
+                command=command,
+                timeout=30,
+            )
+            yield check_name, {
+                "success": result['exit_code'] == 0,
+                "output": result['stdout'] or result['stderr'],
+            }
+        except (OverloadedError, CommandCancelledError):
+            raise
+        except HostUnavailableError as e:
+            # 诊断过程中主机进入退避期：已完成的检查照常返回，其余检查标记为不可达
+            yield check_name, {
+                "success": False,
+                "output": str(e),
+                "host_down": True,
+            }
+        except Exception as e:
+            yield check_name, {
+                "success": False,
+                "output": str(e),
+            }
+
+
 @router.post("/diagnose")
 async def diagnose_service(
+    http_request: Request,
     host: str,
     service_name: str,
     port: int = 22,
     username: str = "root",
     password: Optional[str] = None,
+    accept: Optional[str] = Header(default=None),
 ):
     """
     诊断指定服务状态
     
-    执行一系列诊断命令检查服务健康状况
+    执行一系列诊断命令检查服务健康状况。
+    请求头 Accept: application/x-ndjson 时每完成一项输出一行，最后一行为汇总
     """
+    # 请求开始前主机已处于退避期时直接返回 503
+    host_health.check(host, port, probe=False)
     ssh_service = SSHService()
     password = password or settings.SSH_DEFAULT_PASSWORD
     
@@ -248,30 +443,32 @@ async def diagnose_service(
         "recent_logs": f"journalctl -u {service_name} -n 50 --no-pager",
         "process_check": f"ps aux | grep {service_name}",
     }
+    streaming = wants_ndjson(accept)
+    # 流式输出时由 StreamingResponse 监听断开并取消生成器
+    checks = _run_diagnostics(
+        None if streaming else http_request, ssh_service, diagnose_commands, host, port, username, password
+    )
     
-    results = {}
+    if streaming:
+        async def generate():
+            try:
+                async for check_name, result in checks:
+                    yield ndjson_line({"event": "check", "name": check_name, **result})
+            except (OverloadedError, CommandCancelledError) as e:
+                # 已开始输出，错误以独立的一行返回
+                yield ndjson_line({"event": "error", "detail": str(e)})
+                return
+            yield ndjson_line({
+                "event": "summary",
+                "host": host,
+                "service": service_name,
+                "timestamp": datetime.now().isoformat(),
+            })
+        
+        return StreamingResponse(generate(), media_type=NDJSON_MEDIA_TYPE)
     
     try:
-        for check_name, command in diagnose_commands.items():
-            try:
-                result = await asyncio.to_thread(
-                    ssh_service.execute_command,
-                    host=host,
-                    port=port,
-                    username=username,
-                    password=password,
-                    command=command,
-                    timeout=30,
-                )
-                results[check_name] = {
-                    "success": result['exit_code'] == 0,
-                    "output": result['stdout'] or result['stderr'],
-                }
-            except Exception as e:
-                results[check_name] = {
-                    "success": False,
-                    "output": str(e),
-                }
+        results = {check_name: result async for check_name, result in checks}
         
         return {
             "host": host,
@@ -280,6 +477,10 @@ async def diagnose_service(
             "diagnostics": results,
         }
         
+    except CommandCancelledError as e:
+        raise _cancelled_error(e)
+    except OverloadedError:
+        raise
     except Exception as e:
         logger.exception(f"服务诊断失败: {service_name}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -19,14 +19,75 @@ class Settings(BaseSettings):
     DIFY_API_BASE_URL: str = "http://localhost/v1"
     DIFY_API_KEY: str = ""
     DIFY_APP_ID: str = ""
+    DIFY_STOP_ON_DISCONNECT: bool = True  # 客户端断开时调用 Dify 停止生成接口
+    
+    # Dify 上游容错配置
+    DIFY_BREAKER_FAILURE_THRESHOLD: int = 5  # 连续失败多少次后熔断
+    DIFY_BREAKER_RECOVERY_SECONDS: float = 30.0  # 熔断后多久进入半开探测
+    DIFY_RETRY_ATTEMPTS: int = 2  # 幂等请求的额外重试次数
+    DIFY_RETRY_BACKOFF: float = 0.2  # 重试退避基数（秒），实际等待带随机抖动
+    DIFY_HEDGE_ENABLED: bool = False  # 知识库检索对冲请求
+    DIFY_HEDGE_DELAY_MS: int = 300  # 首个请求超过该时间未返回时发出对冲请求
+    
+    # 答案缓存配置（仅缓存新会话的首轮问答，默认关闭）
+    ANSWER_CACHE_ENABLED: bool = False
+    ANSWER_CACHE_TTL: int = 600  # 秒
+    ANSWER_CACHE_MAX_ENTRIES: int = 512
+    
+    # 知识库检索缓存配置
+    RETRIEVAL_CACHE_ENABLED: bool = True
+    RETRIEVAL_CACHE_TTL: int = 300  # 秒
+    RETRIEVAL_CACHE_MAX_ENTRIES: int = 1024
+    RETRIEVE_FANOUT_TIMEOUT_MS: int = 3000  # 多知识库检索的整体截止时间
+    RETRIEVE_MAX_DATASETS: int = 20  # 单次多知识库检索的最大数据集数
+    
+    # 本地关键词索引配置（BM25，Dify 检索超时或熔断时兜底）
+    LEXICAL_INDEX_ENABLED: bool = True
+    LEXICAL_INDEX_DIR: str = "./data/lexical_index"
+    LEXICAL_INDEX_FLUSH_SECONDS: float = 5.0  # 变更后延迟落盘时间
+    LEXICAL_FALLBACK_ENABLED: bool = True
+    
+    # WebSocket 对话配置
+    WS_MAX_STREAMS: int = 8  # 单个连接最大并发会话流
+    WS_STREAM_WINDOW: int = 256  # 每个会话流的初始发送窗口（帧数），客户端通过 ack 补充
+    WS_OUTBOX_SIZE: int = 512  # 单个连接的出站帧队列长度
+    
+    # 知识库配置
+    KNOWLEDGE_UPLOAD_MAX_MB: int = 512  # 单个上传文件大小上限
+    LISTING_PAGE_SIZE: int = 100  # 流式列表每次向 Dify 请求的条数（上限 100）
+    LISTING_MAX_PAGES: int = 500  # 流式列表最多遍历的页数
+    LISTING_CACHE_TTL: int = 30  # 完整列表缓存时间（秒）
+    INDEXING_TRACKER_ENABLED: bool = True  # 上传后在后台跟踪 Dify 索引进度
+    INDEXING_POLL_MIN_INTERVAL: float = 1.0  # 索引状态轮询最短间隔（秒）
+    INDEXING_POLL_MAX_INTERVAL: float = 15.0  # 无变化或出错时退避的最长间隔（秒）
+    INDEXING_TRACK_TIMEOUT: int = 3600  # 批次最长跟踪时间（秒）
+    INDEXING_SSE_HEARTBEAT: float = 15.0  # SSE 心跳间隔（秒）
+    KNOWLEDGE_INGEST_CONCURRENCY: int = 4  # 批量导入时并发上传到 Dify 的文件数
+    KNOWLEDGE_LOCAL_EXTRACT: bool = False  # 上传前在本地提取 PDF/DOCX/MD 文本
+    EXTRACT_WORKERS: int = 0  # 提取进程数，0 表示 CPU 核数
+    EXTRACT_PDF_PAGES_PER_TASK: int = 20  # PDF 每个并行任务处理的页数
+    EXTRACT_CHUNK_CHARS: int = 800  # 本地分段的最大字符数
+    EXTRACT_CHUNK_MAX_TOKENS: int = 1000  # 提交给 Dify 的分段 max_tokens
+    
+    # 批量评测配置
+    BATCH_MAX_REQUESTS: int = 1000
+    BATCH_MAX_CONCURRENCY: int = 16
     
     # SSH 配置
     SSH_DEFAULT_USERNAME: str = "root"
     SSH_DEFAULT_PASSWORD: str = ""
     SSH_DEFAULT_PORT: int = 22
     SSH_TIMEOUT: int = 30
+    SSH_OPERATION_DEADLINE: int = 120  # 连接测试、服务器状态的总时长上限（秒），超过后取消远程命令
     SSH_ALLOWED_IPS: List[str] = []  # IP 白名单，空表示不限制
     
+    # SSH 主机健康：按历史连接耗时调整连接超时，连接失败的主机在退避期内直接返回失败
+    SSH_HOST_HEALTH_ENABLED: bool = True
+    SSH_CONNECT_TIMEOUT_MIN: float = 2.0  # 自适应连接超时下限（秒），上限为 SSH_TIMEOUT
+    SSH_CONNECT_TIMEOUT_FACTOR: float = 10.0  # 连接超时 = 连接耗时均值 × 该倍数
+    SSH_HOST_BACKOFF_BASE: float = 2.0  # 首次失败后的退避时间（秒），连续失败时翻倍
+    SSH_HOST_BACKOFF_MAX: float = 60.0  # 退避时间上限（秒）
+    
     # 命令白名单
     ALLOWED_COMMANDS: List[str] = [
         # kubectl 命令
@@ -54,11 +115,43 @@ class Settings(BaseSettings):
         "journalctl",
     ]
     
+    # 准入控制配置（过载时拒绝低优先级请求并报告未就绪）
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_MAX_SSH: int = 64  # 同时进行的 SSH 操作上限，达到后拒绝所有 SSH 请求
+    ADMISSION_MAX_DIFY_STREAMS: int = 200  # 同时进行的 Dify 流式会话上限
+    ADMISSION_MAX_DIFY_REQUESTS: int = 200  # 同时进行的 Dify 非流式代理请求（对话、检索、知识库）上限
+    ADMISSION_SHED_RATIO: float = 0.8  # 占用达到上限的该比例时视为过载
+    ADMISSION_MAX_QUEUE_WAIT_MS: int = 2000  # 线程池排队时间超过该值时视为过载
+    ADMISSION_RETRY_AFTER: int = 5  # 拒绝时返回的 Retry-After（秒）
+    
+    # 请求追踪配置
+    TRACE_SERVER_TIMING: bool = True  # 响应头附带 Server-Timing 分阶段耗时
+    TRACE_LOG_ENABLED: bool = False  # 请求结束时输出分阶段耗时日志
+    TRACE_LOG_SLOW_MS: int = 0  # 只记录耗时不低于该值的请求
+    
+    # 管理接口配置（剖析等），未设置令牌时管理接口不可用
+    ADMIN_TOKEN: str = ""
+    PROFILE_MAX_SECONDS: int = 60  # 进程剖析最长时间
+    PROFILE_INTERVAL_MS: float = 10.0  # 默认采样间隔
+    
+    # 响应压缩配置（按 Accept-Encoding 协商 br / gzip，br 需安装 brotli）
+    COMPRESSION_ENABLED: bool = True
+    COMPRESSION_MIN_BYTES: int = 1024  # 小于该大小的一次性响应不压缩
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_QUALITY: int = 4
+    NDJSON_CHUNK_CHARS: int = 65536  # NDJSON 模式下命令输出每行的最大字符数
+    
+    # 启动配置
+    STARTUP_WARMUP: bool = True  # 端口打开后在后台预热（paramiko、关键词索引、OpenAPI），否则启动时同步加载关键词索引
+    
     # 数据库配置
     DATABASE_URL: str = "sqlite+aiosqlite:///./ops_assistant.db"
+    CHAT_HISTORY_MIRROR: bool = True  # 在本地数据库镜像对话历史
     
-    # Redis 配置
+    # Redis 配置（多 worker 部署时共享答案 / 检索 / 列表缓存与任务进度；为空时保存在进程内）
     REDIS_URL: Optional[str] = None
+    REDIS_KEY_PREFIX: str = "ops-assistant"
+    REDIS_SOCKET_TIMEOUT: float = 1.0  # 超时后缓存按未命中处理
     
     # JWT 配置
     SECRET_KEY: str = "your-secret-key-change-in-production"
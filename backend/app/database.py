@@ -0,0 +1,55 @@
+"""
+数据库模块
+基于 SQLAlchemy 异步引擎，使用 DATABASE_URL 配置（默认 SQLite）
+"""
+from typing import Optional
+from sqlalchemy import MetaData, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from loguru import logger
+
+from app.config import settings
+
+# 所有本地表共享同一个 MetaData，由各服务模块注册表结构
+metadata = MetaData()
+
+_engine: Optional[AsyncEngine] = None
+
+
+def _enable_sqlite_pragmas(dbapi_connection, connection_record):
+    """SQLite 启用 WAL，读写互不阻塞"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+def get_engine() -> AsyncEngine:
+    """获取数据库引擎单例"""
+    global _engine
+    if _engine is None:
+        _engine = create_async_engine(settings.DATABASE_URL)
+        if _engine.dialect.name == "sqlite":
+            event.listen(_engine.sync_engine, "connect", _enable_sqlite_pragmas)
+    return _engine
+
+
+async def init_db():
+    """创建本地表（已存在则跳过）"""
+    try:
+        async with get_engine().begin() as conn:
+            await conn.run_sync(metadata.create_all)
+    except OperationalError:
+        # 多 worker 同时启动时，其他 worker 可能在检查与建表之间建好了表，重试时会跳过
+        async with get_engine().begin() as conn:
+            await conn.run_sync(metadata.create_all)
+    logger.info("本地数据库已就绪")
+
+
+async def close_db():
+    """释放数据库连接"""
+    global _engine
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = None
@@ -1,20 +1,62 @@
 """
 智能运维助手 - 后端服务入口
 """
-from fastapi import FastAPI
+import time
+
+_import_started = time.perf_counter()
+
+import asyncio
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
 from loguru import logger
 
 from app.config import settings
-from app.api import chat, ssh, health, knowledge
+from app.database import init_db, close_db
+from app.services.admission import OverloadedError
+from app.services.dify_client import CircuitOpenError, close_client
+from app.services.extract_service import shutdown_pool
+from app.services.host_health import HostUnavailableError
+from app.services.indexing_tracker import indexing_tracker
+from app.services.lexical_index import lexical_index
+from app.services import shared_state
+from app.api import admin, chat, ssh, health, knowledge
+from app.middleware import CompressionMiddleware, MetricsMiddleware, ProfilingMiddleware, TracingMiddleware
+from app.responses import FastJSONResponse
+from app.startup import import_module_in_thread, startup_report, warm_up
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
     logger.info(f"🚀 启动 {settings.APP_NAME} v{settings.APP_VERSION}")
+    with startup_report.phase("init_db"):
+        await init_db()
+
+    warmup_steps = [("paramiko", import_module_in_thread("paramiko"))]
+    if settings.LEXICAL_INDEX_ENABLED:
+        warmup_steps.append(("lexical_index", lexical_index.load))
+    warmup_steps.append(("openapi", lambda: asyncio.to_thread(app.openapi)))
+
+    warmup_task = None
+    if settings.STARTUP_WARMUP:
+        # 生命周期让出后 uvicorn 才开始监听端口，预热放到后台，不推迟 /health 首次响应
+        warmup_task = asyncio.create_task(warm_up(warmup_steps))
+    elif settings.LEXICAL_INDEX_ENABLED:
+        with startup_report.phase("lexical_index"):
+            await lexical_index.load()
+    startup_report.mark_ready()
     yield
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+    indexing_tracker.close()
+    await lexical_index.close()
+    shutdown_pool()
+    await close_client()
+    await shared_state.close()
+    await close_db()
     logger.info("👋 关闭应用")
 
 
@@ -23,6 +65,7 @@ app = FastAPI(
     version=settings.APP_VERSION,
     description="基于 Dify 的智能运维助手 API",
     lifespan=lifespan,
+    default_response_class=FastJSONResponse,
 )
 
 # CORS 中间件
@@ -34,11 +77,52 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 响应压缩（在追踪与指标之内，耗时计入请求）
+app.add_middleware(CompressionMiddleware)
+
+# 请求剖析、追踪与指标中间件（最外层，耗时包含 CORS 处理）
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(TracingMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_handler(request: Request, exc: CircuitOpenError):
+    """Dify 熔断时快速返回 503，提示客户端稍后重试"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(OverloadedError)
+async def overloaded_handler(request: Request, exc: OverloadedError):
+    """过载时拒绝请求，提示客户端稍后重试"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+@app.exception_handler(HostUnavailableError)
+async def host_unavailable_handler(request: Request, exc: HostUnavailableError):
+    """SSH 主机处于连接失败退避期，未发起连接直接返回"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc), "host_down": True, "retry_after": exc.retry_after},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
 # 注册路由
 app.include_router(health.router, tags=["健康检查"])
 app.include_router(chat.router, prefix="/api/chat", tags=["对话"])
 app.include_router(ssh.router, prefix="/api/ssh", tags=["SSH 操作"])
 app.include_router(knowledge.router, prefix="/api/knowledge", tags=["知识库"])
+app.include_router(admin.router, prefix="/api/admin", tags=["管理"])
+
+startup_report.record("import_app", (time.perf_counter() - _import_started) * 1000)
 
 
 @app.get("/")
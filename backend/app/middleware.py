@@ -0,0 +1,243 @@
+"""
+ASGI 中间件
+直接实现 ASGI 接口（不使用 BaseHTTPMiddleware），不缓冲响应体，
+流式响应与客户端断开检测不受影响
+"""
+import asyncio
+import time
+import zlib
+from typing import Optional
+
+from loguru import logger
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import settings
+from app.services import tracing
+from app.services.metrics import HTTP_COMPRESSION_BYTES, HTTP_IN_FLIGHT, HTTP_LATENCY, HTTP_REQUESTS
+from app.services.profiler import profiler
+
+try:
+    import brotli
+except ImportError:  # 可选依赖，未安装时只提供 gzip
+    brotli = None
+
+# 可压缩的内容类型（另外包括 text/*）；SSE 事件小且需要逐条送达，不压缩
+_COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "application/javascript", "application/xml")
+# 超过该大小的响应体在线程中压缩，避免阻塞事件循环
+_COMPRESS_IN_THREAD_BYTES = 256 * 1024
+
+
+class MetricsMiddleware:
+    """按路由模板记录 HTTP 请求数、耗时与处理中请求数"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        with HTTP_IN_FLIGHT.track():
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                # 路由匹配后 scope 中带有 route，使用路由模板作为标签，避免路径参数导致标签膨胀
+                route = scope.get("route")
+                path = getattr(route, "path_format", None) or getattr(route, "path", None) or "unmatched"
+                method = scope["method"]
+                HTTP_LATENCY.observe(time.perf_counter() - started, method, path)
+                HTTP_REQUESTS.labels(method, path, str(status)).inc()
+
+
+class TracingMiddleware:
+    """
+    为每个请求建立 Trace，响应头附带 Server-Timing 分阶段耗时
+
+    流式响应的响应头在首个数据块之前发出，只包含此前完成的阶段；
+    完整记录可通过 TRACE_LOG_ENABLED 输出到结构化日志
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace, token = tracing.start()
+        status = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if settings.TRACE_SERVER_TIMING:
+                    headers = MutableHeaders(scope=message)
+                    headers.append("Server-Timing", trace.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            tracing.finish(token)
+            if settings.TRACE_LOG_ENABLED and trace.elapsed_ms() >= settings.TRACE_LOG_SLOW_MS:
+                record = trace.to_record()
+                logger.bind(trace=record).info(
+                    f"请求追踪 | {scope['method']} {scope['path']} | 状态: {status} | "
+                    f"耗时: {record['total_ms']}ms | {trace.breakdown()}"
+                )
+
+
+class ProfilingMiddleware:
+    """请求剖析进行中时登记匹配的请求；未剖析时直接透传"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        session = profiler.session
+        label = session.claim(scope) if session is not None and scope["type"] == "http" else None
+        if label is None:
+            await self.app(scope, receive, send)
+            return
+
+        token = session.enter(label)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            session.exit(token)
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """按 Accept-Encoding 选择压缩编码，br 优先（需安装 brotli），q=0 表示不接受"""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in ("br", "gzip") if brotli is not None else ("gzip",):
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def _compressible(headers: Headers) -> bool:
+    if "content-encoding" in headers:
+        return False
+    content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type == "text/event-stream":
+        return False
+    return content_type.startswith("text/") or content_type in _COMPRESSIBLE_TYPES
+
+
+class _Compressor:
+    """单个响应的压缩流；非最后一块时同步刷新，已输出的数据客户端可立即解压"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+        else:
+            self._zlib = zlib.compressobj(settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        if self.encoding == "br":
+            output = self._brotli.process(data) + (self._brotli.finish() if final else self._brotli.flush())
+        else:
+            output = self._zlib.compress(data) + self._zlib.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+        HTTP_COMPRESSION_BYTES.labels(self.encoding, "in").inc(len(data))
+        HTTP_COMPRESSION_BYTES.labels(self.encoding, "out").inc(len(output))
+        return output
+
+
+class CompressionMiddleware:
+    """
+    按 Accept-Encoding 压缩响应（br 需安装 brotli，否则 gzip）
+
+    - 一次性响应：响应体不小于 COMPRESSION_MIN_BYTES 时压缩，较大的响应体在线程中压缩
+    - 流式响应（NDJSON 等）：逐块压缩并同步刷新，客户端仍可逐行接收
+    - SSE、已编码或不可压缩类型的响应直接透传
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        encoding = None
+        if scope["type"] == "http" and settings.COMPRESSION_ENABLED:
+            encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        # None: 尚未收到响应体；False: 透传
+        compressor = None
+
+        async def compress(data: bytes, final: bool) -> bytes:
+            if len(data) < _COMPRESS_IN_THREAD_BYTES:
+                return compressor.compress(data, final)
+            started = time.perf_counter()
+            output = await asyncio.to_thread(compressor.compress, data, final)
+            tracing.record("compress", started, time.perf_counter() - started)
+            return output
+
+        async def send_wrapper(message: Message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                # 等首个响应体决定是否压缩，再发出响应头
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compressor is None:
+                headers = MutableHeaders(scope=start)
+                if not _compressible(headers) or (not more_body and len(body) < settings.COMPRESSION_MIN_BYTES):
+                    compressor = False
+                    await send(start)
+                    await send(message)
+                    return
+                compressor = _Compressor(encoding)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if more_body:
+                    del headers["Content-Length"]
+                    await send(start)
+                else:
+                    body = await compress(body, final=True)
+                    headers["Content-Length"] = str(len(body))
+                    await send(start)
+                    await send({"type": "http.response.body", "body": body, "more_body": False})
+                    return
+            elif compressor is False:
+                await send(message)
+                return
+
+            await send({"type": "http.response.body", "body": await compress(body, not more_body), "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
+        if start is not None and compressor is None:
+            await send(start)
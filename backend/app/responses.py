@@ -0,0 +1,58 @@
+"""
+响应序列化
+
+- 安装 orjson 时用它序列化 JSON（应用默认响应类），未安装时回退到标准库 json
+- 大模型（SSH 命令输出）由 pydantic-core 直接输出 JSON，跳过 jsonable_encoder 与二次校验
+- Dify 列表等代理接口原样转发上游响应体，不再解析后重新序列化
+- NDJSON：每行一个 JSON 对象，客户端可边接收边渲染
+"""
+import json
+from typing import Any, Iterable
+
+import httpx
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+from pydantic_core import to_json
+
+try:
+    import orjson
+except ImportError:  # 可选依赖
+    orjson = None
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def ndjson_line(content: Any) -> bytes:
+    return dumps(content) + b"\n"
+
+
+def ndjson_lines(items: Iterable[Any]) -> bytes:
+    return b"".join(ndjson_line(item) for item in items)
+
+
+def wants_ndjson(accept: str) -> bool:
+    """客户端在 Accept 中声明 application/x-ndjson 时使用 NDJSON 分段输出"""
+    return NDJSON_MEDIA_TYPE in (accept or "")
+
+
+class FastJSONResponse(JSONResponse):
+    """使用 orjson（若已安装）序列化的 JSONResponse"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def model_response(model: BaseModel, status_code: int = 200) -> Response:
+    """由 pydantic-core 直接序列化模型"""
+    return Response(to_json(model), status_code=status_code, media_type="application/json")
+
+
+def upstream_json(response: httpx.Response) -> Response:
+    """原样转发上游 JSON 响应体"""
+    return Response(response.content, status_code=response.status_code, media_type="application/json")
@@ -0,0 +1,205 @@
+"""
+准入控制
+跟踪进行中的 SSH 操作、Dify 流式会话、Dify 非流式代理请求与线程池排队时间：
+- 占用达到上限的 ADMISSION_SHED_RATIO 或排队时间超过阈值时视为过载，拒绝低优先级请求，/ready 返回未就绪
+- 占用达到上限时拒绝所有请求
+被拒绝的请求返回 503 与 Retry-After
+
+调用方被取消后，SSH 操作仍计入占用直至工作线程真正返回（孤儿操作），释放时记录回收耗时
+"""
+import asyncio
+import itertools
+import time
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Callable, Dict, Iterator
+
+from loguru import logger
+
+from app.config import settings
+from app.services.metrics import ADMISSION_REJECTED, SSH_ORPHANED, SSH_ORPHANS_RECLAIMED, SSH_RECLAIM_LATENCY
+
+HIGH = "high"
+LOW = "low"
+
+# 排队时间均值超过该时长未更新时视为过期（没有新的 SSH 操作）
+_WAIT_STALE_SECONDS = 10.0
+_WAIT_EWMA_ALPHA = 0.2
+
+
+class OverloadedError(Exception):
+    """服务过载，请求被拒绝"""
+
+    def __init__(self, resource: str, retry_after: int):
+        self.resource = resource
+        self.retry_after = retry_after
+        super().__init__(f"服务繁忙（{resource}），请 {retry_after} 秒后重试")
+
+
+class AdmissionController:
+    """准入控制器"""
+
+    def __init__(self):
+        self.ssh_in_flight = 0
+        self.streams_in_flight = 0
+        self.dify_in_flight = 0
+        # 已提交到线程池但尚未开始执行的 SSH 操作：序号 -> 提交时间
+        self._waiting: Dict[int, float] = {}
+        self._sequence = itertools.count()
+        self._wait_ewma = 0.0
+        self._wait_updated = 0.0
+        # 调用方已取消、线程仍在执行的 SSH 操作 -> 取消时间
+        self._orphans: Dict[asyncio.Future, float] = {}
+        self.stats = {"admitted": 0, "shed_low": 0, "shed_all": 0, "orphans_reclaimed": 0}
+
+    def queue_wait_ms(self) -> float:
+        """线程池排队时间：近期均值与当前最久排队者取较大值"""
+        now = time.perf_counter()
+        recent = self._wait_ewma if now - self._wait_updated < _WAIT_STALE_SECONDS else 0.0
+        # 工作线程会并发删除条目，先复制再遍历
+        oldest = min(list(self._waiting.values()), default=now)
+        return max(recent, now - oldest) * 1000
+
+    def pressure(self) -> Dict[str, bool]:
+        """各项指标是否超过过载阈值"""
+        ratio = settings.ADMISSION_SHED_RATIO
+        return {
+            "ssh": self.ssh_in_flight >= settings.ADMISSION_MAX_SSH * ratio,
+            "dify_streams": self.streams_in_flight >= settings.ADMISSION_MAX_DIFY_STREAMS * ratio,
+            "dify_requests": self.dify_in_flight >= settings.ADMISSION_MAX_DIFY_REQUESTS * ratio,
+            "queue_wait": self.queue_wait_ms() >= settings.ADMISSION_MAX_QUEUE_WAIT_MS,
+        }
+
+    def overloaded(self) -> bool:
+        return settings.ADMISSION_ENABLED and any(self.pressure().values())
+
+    def _admit(self, resource: str, in_flight: int, limit: int, priority: str):
+        if not settings.ADMISSION_ENABLED:
+            return
+        if limit and in_flight >= limit:
+            self._reject(resource, priority, "shed_all")
+        if priority == LOW and self.overloaded():
+            self._reject(resource, priority, "shed_low")
+        self.stats["admitted"] += 1
+
+    def _reject(self, resource: str, priority: str, kind: str):
+        self.stats[kind] += 1
+        ADMISSION_REJECTED.labels(resource, priority).inc()
+        logger.warning(
+            f"请求被拒绝 | 资源: {resource} | 优先级: {priority} | SSH: {self.ssh_in_flight} | "
+            f"Dify 流: {self.streams_in_flight} | Dify 请求: {self.dify_in_flight} | 排队: {self.queue_wait_ms():.0f}ms"
+        )
+        raise OverloadedError(resource, settings.ADMISSION_RETRY_AFTER)
+
+    async def run_ssh(self, priority: str, func: Callable[..., Any], **kwargs) -> Any:
+        """
+        准入检查后在线程池中执行 SSH 操作，并记录排队时间
+        
+        调用方被取消时立即抛出 CancelledError，线程中的操作需由调用方中断（SSHService.cancel），
+        返回前仍计入 ssh_in_flight
+        """
+        self._admit("ssh", self.ssh_in_flight, settings.ADMISSION_MAX_SSH, priority)
+        key = next(self._sequence)
+        self._waiting[key] = time.perf_counter()
+
+        def run():
+            submitted = self._waiting.pop(key, None)
+            if submitted is not None:
+                now = time.perf_counter()
+                self._wait_ewma += _WAIT_EWMA_ALPHA * ((now - submitted) - self._wait_ewma)
+                self._wait_updated = now
+            return func(**kwargs)
+
+        self.ssh_in_flight += 1
+        future = asyncio.ensure_future(asyncio.to_thread(run))
+        future.add_done_callback(self._ssh_finished)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if not future.done():
+                self._orphans[future] = time.perf_counter()
+                SSH_ORPHANED.inc()
+            raise
+        finally:
+            self._waiting.pop(key, None)
+
+    def _ssh_finished(self, future: asyncio.Future):
+        self.ssh_in_flight -= 1
+        cancelled_at = self._orphans.pop(future, None)
+        if cancelled_at is not None:
+            SSH_ORPHANED.dec()
+            SSH_ORPHANS_RECLAIMED.inc()
+            SSH_RECLAIM_LATENCY.observe(time.perf_counter() - cancelled_at)
+            self.stats["orphans_reclaimed"] += 1
+            # 结果已无人读取，取出异常避免 "exception was never retrieved" 警告
+            if not future.cancelled():
+                future.exception()
+
+    def admit(self, resource: str, priority: str):
+        """没有独立上限的请求（如批量评测），只在过载时拒绝低优先级"""
+        self._admit(resource, 0, 0, priority)
+
+    def admit_stream(self, priority: str) -> "StreamSlot":
+        """
+        Dify 流式会话开始前检查并占用名额（在返回响应头之前调用，才能返回 503）
+
+        调用方必须在会话结束时调用返回值的 release()，包括生成器或任务从未开始运行的情况
+        """
+        self._admit("dify_streams", self.streams_in_flight, settings.ADMISSION_MAX_DIFY_STREAMS, priority)
+        self.streams_in_flight += 1
+        return StreamSlot(self)
+
+    def _release_stream(self):
+        self.streams_in_flight -= 1
+
+    @contextmanager
+    def track_dify(self, priority: str) -> Iterator[None]:
+        """Dify 非流式代理请求（对话、检索、知识库列表与上传）：准入检查，并在处理期间计入占用"""
+        self._admit("dify_requests", self.dify_in_flight, settings.ADMISSION_MAX_DIFY_REQUESTS, priority)
+        self.dify_in_flight += 1
+        try:
+            yield
+        finally:
+            self.dify_in_flight -= 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "enabled": settings.ADMISSION_ENABLED,
+            "overloaded": self.overloaded(),
+            "pressure": self.pressure(),
+            "ssh_in_flight": self.ssh_in_flight,
+            "ssh_orphaned": len(self._orphans),
+            "ssh_limit": settings.ADMISSION_MAX_SSH,
+            "dify_streams_in_flight": self.streams_in_flight,
+            "dify_streams_limit": settings.ADMISSION_MAX_DIFY_STREAMS,
+            "dify_requests_in_flight": self.dify_in_flight,
+            "dify_requests_limit": settings.ADMISSION_MAX_DIFY_REQUESTS,
+            "queue_wait_ms": round(self.queue_wait_ms(), 1),
+            **self.stats,
+        }
+
+
+class StreamSlot:
+    """已占用的 Dify 流式会话名额，release() 可重复调用"""
+
+    __slots__ = ("_controller",)
+
+    def __init__(self, controller: AdmissionController):
+        self._controller = controller
+
+    def release(self):
+        if self._controller is not None:
+            self._controller._release_stream()
+            self._controller = None
+
+
+admission = AdmissionController()
+
+
+def admit_dify(priority: str) -> Callable[[], AsyncIterator[None]]:
+    """路由依赖（Depends）：Dify 代理请求的准入检查与占用跟踪"""
+
+    async def dependency() -> AsyncIterator[None]:
+        with admission.track_dify(priority):
+            yield
+
+    return dependency
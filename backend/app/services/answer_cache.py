@@ -0,0 +1,83 @@
+"""
+对话答案缓存
+缓存新会话首轮问答的完整答案，相同问题直接返回，并发的相同问题合并为一次 Dify 调用
+"""
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from app.config import settings
+from app.services.cache import SingleFlight
+from app.services.shared_state import SharedCache
+
+
+def normalize_query(query: str) -> str:
+    """规范化问题文本：忽略大小写与多余空白"""
+    return " ".join(query.lower().split())
+
+
+class AnswerCache:
+    """答案缓存（LRU + TTL + single-flight）"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        # 知识库变更时递增版本号，失效前发起的请求不会回填旧答案
+        self._cache = SharedCache("answer", maxsize=maxsize, ttl=ttl)
+        self._flight = SingleFlight()
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(query: str, inputs: Optional[Dict[str, Any]], app_id: str) -> str:
+        """缓存 key = 规范化问题 + inputs + 应用 ID"""
+        raw = json.dumps(
+            [app_id, normalize_query(query), inputs or {}],
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def get_or_fetch(
+        self,
+        key: str,
+        fetch: Callable[[], Awaitable[Any]],
+    ) -> Tuple[Any, bool]:
+        """
+        读取缓存，未命中时调用 fetch 并回填
+
+        Returns:
+            (value, hit)
+        """
+        value, generation = await self._cache.lookup(key)
+        if value is not None:
+            return value, True
+
+        async def load():
+            result = await fetch()
+            await self._cache.set(key, result, generation)
+            return result
+
+        return await self._flight.do((generation, key), load), False
+
+    async def invalidate(self):
+        """使全部缓存失效（知识库内容变化时调用）"""
+        self.invalidations += 1
+        await self._cache.invalidate()
+
+    async def clear(self):
+        await self.invalidate()
+        await self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": settings.ANSWER_CACHE_ENABLED,
+            **self._cache.stats(),
+            "coalesced": self._flight.coalesced,
+            "in_flight": self._flight.in_flight,
+            "invalidations": self.invalidations,
+        }
+
+
+answer_cache = AnswerCache(
+    maxsize=settings.ANSWER_CACHE_MAX_ENTRIES,
+    ttl=settings.ANSWER_CACHE_TTL,
+)
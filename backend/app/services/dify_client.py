@@ -0,0 +1,303 @@
+"""
+Dify 上游调用
+共享连接池，并为每类接口提供熔断、带抖动的重试与对冲请求
+"""
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+import httpx
+from loguru import logger
+
+from app.config import settings
+from app.services import tracing
+from app.services.metrics import DIFY_IN_FLIGHT, DIFY_LATENCY, DIFY_TTFB
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开，快速失败"""
+
+    def __init__(self, endpoint: str, retry_after: float):
+        self.endpoint = endpoint
+        self.retry_after = max(1, int(retry_after + 0.999))
+        super().__init__(f"Dify 服务暂不可用（熔断中）: {endpoint}，请 {self.retry_after} 秒后重试")
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    连续失败达到阈值后打开，打开期间直接拒绝请求；
+    冷却时间过后进入半开状态，只放行一个探测请求，成功则关闭，失败则重新打开
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, recovery_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probe_started_at = 0.0
+        self.consecutive_failures = 0
+        self.total_failures = 0
+        self.rejected = 0
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            return self.HALF_OPEN
+        return self._state
+
+    def before_call(self):
+        """请求前检查，熔断时抛出 CircuitOpenError"""
+        state = self.state
+        if state == self.CLOSED:
+            return
+
+        now = time.monotonic()
+        if state == self.OPEN:
+            self.rejected += 1
+            raise CircuitOpenError(self.name, self.recovery_timeout - (now - self._opened_at))
+
+        # 半开：同一时间只放行一个探测请求（探测被取消时，超过冷却时间后允许重新探测）
+        if now - self._probe_started_at < self.recovery_timeout:
+            self.rejected += 1
+            raise CircuitOpenError(self.name, self.recovery_timeout)
+        self._probe_started_at = now
+
+    def record_success(self):
+        if self._state != self.CLOSED:
+            logger.info(f"Dify 熔断器恢复: {self.name}")
+        self._state = self.CLOSED
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self.total_failures += 1
+        if self.state == self.HALF_OPEN or (
+            self._state == self.CLOSED and self.consecutive_failures >= self.failure_threshold
+        ):
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._probe_started_at = 0.0
+            self.times_opened += 1
+            logger.warning(f"Dify 熔断器打开: {self.name} | 连续失败 {self.consecutive_failures} 次")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "total_failures": self.total_failures,
+            "rejected": self.rejected,
+            "times_opened": self.times_opened,
+        }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_client: Optional[httpx.AsyncClient] = None
+
+# 重试与对冲统计
+upstream_stats = {
+    "retries": 0,
+    "hedges_sent": 0,
+    "hedge_wins": 0,
+}
+
+# 可重试的状态码（仅幂等请求）
+_RETRYABLE_STATUS = {502, 503, 504}
+
+
+def get_breaker(endpoint: str) -> CircuitBreaker:
+    """按接口类别获取熔断器"""
+    breaker = _breakers.get(endpoint)
+    if breaker is None:
+        breaker = CircuitBreaker(
+            endpoint,
+            failure_threshold=settings.DIFY_BREAKER_FAILURE_THRESHOLD,
+            recovery_timeout=settings.DIFY_BREAKER_RECOVERY_SECONDS,
+        )
+        _breakers[endpoint] = breaker
+    return breaker
+
+
+def breaker_states() -> Dict[str, Dict[str, Any]]:
+    """所有熔断器状态（用于 /ready）"""
+    return {name: breaker.snapshot() for name, breaker in _breakers.items()}
+
+
+def any_breaker_open() -> bool:
+    return any(breaker.state == CircuitBreaker.OPEN for breaker in _breakers.values())
+
+
+def get_client() -> httpx.AsyncClient:
+    """获取共享的 Dify HTTP 客户端（复用连接池）"""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=settings.DIFY_API_BASE_URL,
+            headers={"Authorization": f"Bearer {settings.DIFY_API_KEY}"},
+            timeout=30.0,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _hedged(send: Callable[[], Awaitable[httpx.Response]], delay: float) -> httpx.Response:
+    """
+    对冲请求
+
+    首个请求在 delay 内未返回时再发出一个相同请求，取先成功的结果，取消另一个
+    """
+    first = asyncio.ensure_future(send())
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done:
+        return first.result()
+
+    upstream_stats["hedges_sent"] += 1
+    second = asyncio.ensure_future(send())
+    pending = {first, second}
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        upstream_stats["hedge_wins"] += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def dify_request(
+    method: str,
+    path: str,
+    *,
+    endpoint: str,
+    timeout: float = 30.0,
+    idempotent: bool = False,
+    hedge: bool = False,
+    client: Optional[httpx.AsyncClient] = None,
+    **kwargs,
+) -> httpx.Response:
+    """
+    调用 Dify 接口
+
+    Args:
+        endpoint: 熔断器分组名称（chat / conversations / datasets / retrieve 等）
+        idempotent: 幂等请求在网络错误或 502/503/504 时按 DIFY_RETRY_ATTEMPTS 重试
+        hedge: 启用 DIFY_HEDGE_ENABLED 时对慢请求发出对冲请求
+        client: 指定客户端（默认使用共享客户端）
+
+    Raises:
+        CircuitOpenError: 熔断器打开
+        httpx.TransportError: 网络错误（重试耗尽）
+    """
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        with DIFY_IN_FLIGHT.track(endpoint):
+            response = await _request_with_retry(
+                method, path, endpoint, timeout, idempotent, hedge, client, kwargs
+            )
+        outcome = "ok" if response.status_code < 500 else "error"
+        return response
+    except CircuitOpenError:
+        outcome = "rejected"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        DIFY_LATENCY.observe(elapsed, endpoint, outcome)
+        tracing.record("dify", started, elapsed)
+
+
+async def _request_with_retry(
+    method: str,
+    path: str,
+    endpoint: str,
+    timeout: float,
+    idempotent: bool,
+    hedge: bool,
+    client: Optional[httpx.AsyncClient],
+    kwargs: Dict[str, Any],
+) -> httpx.Response:
+    breaker = get_breaker(endpoint)
+    http = client or get_client()
+    attempts = 1 + (settings.DIFY_RETRY_ATTEMPTS if idempotent else 0)
+
+    async def send() -> httpx.Response:
+        return await http.request(method, path, timeout=timeout, **kwargs)
+
+    for attempt in range(attempts):
+        if attempt:
+            upstream_stats["retries"] += 1
+            # 全抖动指数退避
+            await asyncio.sleep(random.uniform(0, settings.DIFY_RETRY_BACKOFF * 2 ** attempt))
+
+        breaker.before_call()
+        try:
+            if hedge and settings.DIFY_HEDGE_ENABLED:
+                response = await _hedged(send, settings.DIFY_HEDGE_DELAY_MS / 1000)
+            else:
+                response = await send()
+        except httpx.TransportError:
+            breaker.record_failure()
+            if attempt == attempts - 1:
+                raise
+            continue
+
+        if response.status_code < 500:
+            breaker.record_success()
+            return response
+
+        breaker.record_failure()
+        if response.status_code not in _RETRYABLE_STATUS or attempt == attempts - 1:
+            return response
+
+    raise RuntimeError("unreachable")
+
+
+@asynccontextmanager
+async def dify_stream(
+    method: str,
+    path: str,
+    *,
+    endpoint: str,
+    timeout: float = 120.0,
+    **kwargs,
+) -> AsyncIterator[httpx.Response]:
+    """流式调用 Dify 接口（受熔断器保护，不重试），记录响应头到达耗时（TTFB）"""
+    breaker = get_breaker(endpoint)
+    breaker.before_call()
+    started = time.perf_counter()
+    try:
+        with DIFY_IN_FLIGHT.track(endpoint):
+            async with get_client().stream(method, path, timeout=timeout, **kwargs) as response:
+                elapsed = time.perf_counter() - started
+                DIFY_TTFB.observe(elapsed, endpoint)
+                tracing.record("dify_ttfb", started, elapsed)
+                if response.status_code < 500:
+                    breaker.record_success()
+                else:
+                    breaker.record_failure()
+                yield response
+    except httpx.TransportError:
+        breaker.record_failure()
+        raise
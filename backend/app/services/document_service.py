@@ -0,0 +1,37 @@
+"""
+文档管理
+删除 Dify 文档并清理本地状态（答案 / 检索 / 列表缓存、关键词索引、同步清单），
+删除接口与增量同步共用
+"""
+from app.services.answer_cache import answer_cache
+from app.services.dify_client import dify_request
+from app.services.lexical_index import lexical_index
+from app.services.listing_service import listing_cache
+from app.services.retrieval_cache import retrieval_cache
+from app.services import manifest_service
+
+
+class DocumentDeleteError(Exception):
+    """Dify 拒绝删除文档"""
+
+    def __init__(self, status_code: int, detail: str):
+        self.status_code = status_code
+        self.detail = detail
+        super().__init__(f"HTTP {status_code}: {detail}")
+
+
+async def delete_document(dataset_id: str, document_id: str):
+    """删除 Dify 文档；Dify 返回非 200 时抛出 DocumentDeleteError"""
+    response = await dify_request(
+        "DELETE",
+        f"/datasets/{dataset_id}/documents/{document_id}",
+        endpoint="datasets",
+    )
+    if response.status_code != 200:
+        raise DocumentDeleteError(response.status_code, response.text)
+
+    await answer_cache.invalidate()
+    await retrieval_cache.invalidate(dataset_id)
+    await listing_cache.invalidate(dataset_id)
+    lexical_index.remove_document(dataset_id, document_id)
+    await manifest_service.forget_document(dataset_id, document_id)
@@ -0,0 +1,181 @@
+"""
+对话历史镜像服务
+将经过 /send 与 /stream 的对话写入本地数据库，历史记录直接从本地分页读取
+
+任一轮问答没有写入镜像（流中止或出错、镜像写入失败、批量评测追加到已有会话）时，
+会话标记为不完整，之后的历史记录改由 Dify 提供
+"""
+import time
+from typing import Dict, Any, Optional, List
+from sqlalchemy import (
+    Table, Column, String, Text, Integer, Boolean, ForeignKey, Index,
+    select, delete, insert, update,
+)
+from loguru import logger
+
+from app.database import metadata, get_engine
+
+
+conversations = Table(
+    "conversations",
+    metadata,
+    Column("id", String(64), primary_key=True),
+    Column("user_id", String(128), nullable=False),
+    # 会话的第一条消息是否由本地记录；只有完整的会话才从本地提供历史
+    Column("complete", Boolean, nullable=False, default=False),
+    Column("created_at", Integer, nullable=False),
+    Column("updated_at", Integer, nullable=False),
+)
+
+messages = Table(
+    "messages",
+    metadata,
+    # seq 单调递增，作为分页游标的排序键
+    Column("seq", Integer, primary_key=True, autoincrement=True),
+    Column("id", String(64), nullable=False, unique=True),
+    Column(
+        "conversation_id",
+        String(64),
+        ForeignKey("conversations.id", ondelete="CASCADE"),
+        nullable=False,
+    ),
+    Column("user_id", String(128), nullable=False),
+    Column("query", Text, nullable=False),
+    Column("answer", Text, nullable=False),
+    Column("created_at", Integer, nullable=False),
+    Index("ix_messages_conversation_seq", "conversation_id", "seq"),
+)
+
+
+async def record_message(
+    conversation_id: str,
+    message_id: str,
+    user_id: str,
+    query: str,
+    answer: str,
+    new_conversation: bool,
+):
+    """
+    记录一轮问答
+
+    镜像写入失败只记录日志并将会话标记为不完整，不影响对话本身
+    """
+    if not (conversation_id and message_id):
+        return
+
+    now = int(time.time())
+    try:
+        async with get_engine().begin() as conn:
+            existing = await conn.scalar(
+                select(conversations.c.id).where(conversations.c.id == conversation_id)
+            )
+            if existing is None:
+                await conn.execute(insert(conversations).values(
+                    id=conversation_id,
+                    user_id=user_id,
+                    complete=new_conversation,
+                    created_at=now,
+                    updated_at=now,
+                ))
+            else:
+                await conn.execute(
+                    update(conversations)
+                    .where(conversations.c.id == conversation_id)
+                    .values(updated_at=now)
+                )
+
+            await conn.execute(insert(messages).values(
+                id=message_id,
+                conversation_id=conversation_id,
+                user_id=user_id,
+                query=query,
+                answer=answer,
+                created_at=now,
+            ))
+    except Exception as e:
+        logger.warning(f"对话镜像写入失败: {conversation_id} | {e}")
+        await mark_incomplete(conversation_id)
+
+
+async def mark_incomplete(conversation_id: Optional[str]):
+    """会话有未镜像的问答，不再从本地提供历史（失败只记录日志）"""
+    if not conversation_id:
+        return
+    try:
+        async with get_engine().begin() as conn:
+            await conn.execute(
+                update(conversations)
+                .where(conversations.c.id == conversation_id)
+                .values(complete=False, updated_at=int(time.time()))
+            )
+    except Exception as e:
+        logger.warning(f"标记对话镜像不完整失败: {conversation_id} | {e}")
+
+
+async def is_mirrored(conversation_id: str, user_id: str) -> bool:
+    """会话是否有完整的本地镜像"""
+    async with get_engine().connect() as conn:
+        complete = await conn.scalar(
+            select(conversations.c.complete).where(
+                conversations.c.id == conversation_id,
+                conversations.c.user_id == user_id,
+            )
+        )
+    return bool(complete)
+
+
+async def list_messages(
+    conversation_id: str,
+    limit: int = 20,
+    first_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    游标分页读取历史消息
+
+    与 Dify /messages 接口保持相同的返回结构：
+    first_id 为当前页最早一条消息的 ID，返回比它更早的 limit 条，按时间正序排列
+    """
+    async with get_engine().connect() as conn:
+        query = select(
+            messages.c.seq,
+            messages.c.id,
+            messages.c.conversation_id,
+            messages.c.query,
+            messages.c.answer,
+            messages.c.created_at,
+        ).where(messages.c.conversation_id == conversation_id)
+
+        if first_id:
+            cursor = await conn.scalar(
+                select(messages.c.seq).where(
+                    messages.c.id == first_id,
+                    messages.c.conversation_id == conversation_id,
+                )
+            )
+            if cursor is None:
+                return {"limit": limit, "has_more": False, "data": []}
+            query = query.where(messages.c.seq < cursor)
+
+        # 多取一条用于判断 has_more
+        query = query.order_by(messages.c.seq.desc()).limit(limit + 1)
+        rows = (await conn.execute(query)).all()
+
+    has_more = len(rows) > limit
+    data: List[Dict[str, Any]] = [
+        {
+            "id": row.id,
+            "conversation_id": row.conversation_id,
+            "query": row.query,
+            "answer": row.answer,
+            "created_at": row.created_at,
+        }
+        for row in reversed(rows[:limit])
+    ]
+    return {"limit": limit, "has_more": has_more, "data": data}
+
+
+async def delete_conversation(conversation_id: str):
+    """删除本地镜像的会话及其消息"""
+    async with get_engine().begin() as conn:
+        await conn.execute(delete(messages).where(messages.c.conversation_id == conversation_id))
+        await conn.execute(delete(conversations).where(conversations.c.id == conversation_id))
@@ -0,0 +1,188 @@
+"""
+SSH 主机健康跟踪
+
+- 自适应连接超时：按主机记录 TCP 连接耗时的 EWMA，连接超时取 EWMA × SSH_CONNECT_TIMEOUT_FACTOR，
+  介于 SSH_CONNECT_TIMEOUT_MIN 与 SSH_TIMEOUT 之间；没有历史或最近失败过的主机使用完整的 SSH_TIMEOUT
+- 失败缓存：连接失败（认证失败除外）后主机进入退避期，期间的请求直接返回 HostUnavailableError，
+  不占用工作线程；连续失败时退避时间从 SSH_HOST_BACKOFF_BASE 起翻倍，最长 SSH_HOST_BACKOFF_MAX。
+  退避期结束后只放行一个连接作为探测，成功即恢复，探测期间其他请求仍直接失败
+
+状态保存在进程内（在工作线程中更新），多 worker 部署时各 worker 分别跟踪
+"""
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from app.config import settings
+from app.services.metrics import SSH_HOST_FAST_FAILS
+
+_EWMA_ALPHA = 0.2
+# 长期没有访问的主机不再保留健康记录
+_RECORD_TTL = 3600.0
+_MAX_HOSTS = 1024
+
+
+class HostUnavailableError(Exception):
+    """主机处于退避期，请求未发起直接失败"""
+
+    def __init__(self, host: str, port: int, retry_after: float, failures: int, last_error: str):
+        self.host = host
+        self.port = port
+        self.retry_after = max(1, int(retry_after + 0.999))
+        self.failures = failures
+        self.last_error = last_error
+        super().__init__(
+            f"主机 {host}:{port} 不可达（连续失败 {failures} 次，{self.retry_after} 秒后重试）: {last_error}"
+        )
+
+
+class _HostRecord:
+    __slots__ = (
+        "connect_ewma", "failures", "down_until", "probe_until", "last_error", "last_success", "fast_failures",
+        "last_seen",
+    )
+
+    def __init__(self):
+        self.last_seen = time.monotonic()
+        self.connect_ewma: Optional[float] = None
+        self.failures = 0
+        self.down_until = 0.0
+        self.probe_until = 0.0
+        self.last_error = ""
+        self.last_success: Optional[float] = None
+        self.fast_failures = 0
+
+
+class HostHealthTracker:
+    """按 (host, port) 跟踪连接耗时与失败退避"""
+
+    def __init__(self):
+        self._records: Dict[Tuple[str, int], _HostRecord] = {}
+        self._lock = threading.Lock()
+
+    def _record(self, host: str, port: int) -> _HostRecord:
+        """取得（或创建）主机记录，调用方持有锁"""
+        record = self._records.get((host, port))
+        if record is None:
+            if len(self._records) >= _MAX_HOSTS:
+                self._prune()
+            record = self._records[(host, port)] = _HostRecord()
+        record.last_seen = time.monotonic()
+        return record
+
+    def _prune(self):
+        now = time.monotonic()
+        for key, record in list(self._records.items()):
+            if now - record.last_seen > _RECORD_TTL and record.down_until <= now:
+                del self._records[key]
+        # 仍然超出上限时淘汰最久未访问的一半
+        if len(self._records) >= _MAX_HOSTS:
+            for key, _ in sorted(self._records.items(), key=lambda item: item[1].last_seen)[: _MAX_HOSTS // 2]:
+                del self._records[key]
+
+    def check(self, host: str, port: int, probe: bool = True):
+        """
+        主机处于退避期或正在探测时抛出 HostUnavailableError
+
+        probe=False 只做检查，不占用探测名额（进入线程池之前的预检）
+        """
+        if not settings.SSH_HOST_HEALTH_ENABLED:
+            return
+        with self._lock:
+            record = self._records.get((host, port))
+            if record is None or not record.failures:
+                return
+            now = time.monotonic()
+            remaining = max(record.down_until, record.probe_until) - now
+            if remaining <= 0:
+                # 退避结束：放行本次请求作为探测（连接加握手最长 2 × SSH_TIMEOUT）
+                if probe:
+                    record.probe_until = now + 2 * settings.SSH_TIMEOUT
+                return
+            record.fast_failures += 1
+            failures, last_error = record.failures, record.last_error
+        SSH_HOST_FAST_FAILS.inc()
+        raise HostUnavailableError(host, port, remaining, failures, last_error)
+
+    def connect_timeout(self, host: str, port: int) -> float:
+        """TCP 连接超时（秒）"""
+        if not settings.SSH_HOST_HEALTH_ENABLED:
+            return settings.SSH_TIMEOUT
+        with self._lock:
+            record = self._records.get((host, port))
+        # 最近失败过的主机可能只是变慢，探测时给足时间
+        if record is None or record.connect_ewma is None or record.failures:
+            return settings.SSH_TIMEOUT
+        return min(
+            settings.SSH_TIMEOUT,
+            max(settings.SSH_CONNECT_TIMEOUT_MIN, record.connect_ewma * settings.SSH_CONNECT_TIMEOUT_FACTOR),
+        )
+
+    def record_connect(self, host: str, port: int, elapsed: float):
+        """TCP 连接成功，更新耗时均值"""
+        with self._lock:
+            record = self._record(host, port)
+            if record.connect_ewma is None:
+                record.connect_ewma = elapsed
+            else:
+                record.connect_ewma += _EWMA_ALPHA * (elapsed - record.connect_ewma)
+
+    def record_success(self, host: str, port: int):
+        """主机可达（握手完成，认证失败同样视为可达）"""
+        with self._lock:
+            record = self._record(host, port)
+            recovered = record.failures
+            record.failures = 0
+            record.down_until = 0.0
+            record.probe_until = 0.0
+            record.last_success = time.time()
+        if recovered:
+            logger.info(f"SSH 主机恢复: {host}:{port}（此前连续失败 {recovered} 次）")
+
+    def record_failure(self, host: str, port: int, error: str):
+        """连接或握手失败，进入退避期"""
+        with self._lock:
+            record = self._record(host, port)
+            record.failures += 1
+            record.last_error = error
+            backoff = min(
+                settings.SSH_HOST_BACKOFF_MAX,
+                settings.SSH_HOST_BACKOFF_BASE * 2 ** (record.failures - 1),
+            )
+            record.down_until = time.monotonic() + backoff
+            record.probe_until = 0.0
+            failures = record.failures
+        logger.warning(f"SSH 主机连接失败: {host}:{port} | 连续 {failures} 次 | 退避 {backoff:.0f} 秒 | {error}")
+
+    def reset(self, host: Optional[str] = None) -> int:
+        """清除健康记录（全部或指定主机），返回清除的条数"""
+        with self._lock:
+            keys = [key for key in self._records if host is None or key[0] == host]
+            for key in keys:
+                del self._records[key]
+        return len(keys)
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            items = list(self._records.items())
+        return [
+            {
+                "host": host,
+                "port": port,
+                "down": record.down_until > now,
+                "retry_after": round(max(0.0, record.down_until - now), 1),
+                "failures": record.failures,
+                "last_error": record.last_error or None,
+                "connect_ewma_ms": round(record.connect_ewma * 1000, 2) if record.connect_ewma is not None else None,
+                "connect_timeout": round(self.connect_timeout(host, port), 2),
+                "fast_failures": record.fast_failures,
+                "last_success": record.last_success,
+            }
+            for (host, port), record in items
+        ]
+
+
+host_health = HostHealthTracker()
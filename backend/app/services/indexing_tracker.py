@@ -0,0 +1,230 @@
+"""
+文档索引状态跟踪
+上传后的文档批次由每个数据集一个后台轮询任务跟踪 Dify 索引进度，
+状态变化通过订阅队列推送给所有观察者，N 个观察者只对应一个上游轮询循环
+"""
+import asyncio
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from loguru import logger
+
+from app.config import settings
+from app.services.dify_client import CircuitOpenError, dify_request
+from app.services.listing_service import listing_cache
+from app.services.retrieval_cache import retrieval_cache
+
+# 索引结束的状态
+TERMINAL_STATUSES = {"completed", "error"}
+
+_WATCHER_QUEUE_SIZE = 256
+
+
+class _Batch:
+    """一个上传批次（Dify 每次上传返回一个 batch）"""
+
+    def __init__(self, batch: str, document_ids: Iterable[str]):
+        self.batch = batch
+        self.created_at = time.monotonic()
+        self.documents: Dict[str, Dict[str, Any]] = {
+            document_id: {"document_id": document_id, "status": "waiting"}
+            for document_id in document_ids
+        }
+
+    @property
+    def done(self) -> bool:
+        return bool(self.documents) and all(
+            doc["status"] in TERMINAL_STATUSES for doc in self.documents.values()
+        )
+
+
+class Watcher:
+    """一个订阅者，事件队列满时标记为溢出，由订阅方重新订阅获取快照"""
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=_WATCHER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def push(self, event: Dict[str, Any]):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            logger.warning("索引状态订阅者处理过慢，已断开")
+
+
+class DatasetTracker:
+    """单个数据集的跟踪器"""
+
+    def __init__(self, dataset_id: str, stats: Dict[str, int]):
+        self.dataset_id = dataset_id
+        self.batches: Dict[str, _Batch] = {}
+        self.watchers: Set[Watcher] = set()
+        self.interval = settings.INDEXING_POLL_MIN_INTERVAL
+        self._task: Optional[asyncio.Task] = None
+        self._stats = stats
+
+    def track(self, batch: str, document_ids: Iterable[str]):
+        entry = self.batches.get(batch)
+        if entry is None:
+            self.batches[batch] = _Batch(batch, document_ids)
+        else:
+            for document_id in document_ids:
+                entry.documents.setdefault(document_id, {"document_id": document_id, "status": "waiting"})
+        # 新批次加入时从最短间隔重新开始
+        self.interval = settings.INDEXING_POLL_MIN_INTERVAL
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._poll_loop())
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "event": "snapshot",
+            "dataset_id": self.dataset_id,
+            "poll_interval": round(self.interval, 2),
+            "batches": [
+                {"batch": entry.batch, "documents": list(entry.documents.values())}
+                for entry in self.batches.values()
+            ],
+        }
+
+    def _publish(self, event: Dict[str, Any]):
+        for watcher in self.watchers:
+            watcher.push(event)
+
+    async def _poll_loop(self):
+        """轮询所有未完成批次：有状态变化时缩短间隔，无变化时逐步放慢，出错时退避"""
+        while self.batches:
+            await asyncio.sleep(self.interval)
+            changed = False
+            delay: Optional[float] = None
+            for entry in list(self.batches.values()):
+                if time.monotonic() - entry.created_at > settings.INDEXING_TRACK_TIMEOUT:
+                    del self.batches[entry.batch]
+                    self._publish({"event": "batch_timeout", "dataset_id": self.dataset_id, "batch": entry.batch})
+                    continue
+                try:
+                    changed |= await self._poll_batch(entry)
+                except asyncio.CancelledError:
+                    raise
+                except CircuitOpenError as e:
+                    delay = max(delay or 0.0, float(e.retry_after))
+                    break
+                except Exception as e:
+                    self._stats["poll_errors"] += 1
+                    logger.warning(f"查询索引状态失败 | 数据集: {self.dataset_id} | 批次: {entry.batch} | {e}")
+                    delay = self.interval * 2
+                    continue
+
+                if entry.done:
+                    del self.batches[entry.batch]
+                    self._publish({"event": "batch_done", "dataset_id": self.dataset_id, "batch": entry.batch})
+
+            if delay is not None:
+                self.interval = min(delay, settings.INDEXING_POLL_MAX_INTERVAL)
+            elif changed:
+                self.interval = settings.INDEXING_POLL_MIN_INTERVAL
+            else:
+                self.interval = min(self.interval * 1.5, settings.INDEXING_POLL_MAX_INTERVAL)
+
+    async def _poll_batch(self, entry: _Batch) -> bool:
+        """查询一个批次的索引状态，推送变化，返回是否有变化"""
+        self._stats["polls"] += 1
+        response = await dify_request(
+            "GET",
+            f"/datasets/{self.dataset_id}/documents/{entry.batch}/indexing-status",
+            endpoint="datasets",
+            idempotent=True,
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+
+        changed = False
+        finished = False
+        for item in response.json().get("data") or []:
+            document_id = item.get("id")
+            if not document_id:
+                continue
+            state = {
+                "document_id": document_id,
+                "status": item.get("indexing_status"),
+                "completed_segments": item.get("completed_segments"),
+                "total_segments": item.get("total_segments"),
+                "error": item.get("error"),
+            }
+            previous = entry.documents.get(document_id)
+            if previous == state:
+                continue
+            entry.documents[document_id] = state
+            changed = True
+            self._stats["transitions"] += 1
+            self._publish({"event": "status", "dataset_id": self.dataset_id, "batch": entry.batch, **state})
+            if state["status"] in TERMINAL_STATUSES and (previous or {}).get("status") != state["status"]:
+                finished = True
+
+        if finished:
+            # 索引完成后检索结果与文档列表都会变化
+            await retrieval_cache.invalidate(self.dataset_id)
+            await listing_cache.invalidate(self.dataset_id)
+        return changed
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+class IndexingTracker:
+    """所有数据集的索引状态跟踪"""
+
+    def __init__(self):
+        self._datasets: Dict[str, DatasetTracker] = {}
+        self.stats = {"polls": 0, "poll_errors": 0, "transitions": 0}
+
+    def _dataset(self, dataset_id: str) -> DatasetTracker:
+        tracker = self._datasets.get(dataset_id)
+        if tracker is None:
+            tracker = DatasetTracker(dataset_id, self.stats)
+            self._datasets[dataset_id] = tracker
+        return tracker
+
+    def track(self, dataset_id: str, batch: Optional[str], document_ids: Iterable[str]):
+        """登记上传批次（上传成功后调用）"""
+        if not settings.INDEXING_TRACKER_ENABLED or not batch:
+            return
+        self._dataset(dataset_id).track(batch, [doc_id for doc_id in document_ids if doc_id])
+
+    def subscribe(self, dataset_id: str) -> Watcher:
+        tracker = self._dataset(dataset_id)
+        watcher = Watcher()
+        watcher.push(tracker.snapshot())
+        tracker.watchers.add(watcher)
+        return watcher
+
+    def unsubscribe(self, dataset_id: str, watcher: Watcher):
+        tracker = self._datasets.get(dataset_id)
+        if tracker is not None:
+            tracker.watchers.discard(watcher)
+
+    def snapshot(self, dataset_id: str) -> Dict[str, Any]:
+        return self._dataset(dataset_id).snapshot()
+
+    def overview(self) -> Dict[str, Any]:
+        datasets: List[Dict[str, Any]] = [
+            {
+                "dataset_id": dataset_id,
+                "pending_batches": len(tracker.batches),
+                "watchers": len(tracker.watchers),
+                "poll_interval": round(tracker.interval, 2),
+            }
+            for dataset_id, tracker in self._datasets.items()
+            if tracker.batches or tracker.watchers
+        ]
+        return {"enabled": settings.INDEXING_TRACKER_ENABLED, **self.stats, "datasets": datasets}
+
+    def close(self):
+        for tracker in self._datasets.values():
+            tracker.cancel()
+
+
+indexing_tracker = IndexingTracker()
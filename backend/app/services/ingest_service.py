@@ -0,0 +1,499 @@
+"""
+批量导入服务
+接收多个文件或 zip/tar 归档，流式解包后以有限并发上传到 Dify，并以任务形式跟踪进度
+
+同步模式下按内容哈希与本地清单比对，只上传新增或变化的文档，并删除源中已不存在的文档。
+任一源文件（归档）无法读取时无法判断哪些文档已不存在，跳过删除，任务状态为 partial
+
+清单按源文件相对路径（归档内路径或上传时指定的 paths）记录，批量导入同样写入清单，
+之后生成的同步计划与导入结果一致
+"""
+import asyncio
+import hashlib
+import os
+import posixpath
+import shutil
+import tarfile
+import tempfile
+import time
+import uuid
+import zipfile
+from typing import IO, Any, Callable, Dict, Iterable, List, Optional, Set
+
+from loguru import logger
+
+from app.config import settings
+from app.services.answer_cache import answer_cache
+from app.services.indexing_tracker import indexing_tracker
+from app.services.lexical_index import lexical_index
+from app.services.listing_service import listing_cache
+from app.services.retrieval_cache import retrieval_cache
+from app.services.shared_state import create_registry
+from app.services import document_service, extract_service, manifest_service
+from app.services.manifest_service import ManifestEntry
+from app.services.upload_service import (
+    ALLOWED_CONTENT_TYPES,
+    EXTENSION_CONTENT_TYPES,
+    UploadProgress,
+    upload_file_to_dify,
+)
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+# 小文件留在内存，超过该大小落盘
+_SPOOL_MAX_SIZE = 1024 * 1024
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+def is_archive(filename: str) -> bool:
+    return filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def normalize_path(path: str) -> str:
+    """源文件相对路径的统一形式（清单键）：/ 分隔，去掉开头的 ./ 与 /"""
+    path = posixpath.normpath(path.replace("\\", "/")).lstrip("/")
+    return "" if path == "." else path
+
+
+def content_type_for(filename: str) -> Optional[str]:
+    """按扩展名推断文档类型，不支持的类型返回 None"""
+    return EXTENSION_CONTENT_TYPES.get(os.path.splitext(filename)[1].lower())
+
+
+class IngestSource:
+    """任务持有的一个上传文件（请求结束后表单文件会被关闭，因此需要复制一份）"""
+
+    def __init__(self, filename: str, content_type: Optional[str], fileobj: IO[bytes]):
+        self.filename = filename
+        self.content_type = content_type
+        self.fileobj = fileobj
+
+
+class _Entry:
+    """待上传的单个文档"""
+
+    def __init__(
+        self,
+        progress: UploadProgress,
+        content_type: str,
+        open_file: Callable[[], IO[bytes]],
+        content_hash: str,
+    ):
+        self.progress = progress
+        self.content_type = content_type
+        self.open_file = open_file
+        self.content_hash = content_hash
+
+
+class IngestJob:
+    """批量导入任务（sync=True 时为增量同步任务）"""
+
+    def __init__(
+        self,
+        dataset_id: str,
+        indexing_technique: str,
+        sync: bool = False,
+        delete_missing: bool = True,
+    ):
+        self.job_id = uuid.uuid4().hex
+        self.dataset_id = dataset_id
+        self.indexing_technique = indexing_technique
+        self.sync = sync
+        self.delete_missing = delete_missing
+        # 同步模式：任务开始时加载的清单，以及本次源中出现过（或客户端声明未变化）的路径
+        self.manifest: Dict[str, ManifestEntry] = {}
+        self.seen: Set[str] = set()
+        # 无法读取的源文件（归档损坏等），非空时不删除源中不存在的文档
+        self.source_errors: List[str] = []
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.files: List[UploadProgress] = []
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    def add_file(self, filename: str, size: int) -> UploadProgress:
+        progress = UploadProgress(f"{self.job_id}:{len(self.files)}", filename, size)
+        self.files.append(progress)
+        return progress
+
+    def skip(self, filename: str, reason: str):
+        self.add_file(filename, 0).finish("skipped", reason)
+
+    def snapshot(self, include_files: bool = True) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for progress in self.files:
+            counts[progress.status] = counts.get(progress.status, 0) + 1
+        elapsed = (self.finished_at or time.time()) - self.created_at
+        data = {
+            "job_id": self.job_id,
+            "dataset_id": self.dataset_id,
+            "mode": "sync" if self.sync else "ingest",
+            "status": self.status,
+            "error": self.error,
+            "source_errors": self.source_errors,
+            "total": len(self.files),
+            "counts": counts,
+            "bytes_sent": sum(p.bytes_sent for p in self.files),
+            "total_bytes": sum(p.total_bytes for p in self.files),
+            "elapsed_s": round(elapsed, 1),
+        }
+        if include_files:
+            data["files"] = [p.snapshot() for p in self.files]
+        return data
+
+
+# 任务记录保留一天
+ingest_jobs = create_registry("ingest-jobs", maxsize=256, ttl=24 * 3600)
+
+# 保存后台任务引用，避免被垃圾回收
+_running: Set[asyncio.Task] = set()
+
+
+def _spool(fileobj: IO[bytes]) -> IO[bytes]:
+    """把文件内容复制到临时文件（阻塞操作，需在线程中调用）"""
+    owned = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_SIZE)
+    shutil.copyfileobj(fileobj, owned)
+    owned.seek(0)
+    return owned
+
+
+def _spool_hashed(fileobj: IO[bytes]):
+    """复制到临时文件并同时计算 SHA-256（阻塞操作，需在线程中调用）"""
+    owned = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_SIZE)
+    digest = hashlib.sha256()
+    while True:
+        chunk = fileobj.read(_HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        owned.write(chunk)
+    owned.seek(0)
+    return owned, digest.hexdigest()
+
+
+def _hash_stream(fileobj: IO[bytes]) -> str:
+    """读取到文件末尾并计算 SHA-256（阻塞操作，需在线程中调用）"""
+    digest = hashlib.sha256()
+    while True:
+        chunk = fileobj.read(_HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _hash_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> str:
+    with archive.open(info) as member:
+        return _hash_stream(member)
+
+
+def _hash_and_rewind(fileobj: IO[bytes]) -> str:
+    content_hash = _hash_stream(fileobj)
+    fileobj.seek(0)
+    return content_hash
+
+
+def take_ownership(fileobj: IO[bytes]) -> IO[bytes]:
+    """复制上传文件，使任务在请求结束后仍可读取（阻塞操作，需在线程中调用）"""
+    fileobj.seek(0)
+    return _spool(fileobj)
+
+
+def _file_size(fileobj: IO[bytes]) -> int:
+    fileobj.seek(0, 2)
+    size = fileobj.tell()
+    fileobj.seek(0)
+    return size
+
+
+def _accept(job: IngestJob, name: str, size: int, declared_type: Optional[str] = None) -> Optional[str]:
+    """
+    检查单个文档，返回内容类型；不符合条件时记录为跳过
+
+    优先按扩展名判断，扩展名无法识别时使用上传时声明的类型
+    """
+    job.seen.add(name)
+    basename = os.path.basename(name)
+    if not basename or basename.startswith(".") or "__MACOSX" in name:
+        return None
+    content_type = content_type_for(name) or (
+        declared_type if declared_type in ALLOWED_CONTENT_TYPES else None
+    )
+    if content_type is None:
+        job.skip(name, "不支持的文件类型")
+        return None
+    if size > settings.KNOWLEDGE_UPLOAD_MAX_MB * 1024 * 1024:
+        job.skip(name, f"文件超过大小限制: {settings.KNOWLEDGE_UPLOAD_MAX_MB} MB")
+        return None
+    return content_type
+
+
+def _unchanged(job: IngestJob, name: str, size: int, content_hash: str) -> bool:
+    """同步模式下内容与清单一致的文档直接记为 unchanged"""
+    entry = job.manifest.get(name)
+    if not job.sync or entry is None or entry.content_hash != content_hash:
+        return False
+    job.add_file(name, size).finish("unchanged")
+    return True
+
+
+async def _produce(job: IngestJob, sources: List[IngestSource], queue: asyncio.Queue):
+    """
+    遍历上传文件与归档成员，按顺序放入有界队列
+
+    zip 成员在上传时才按需解压；tar 以流模式顺序读取，每个成员先复制到临时文件
+    """
+    for source in sources:
+        name = normalize_path(source.filename)
+        try:
+            if name.lower().endswith(".zip"):
+                archive = await asyncio.to_thread(zipfile.ZipFile, source.fileobj)
+                for info in archive.infolist():
+                    if info.is_dir():
+                        continue
+                    path = normalize_path(info.filename)
+                    content_type = _accept(job, path, info.file_size)
+                    if not content_type:
+                        continue
+                    open_member = lambda archive=archive, info=info: archive.open(info)
+                    content_hash = await asyncio.to_thread(_hash_member, archive, info)
+                    if _unchanged(job, path, info.file_size, content_hash):
+                        continue
+                    progress = job.add_file(path, info.file_size)
+                    await queue.put(_Entry(progress, content_type, open_member, content_hash))
+
+            elif is_archive(name):
+                archive = await asyncio.to_thread(tarfile.open, fileobj=source.fileobj, mode="r|*")
+                while True:
+                    member = await asyncio.to_thread(archive.next)
+                    if member is None:
+                        break
+                    if not member.isfile():
+                        continue
+                    path = normalize_path(member.name)
+                    content_type = _accept(job, path, member.size)
+                    if not content_type:
+                        continue
+                    extracted = archive.extractfile(member)
+                    owned, content_hash = await asyncio.to_thread(_spool_hashed, extracted)
+                    if _unchanged(job, path, member.size, content_hash):
+                        owned.close()
+                        continue
+                    progress = job.add_file(path, member.size)
+                    await queue.put(_Entry(progress, content_type, lambda owned=owned: owned, content_hash))
+
+            else:
+                size = await asyncio.to_thread(_file_size, source.fileobj)
+                content_type = _accept(job, name, size, source.content_type)
+                if not content_type:
+                    continue
+                open_source = lambda f=source.fileobj: f
+                content_hash = await asyncio.to_thread(_hash_and_rewind, source.fileobj)
+                if _unchanged(job, name, size, content_hash):
+                    continue
+                progress = job.add_file(name, size)
+                await queue.put(_Entry(progress, content_type, open_source, content_hash))
+
+        except (zipfile.BadZipFile, tarfile.TarError) as e:
+            job.source_errors.append(f"{name}: 归档无法解析: {e}")
+            job.skip(name, f"归档无法解析: {e}")
+        except Exception as e:
+            logger.warning(f"读取源文件失败: {name} | {e}")
+            job.source_errors.append(f"{name}: 读取失败: {e}")
+            job.skip(name, f"读取失败: {e}")
+
+
+async def _record_manifest(job: IngestJob, entry: _Entry, document: Dict[str, Any]):
+    """
+    更新清单；同步模式下同时删除内容已变化文档的旧版本
+
+    批量导入不删除旧版本（与此前的导入行为一致），同一路径的清单记录指向新文档
+    """
+    document_id = document.get("id")
+    if not document_id:
+        return
+    path = entry.progress.filename
+    previous = job.manifest.get(path)
+    await manifest_service.upsert_entry(
+        job.dataset_id,
+        ManifestEntry(path, entry.content_hash, document_id, entry.progress.total_bytes),
+    )
+    if job.sync and previous and previous.document_id != document_id:
+        try:
+            await document_service.delete_document(job.dataset_id, previous.document_id)
+        except Exception as e:
+            logger.warning(f"删除旧版本文档失败: {path} | {previous.document_id} | {e}")
+
+
+async def _delete_missing(job: IngestJob):
+    """同步模式：删除源中已不存在的文档"""
+    for path, entry in job.manifest.items():
+        if path in job.seen:
+            continue
+        progress = job.add_file(path, 0)
+        try:
+            await document_service.delete_document(job.dataset_id, entry.document_id)
+            await manifest_service.remove_paths(job.dataset_id, [path])
+            progress.finish("deleted")
+        except Exception as e:
+            progress.finish("failed", f"删除失败: {e}")
+
+
+async def _upload_worker(job: IngestJob, queue: asyncio.Queue):
+    """从队列中取文档并上传，直到收到结束标记"""
+    while True:
+        entry = await queue.get()
+        if entry is None:
+            return
+
+        progress = entry.progress
+        fileobj = None
+        # 本地提取的分段，供关键词索引复用；None 表示未在本地提取
+        chunks: Optional[List[str]] = None
+        try:
+            fileobj = await asyncio.to_thread(entry.open_file)
+            if settings.KNOWLEDGE_LOCAL_EXTRACT and extract_service.is_extractable(entry.content_type):
+                response, chunks = await extract_service.upload_extracted(
+                    job.dataset_id,
+                    filename=progress.filename,
+                    content_type=entry.content_type,
+                    fileobj=fileobj,
+                    size=progress.total_bytes,
+                    indexing_technique=job.indexing_technique,
+                    progress=progress,
+                )
+            else:
+                response = await upload_file_to_dify(
+                    job.dataset_id,
+                    filename=progress.filename,
+                    content_type=entry.content_type,
+                    reader=lambda n, f=fileobj: asyncio.to_thread(f.read, n),
+                    size=progress.total_bytes,
+                    indexing_technique=job.indexing_technique,
+                    progress=progress,
+                )
+            if response.status_code == 200:
+                result = response.json()
+                document = result.get("document") or {}
+                indexing_tracker.track(job.dataset_id, result.get("batch"), [document.get("id")])
+                await _record_manifest(job, entry, document)
+                if settings.LEXICAL_INDEX_ENABLED and document.get("id"):
+                    if chunks is None:
+                        await lexical_index.index_upload(
+                            job.dataset_id, document["id"], progress.filename, entry.content_type, fileobj
+                        )
+                    elif chunks:
+                        lexical_index.index_chunks(job.dataset_id, document["id"], progress.filename, chunks)
+                progress.finish("completed")
+            else:
+                progress.finish("failed", f"HTTP {response.status_code}: {response.text}")
+        except Exception as e:
+            progress.finish("failed", str(e))
+            logger.warning(f"批量导入文件失败: {progress.filename} | {e}")
+        finally:
+            if fileobj is not None:
+                await asyncio.to_thread(fileobj.close)
+
+
+async def _run_job(job: IngestJob, sources: List[IngestSource]):
+    concurrency = max(1, settings.KNOWLEDGE_INGEST_CONCURRENCY)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+    job.status = "running"
+
+    workers = []
+    try:
+        if job.sync:
+            job.manifest = await manifest_service.load_manifest(job.dataset_id)
+        workers = [
+            asyncio.create_task(_upload_worker(job, queue))
+            for _ in range(concurrency)
+        ]
+        await _produce(job, sources, queue)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+        if job.source_errors:
+            # 源不完整，清单中未出现的路径不能视为已删除
+            job.status = "partial"
+            job.error = f"{len(job.source_errors)} 个源文件无法读取"
+            if job.sync and job.delete_missing:
+                job.error += "，已跳过删除源中不存在的文档"
+                logger.warning(f"同步任务源文件不完整，跳过删除 | {job.job_id} | {job.source_errors}")
+        else:
+            if job.sync and job.delete_missing:
+                await _delete_missing(job)
+            job.status = "completed"
+    except Exception as e:
+        logger.exception(f"批量导入任务失败: {job.job_id}")
+        job.status = "failed"
+        job.error = str(e)
+        for worker in workers:
+            worker.cancel()
+    finally:
+        job.finished_at = time.time()
+        for source in sources:
+            source.fileobj.close()
+
+    if any(p.status in ("completed", "deleted") for p in job.files):
+        # 知识库内容已变化，缓存的答案与检索结果可能过期
+        await answer_cache.invalidate()
+        await retrieval_cache.invalidate(job.dataset_id)
+        await listing_cache.invalidate(job.dataset_id)
+
+    snapshot = job.snapshot(include_files=False)
+    logger.info(
+        f"批量导入任务结束 | {job.job_id} | 数据集: {job.dataset_id} | "
+        f"{snapshot['counts']} | {snapshot['elapsed_s']}s"
+    )
+
+
+def start_ingest_job(
+    dataset_id: str,
+    sources: List[IngestSource],
+    indexing_technique: str,
+    sync: bool = False,
+    delete_missing: bool = True,
+    unchanged: Iterable[str] = (),
+) -> IngestJob:
+    """
+    创建并在后台启动批量导入任务
+
+    Args:
+        sync: 增量同步模式，跳过内容未变化的文档
+        delete_missing: 同步模式下删除源中已不存在的文档（有源文件无法读取时跳过）
+        unchanged: 同步计划中未变化、客户端没有上传的源文件路径，不视为已从源中删除
+    """
+    job = IngestJob(dataset_id, indexing_technique, sync=sync, delete_missing=delete_missing)
+    job.seen.update(normalize_path(path) for path in unchanged)
+    ingest_jobs.register(job.job_id, job)
+    task = asyncio.get_running_loop().create_task(_run_job(job, sources))
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+    return job
+
+
+async def plan_sync(dataset_id: str, files: Dict[str, str], delete_missing: bool = True) -> Dict[str, List[Any]]:
+    """
+    根据客户端计算的内容哈希生成同步计划（不上传文件）
+
+    客户端随后只上传 upload 中的文件，并把 unchanged 随 /sync 一起提交；
+    delete 中的文档可直接按 document_id 删除
+
+    Args:
+        files: 源文件路径 -> SHA-256
+    """
+    manifest = await manifest_service.load_manifest(dataset_id)
+    files = {normalize_path(path): content_hash for path, content_hash in files.items()}
+    plan: Dict[str, List[Any]] = {"upload": [], "unchanged": [], "delete": []}
+    for path, content_hash in files.items():
+        entry = manifest.get(path)
+        if entry is not None and entry.content_hash == content_hash.lower():
+            plan["unchanged"].append(path)
+        else:
+            plan["upload"].append(path)
+    if delete_missing:
+        plan["delete"] = [
+            {"path": path, "document_id": entry.document_id}
+            for path, entry in manifest.items()
+            if path not in files
+        ]
+    return plan
@@ -0,0 +1,625 @@
+"""
+本地关键词索引
+为通过知识库接口上传的文档建立 BM25 倒排索引，提供低延迟的关键词检索，
+并在 Dify 检索超时或熔断时作为兜底
+
+每个数据集一个索引：
+- 磁盘段：不可变的索引文件，启动时以 mmap 方式加载，倒排表与正文按需换页
+- 内存段：上次落盘之后新增的文档
+- 删除标记：磁盘段中已删除的文档，落盘时物理移除
+有变更时延迟 LEXICAL_INDEX_FLUSH_SECONDS 秒，将磁盘段与内存段合并写入新文件后原子替换
+"""
+import asyncio
+import hashlib
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import tempfile
+from array import array
+from collections import Counter, defaultdict
+from typing import IO, Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from app.config import settings
+from app.services import extract_service
+
+# 文件格式：魔数 + 头部长度 | JSON 头部 | 对齐填充 | 倒排表 (uint32 对: 分段序号, 词频) | 分段正文 (UTF-8)
+# 倒排表使用本机字节序，索引文件只在本机使用
+_MAGIC = b"OPSLEX01"
+_PREAMBLE = struct.Struct("<8sQ")
+
+# BM25 参数
+_K1 = 1.2
+_B = 0.75
+
+_TOKEN = re.compile(r"[a-z0-9_]+(?:[.\-/:][a-z0-9_]+)*|[\u4e00-\u9fff]+")
+_TOKEN_PARTS = re.compile(r"[.\-/:]")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    分词
+
+    英文、数字与路径按词切分（nginx.conf 同时产生 nginx.conf / nginx / conf），
+    中文按单字 + 相邻二字切分，无需词典
+    """
+    tokens: List[str] = []
+    for match in _TOKEN.finditer(text.lower()):
+        word = match.group()
+        if "\u4e00" <= word[0] <= "\u9fff":
+            tokens.extend(word)
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+            if _TOKEN_PARTS.search(word):
+                tokens.extend(part for part in _TOKEN_PARTS.split(word) if part)
+    return tokens
+
+
+def _analyze(chunks: List[str]) -> List[Tuple[str, Counter]]:
+    """统计每个分段的词频（CPU 密集，在线程中调用）"""
+    return [(chunk, Counter(tokenize(chunk))) for chunk in chunks]
+
+
+class _MemorySegment:
+    """内存段：上次落盘之后新增的文档"""
+
+    def __init__(self):
+        self.documents: Dict[str, str] = {}
+        self.doc_stats: Dict[str, List[int]] = {}
+        self._chunks: List[Tuple[str, int, str]] = []  # (document_id, 词数, 正文)
+        self._terms: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+
+    def add(self, document_id: str, name: str, analyzed: List[Tuple[str, Counter]]):
+        self.documents[document_id] = name
+        stats = self.doc_stats.setdefault(document_id, [0, 0])
+        for text, counts in analyzed:
+            index = len(self._chunks)
+            length = sum(counts.values())
+            self._chunks.append((document_id, length, text))
+            stats[0] += 1
+            stats[1] += length
+            for term, tf in counts.items():
+                self._terms[term].append((index, tf))
+
+    def without(self, document_id: str) -> "_MemorySegment":
+        """返回移除指定文档后的新内存段：丢弃该文档的分段与倒排项并重排分段序号，不重新分词"""
+        segment = _MemorySegment()
+        segment.documents = {doc_id: name for doc_id, name in self.documents.items() if doc_id != document_id}
+        segment.doc_stats = {doc_id: stats for doc_id, stats in self.doc_stats.items() if doc_id != document_id}
+        remap: Dict[int, int] = {}
+        for index, chunk in enumerate(self._chunks):
+            if chunk[0] != document_id:
+                remap[index] = len(segment._chunks)
+                segment._chunks.append(chunk)
+        for term, postings in self._terms.items():
+            kept = [(remap[index], tf) for index, tf in postings if index in remap]
+            if kept:
+                segment._terms[term] = kept
+        return segment
+
+    def postings(self, term: str) -> Iterable[Tuple[int, int]]:
+        return self._terms.get(term, ())
+
+    def chunk_document(self, index: int) -> str:
+        return self._chunks[index][0]
+
+    def chunk_length(self, index: int) -> int:
+        return self._chunks[index][1]
+
+    def text(self, index: int) -> str:
+        return self._chunks[index][2]
+
+    def iter_documents(self) -> Iterable[Tuple[str, str, List[str]]]:
+        texts: Dict[str, List[str]] = defaultdict(list)
+        for document_id, _, text in self._chunks:
+            texts[document_id].append(text)
+        for document_id, name in self.documents.items():
+            yield document_id, name, texts[document_id]
+
+
+class _DiskSegment:
+    """磁盘段：mmap 加载的只读索引文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+
+        magic, header_len = _PREAMBLE.unpack_from(self._mm, 0)
+        if magic != _MAGIC:
+            self.close()
+            raise ValueError(f"不是有效的索引文件: {path}")
+        header = json.loads(self._mm[_PREAMBLE.size:_PREAMBLE.size + header_len])
+
+        self.dataset_id: str = header["dataset_id"]
+        self.documents: Dict[str, str] = header["documents"]
+        self._chunks: List[List[Any]] = header["chunks"]  # [document_id, 词数, 正文偏移, 正文长度]
+        self._terms: Dict[str, List[int]] = header["terms"]  # 词 -> [倒排起始对序号, 文档频率]
+        postings_start = _align(_PREAMBLE.size + header_len)
+        self._texts_start = postings_start + header["postings_bytes"]
+        self._postings = memoryview(self._mm)[postings_start:self._texts_start].cast("I")
+
+        self.doc_stats: Dict[str, List[int]] = {}
+        for document_id, length, _, _ in self._chunks:
+            stats = self.doc_stats.setdefault(document_id, [0, 0])
+            stats[0] += 1
+            stats[1] += length
+
+    @property
+    def size_bytes(self) -> int:
+        return len(self._mm)
+
+    @property
+    def term_count(self) -> int:
+        return len(self._terms)
+
+    def postings(self, term: str) -> Iterable[Tuple[int, int]]:
+        entry = self._terms.get(term)
+        if entry is None:
+            return ()
+        start, count = entry
+        pairs = self._postings[start * 2:(start + count) * 2]
+        return zip(pairs[0::2], pairs[1::2])
+
+    def chunk_document(self, index: int) -> str:
+        return self._chunks[index][0]
+
+    def chunk_length(self, index: int) -> int:
+        return self._chunks[index][1]
+
+    def text(self, index: int) -> str:
+        _, _, offset, length = self._chunks[index]
+        start = self._texts_start + offset
+        return self._mm[start:start + length].decode("utf-8")
+
+    def iter_documents(self) -> Iterable[Tuple[str, str, List[str]]]:
+        texts: Dict[str, List[str]] = defaultdict(list)
+        for index, chunk in enumerate(self._chunks):
+            texts[chunk[0]].append(self.text(index))
+        for document_id, name in self.documents.items():
+            yield document_id, name, texts[document_id]
+
+    def close(self):
+        if getattr(self, "_postings", None) is not None:
+            self._postings.release()
+            self._postings = None
+        self._mm.close()
+        self._file.close()
+
+
+def _align(offset: int, boundary: int = 8) -> int:
+    return (offset + boundary - 1) // boundary * boundary
+
+
+def _write_segment(path: str, dataset_id: str, documents: Iterable[Tuple[str, str, List[str]]]):
+    """合并写入新的索引文件（阻塞操作，在线程中调用）"""
+    names: Dict[str, str] = {}
+    chunks: List[List[Any]] = []
+    terms: Dict[str, array] = defaultdict(lambda: array("I"))
+    texts: List[bytes] = []
+    text_offset = 0
+
+    for document_id, name, chunk_texts in documents:
+        names[document_id] = name
+        for text in chunk_texts:
+            index = len(chunks)
+            counts = Counter(tokenize(text))
+            data = text.encode("utf-8")
+            chunks.append([document_id, sum(counts.values()), text_offset, len(data)])
+            texts.append(data)
+            text_offset += len(data)
+            for term, tf in counts.items():
+                terms[term].extend((index, tf))
+
+    postings = array("I")
+    term_table: Dict[str, List[int]] = {}
+    for term, pairs in terms.items():
+        term_table[term] = [len(postings) // 2, len(pairs) // 2]
+        postings.extend(pairs)
+
+    header = json.dumps({
+        "dataset_id": dataset_id,
+        "documents": names,
+        "chunks": chunks,
+        "terms": term_table,
+        "postings_bytes": len(postings) * postings.itemsize,
+    }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_PREAMBLE.pack(_MAGIC, len(header)))
+            f.write(header)
+            f.write(b"\0" * (_align(_PREAMBLE.size + len(header)) - _PREAMBLE.size - len(header)))
+            f.write(postings.tobytes())
+            for data in texts:
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class DatasetIndex:
+    """单个数据集的索引"""
+
+    def __init__(self, dataset_id: str, path: str, base: Optional[_DiskSegment] = None):
+        self.dataset_id = dataset_id
+        self.path = path
+        self.base = base
+        self.base_deleted: Set[str] = set()
+        # 落盘期间冻结的内存段，落盘完成前仍参与检索
+        self.frozen: Optional[_MemorySegment] = None
+        self.frozen_deleted: Set[str] = set()
+        self.memory = _MemorySegment()
+
+    def _layers(self) -> List[Tuple[Any, Set[str]]]:
+        layers: List[Tuple[Any, Set[str]]] = []
+        if self.base is not None:
+            layers.append((self.base, self.base_deleted))
+        if self.frozen is not None:
+            layers.append((self.frozen, self.frozen_deleted))
+        layers.append((self.memory, set()))
+        return layers
+
+    def contains(self, document_id: str) -> bool:
+        return any(
+            document_id in segment.documents and document_id not in deleted
+            for segment, deleted in self._layers()
+        )
+
+    def live_stats(self) -> Tuple[int, int, int]:
+        """(文档数, 分段数, 总词数)"""
+        documents = chunks = tokens = 0
+        for segment, deleted in self._layers():
+            for document_id, (chunk_count, length) in segment.doc_stats.items():
+                if document_id not in deleted:
+                    documents += 1
+                    chunks += chunk_count
+                    tokens += length
+        return documents, chunks, tokens
+
+    def add(self, document_id: str, name: str, analyzed: List[Tuple[str, Counter]]):
+        self.remove(document_id)
+        self.memory.add(document_id, name, analyzed)
+
+    def remove(self, document_id: str) -> bool:
+        removed = False
+        if self.base is not None and document_id in self.base.documents and document_id not in self.base_deleted:
+            self.base_deleted.add(document_id)
+            removed = True
+        if self.frozen is not None and document_id in self.frozen.documents and document_id not in self.frozen_deleted:
+            self.frozen_deleted.add(document_id)
+            removed = True
+        if document_id in self.memory.documents:
+            self.memory = self.memory.without(document_id)
+            removed = True
+        return removed
+
+    def search(self, query: str, top_k: int) -> List[Tuple[float, str, str, str]]:
+        """BM25 检索，返回 [(分数, document_id, 文档名, 分段正文)]"""
+        _, total_chunks, total_tokens = self.live_stats()
+        terms = set(tokenize(query))
+        if not total_chunks or not terms:
+            return []
+        avg_length = total_tokens / total_chunks
+        layers = self._layers()
+
+        scores: Dict[Tuple[int, int], float] = defaultdict(float)
+        for term in terms:
+            hits = []
+            for layer, (segment, deleted) in enumerate(layers):
+                for index, tf in segment.postings(term):
+                    if deleted and segment.chunk_document(index) in deleted:
+                        continue
+                    hits.append((layer, index, tf, segment.chunk_length(index)))
+            if not hits:
+                continue
+            df = len(hits)
+            idf = math.log(1 + (total_chunks - df + 0.5) / (df + 0.5))
+            for layer, index, tf, length in hits:
+                scores[(layer, index)] += idf * tf * (_K1 + 1) / (
+                    tf + _K1 * (1 - _B + _B * length / avg_length)
+                )
+
+        results = []
+        for (layer, index), score in heapq.nlargest(top_k, scores.items(), key=lambda item: item[1]):
+            segment = layers[layer][0]
+            document_id = segment.chunk_document(index)
+            results.append((score, document_id, segment.documents[document_id], segment.text(index)))
+        return results
+
+    def snapshot_documents(self) -> List[Tuple[str, str, List[str]]]:
+        """收集落盘所需的全部存活文档（此时内存段已冻结）"""
+        documents = []
+        for segment, deleted in self._layers()[:-1]:
+            for document_id, name, texts in segment.iter_documents():
+                if document_id not in deleted:
+                    documents.append((document_id, name, texts))
+        return documents
+
+    def close(self):
+        if self.base is not None:
+            self.base.close()
+            self.base = None
+
+
+class LexicalIndex:
+    """所有数据集的本地关键词索引"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._datasets: Dict[str, DatasetIndex] = {}
+        self._dirty: Set[str] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._tasks: Set[asyncio.Task] = set()
+        # 索引文件在启动预热阶段加载，加载完成前的写入需要等待
+        self._loaded = asyncio.Event()
+        self._pending_removals: List[Tuple[str, str]] = []
+        self.searches = 0
+        self.fallbacks = 0
+        self.indexed = 0
+        self.index_failures = 0
+
+    def _path(self, dataset_id: str) -> str:
+        safe = re.sub(r"[^A-Za-z0-9_-]", "_", dataset_id)
+        if safe != dataset_id:
+            safe = f"{safe[:48]}-{hashlib.sha1(dataset_id.encode('utf-8')).hexdigest()[:12]}"
+        return os.path.join(self.directory, f"{safe}.idx")
+
+    def _dataset(self, dataset_id: str) -> DatasetIndex:
+        index = self._datasets.get(dataset_id)
+        if index is None:
+            index = DatasetIndex(dataset_id, self._path(dataset_id))
+            self._datasets[dataset_id] = index
+        return index
+
+    async def load(self):
+        """
+        启动时以 mmap 方式加载所有索引文件
+
+        加载失败时已加载的数据集照常使用，其余数据集从空索引开始，等待中的写入不会被一直阻塞
+        """
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for filename in sorted(os.listdir(self.directory)):
+                path = os.path.join(self.directory, filename)
+                if filename.endswith(".tmp"):
+                    os.unlink(path)
+                    continue
+                if not filename.endswith(".idx"):
+                    continue
+                try:
+                    segment = await asyncio.to_thread(_DiskSegment, path)
+                except Exception as e:
+                    logger.warning(f"跳过损坏的关键词索引文件: {filename} | {e}")
+                    continue
+                self._datasets[segment.dataset_id] = DatasetIndex(segment.dataset_id, path, segment)
+        except Exception as e:
+            logger.error(f"本地关键词索引加载失败: {e}")
+        finally:
+            self._loaded.set()
+            for dataset_id, document_id in self._pending_removals:
+                self.remove_document(dataset_id, document_id)
+            self._pending_removals.clear()
+        if self._datasets:
+            documents = sum(index.live_stats()[0] for index in self._datasets.values())
+            logger.info(f"本地关键词索引已加载 | 数据集: {len(self._datasets)} | 文档: {documents}")
+
+    def has_dataset(self, dataset_id: str) -> bool:
+        index = self._datasets.get(dataset_id)
+        return index is not None and index.live_stats()[1] > 0
+
+    async def add_document(self, dataset_id: str, document_id: str, name: str, chunks: List[str]):
+        analyzed = await asyncio.to_thread(_analyze, chunks)
+        await self._loaded.wait()
+        self._dataset(dataset_id).add(document_id, name, analyzed)
+        self.indexed += 1
+        self._mark_dirty(dataset_id)
+
+    def remove_document(self, dataset_id: str, document_id: str):
+        if not settings.LEXICAL_INDEX_ENABLED:
+            return
+        if not self._loaded.is_set():
+            self._pending_removals.append((dataset_id, document_id))
+            return
+        index = self._datasets.get(dataset_id)
+        if index is not None and index.remove(document_id):
+            self._mark_dirty(dataset_id)
+
+    async def index_upload(
+        self,
+        dataset_id: str,
+        document_id: str,
+        filename: str,
+        content_type: str,
+        fileobj: IO[bytes],
+    ):
+        """
+        复制已上传的文件并在后台提取文本、建立索引（返回后调用方即可关闭 fileobj）
+
+        在 Dify 接受文档之后调用，失败只记录日志，不影响上传结果
+        """
+        try:
+            path = await asyncio.to_thread(
+                extract_service.copy_to_named_file, fileobj, os.path.splitext(filename)[1]
+            )
+        except Exception as e:
+            self._index_failed(filename, e)
+            return
+        self._spawn(self._index_file(dataset_id, document_id, filename, content_type, path))
+
+    def index_chunks(self, dataset_id: str, document_id: str, name: str, chunks: List[str]):
+        """使用上传时已在本地提取的分段，在后台建立索引"""
+        self._spawn(self._index_chunks(dataset_id, document_id, name, chunks))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _index_failed(self, name: str, error: Exception):
+        self.index_failures += 1
+        logger.warning(f"关键词索引建立失败: {name} | {error}")
+
+    async def _index_chunks(self, dataset_id: str, document_id: str, name: str, chunks: List[str]):
+        try:
+            await self.add_document(dataset_id, document_id, name, chunks)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._index_failed(name, e)
+
+    async def _index_file(self, dataset_id: str, document_id: str, filename: str, content_type: str, path: str):
+        try:
+            chunks = await extract_service.extract_document(path, content_type)
+            if chunks:
+                await self.add_document(dataset_id, document_id, filename, chunks)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._index_failed(filename, e)
+        finally:
+            os.unlink(path)
+
+    def search(self, dataset_id: str, query: str, top_k: int) -> List[Dict[str, Any]]:
+        """
+        关键词检索，返回与 Dify retrieve 相同结构的 records
+
+        score 为 BM25 分数除以本次结果最高分，落在 (0, 1]，只用于本次结果内部排序，
+        与 Dify 的语义检索分数不可比，也不应与 score_threshold 比较
+        """
+        self.searches += 1
+        index = self._datasets.get(dataset_id)
+        if index is None:
+            return []
+        results = index.search(query, top_k)
+        if not results:
+            return []
+        top_score = results[0][0]
+        return [
+            {
+                "segment": {
+                    "content": text,
+                    "document_id": document_id,
+                    "document": {"id": document_id, "name": name},
+                },
+                "score": round(score / top_score, 4),
+                "bm25": round(score, 4),
+                "source": "local",
+            }
+            for score, document_id, name, text in results
+        ]
+
+    def fallback(self, dataset_id: str, query: str, top_k: int) -> Dict[str, Any]:
+        """Dify 检索不可用时的兜底结果（分数与 Dify 不可比，未应用 score_threshold）"""
+        self.fallbacks += 1
+        return {
+            "query": {"content": query},
+            "records": self.search(dataset_id, query, top_k),
+            "fallback": "local",
+            "score_threshold_applied": False,
+        }
+
+    def _mark_dirty(self, dataset_id: str):
+        self._dirty.add(dataset_id)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(settings.LEXICAL_INDEX_FLUSH_SECONDS)
+        # 已开始的落盘不随任务取消中断，关闭时由 close() 等待其完成
+        await asyncio.shield(self.flush())
+
+    async def flush(self):
+        """将有变更的数据集合并写入磁盘"""
+        async with self._flush_lock:
+            while self._dirty:
+                dataset_id = self._dirty.pop()
+                try:
+                    await self._flush_dataset(self._datasets[dataset_id])
+                except Exception as e:
+                    logger.exception(f"关键词索引落盘失败: {dataset_id} | {e}")
+
+    async def _flush_dataset(self, index: DatasetIndex):
+        # 冻结内存段，落盘期间的新增写入新的内存段，删除记录在各段的删除标记中
+        index.frozen, index.memory = index.memory, _MemorySegment()
+        index.frozen_deleted = set()
+        flushed_deleted = set(index.base_deleted)
+        try:
+            documents = await asyncio.to_thread(index.snapshot_documents)
+            if documents:
+                await asyncio.to_thread(_write_segment, index.path, index.dataset_id, documents)
+                segment = await asyncio.to_thread(_DiskSegment, index.path)
+            else:
+                segment = None
+                if os.path.exists(index.path):
+                    os.unlink(index.path)
+        except BaseException:
+            # 落盘失败：把冻结段合并回内存段，保留全部数据
+            for document_id, name, texts in index.frozen.iter_documents():
+                if document_id not in index.frozen_deleted and document_id not in index.memory.documents:
+                    index.memory.add(document_id, name, _analyze(texts))
+            index.frozen, index.frozen_deleted = None, set()
+            self._dirty.add(index.dataset_id)
+            raise
+
+        old_base = index.base
+        index.base = segment
+        # 落盘期间发生的删除仍作用于新的磁盘段
+        index.base_deleted = (index.base_deleted - flushed_deleted) | index.frozen_deleted
+        index.frozen, index.frozen_deleted = None, set()
+        if old_base is not None:
+            old_base.close()
+
+    def stats(self) -> Dict[str, Any]:
+        datasets = {}
+        for dataset_id, index in self._datasets.items():
+            documents, chunks, tokens = index.live_stats()
+            datasets[dataset_id] = {
+                "documents": documents,
+                "chunks": chunks,
+                "tokens": tokens,
+                "terms_on_disk": index.base.term_count if index.base else 0,
+                "bytes_on_disk": index.base.size_bytes if index.base else 0,
+                "pending_documents": len(index.memory.documents),
+            }
+        return {
+            "enabled": settings.LEXICAL_INDEX_ENABLED,
+            "loaded": self._loaded.is_set(),
+            "datasets": datasets,
+            "indexed": self.indexed,
+            "index_failures": self.index_failures,
+            "indexing": len(self._tasks),
+            "searches": self.searches,
+            "fallbacks": self.fallbacks,
+        }
+
+    async def close(self):
+        """取消未完成的索引任务并落盘"""
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        await self.flush()
+        for index in self._datasets.values():
+            index.close()
+
+
+lexical_index = LexicalIndex(settings.LEXICAL_INDEX_DIR)
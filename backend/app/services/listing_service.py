@@ -0,0 +1,146 @@
+"""
+Dify 列表分页遍历
+在服务端遍历知识库 / 文档列表的全部分页，下一页在当前页输出期间预取，
+完整结果短时间缓存，重复查看时直接返回
+"""
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+
+from app.config import settings
+from app.services.dify_client import dify_request
+from app.services.shared_state import SharedCache
+
+# 默认输出字段（fields=* 时输出完整对象）
+DATASET_FIELDS = ("id", "name", "description", "document_count", "word_count", "updated_at")
+DOCUMENT_FIELDS = ("id", "name", "word_count", "hit_count", "indexing_status", "enabled", "created_at")
+
+# Dify 列表接口单页上限
+_MAX_PAGE_SIZE = 100
+
+
+def parse_fields(fields: Optional[str], default: Sequence[str]) -> Optional[List[str]]:
+    """解析逗号分隔的字段列表，返回 None 表示输出完整对象"""
+    if fields is None:
+        return list(default)
+    if fields.strip() == "*":
+        return None
+    return [field.strip() for field in fields.split(",") if field.strip()]
+
+
+def project(item: Dict[str, Any], fields: Optional[List[str]]) -> Dict[str, Any]:
+    if fields is None:
+        return item
+    return {field: item.get(field) for field in fields}
+
+
+class ListingCache:
+    """列表缓存，按数据集维护版本号，文档变更后对应列表立即失效"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = SharedCache("listing", maxsize=maxsize, ttl=ttl)
+
+    @staticmethod
+    def _key(path: str, params: Dict[str, Any]):
+        return (path, tuple(sorted(params.items())))
+
+    async def lookup(self, path: str, params: Dict[str, Any], scope: str) -> Tuple[Optional[List[Dict[str, Any]]], int]:
+        """返回 (缓存的列表, 版本号)"""
+        return await self._cache.lookup(self._key(path, params), scope)
+
+    async def set(self, path: str, params: Dict[str, Any], scope: str, items: List[Dict[str, Any]], generation: int):
+        await self._cache.set(self._key(path, params), items, generation, scope)
+
+    async def invalidate(self, dataset_id: str):
+        """文档上传或删除后调用：该数据集的文档列表与知识库列表（文档数变化）均失效"""
+        await self._cache.invalidate(dataset_id, "")
+
+    def stats(self) -> Dict[str, Any]:
+        return self._cache.stats()
+
+
+listing_cache = ListingCache(maxsize=64, ttl=settings.LISTING_CACHE_TTL)
+
+
+async def _fetch_page(path: str, params: Dict[str, Any], page: int, limit: int) -> Dict[str, Any]:
+    response = await dify_request(
+        "GET",
+        path,
+        endpoint="datasets",
+        idempotent=True,
+        params={**params, "page": page, "limit": limit},
+    )
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail=response.text)
+    return response.json()
+
+
+async def iter_pages(path: str, params: Dict[str, Any], page_size: int) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    逐页遍历 Dify 列表接口
+
+    当前页交给调用方处理时，下一页请求已经发出
+    """
+    limit = max(1, min(page_size, _MAX_PAGE_SIZE))
+    page = 1
+    next_page: Optional[asyncio.Future] = asyncio.ensure_future(_fetch_page(path, params, page, limit))
+    try:
+        while next_page is not None:
+            body = await next_page
+            next_page = None
+            items = body.get("data") or []
+            if body.get("has_more") and items and page < settings.LISTING_MAX_PAGES:
+                page += 1
+                next_page = asyncio.ensure_future(_fetch_page(path, params, page, limit))
+            yield items
+    finally:
+        if next_page is not None:
+            next_page.cancel()
+
+
+class Listing:
+    """
+    一次完整的列表遍历
+
+    调用 start() 获取首页（错误在开始输出前以 HTTP 状态码返回），之后迭代剩余分页
+    """
+
+    def __init__(self, path: str, params: Dict[str, Any], scope: str):
+        self.path = path
+        self.params = params
+        self.scope = scope
+        self.cached = False
+        self.pages = 0
+        self._pages: Optional[AsyncIterator[List[Dict[str, Any]]]] = None
+        self._first: List[Dict[str, Any]] = []
+        self._generation = 0
+
+    async def start(self):
+        cached, self._generation = await listing_cache.lookup(self.path, self.params, self.scope)
+        if cached is not None:
+            self.cached = True
+            self._first = cached
+            return
+        self._pages = iter_pages(self.path, self.params, settings.LISTING_PAGE_SIZE)
+        try:
+            self._first = await self._pages.__anext__()
+        except BaseException:
+            await self._pages.aclose()
+            raise
+        self.pages = 1
+
+    async def __aiter__(self) -> AsyncIterator[List[Dict[str, Any]]]:
+        """逐页输出；完整遍历后写入缓存"""
+        yield self._first
+        if self._pages is None:
+            return
+        collected = list(self._first)
+        try:
+            async for items in self._pages:
+                self.pages += 1
+                collected.extend(items)
+                yield items
+        finally:
+            await self._pages.aclose()
+        await listing_cache.set(self.path, self.params, self.scope, collected, self._generation)
@@ -0,0 +1,91 @@
+"""
+知识库同步清单
+记录每个数据集中源文件路径、内容哈希与 Dify 文档 ID 的对应关系，用于增量同步
+"""
+import time
+from typing import Dict, Iterable
+
+from sqlalchemy import Table, Column, String, Integer, Index, select, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.database import metadata, get_engine
+
+
+knowledge_manifest = Table(
+    "knowledge_manifest",
+    metadata,
+    Column("dataset_id", String(64), primary_key=True),
+    Column("source_path", String(1024), primary_key=True),
+    Column("content_hash", String(64), nullable=False),
+    Column("document_id", String(64), nullable=False),
+    Column("size", Integer, nullable=False),
+    Column("updated_at", Integer, nullable=False),
+    Index("ix_knowledge_manifest_document", "dataset_id", "document_id"),
+)
+
+
+class ManifestEntry:
+    """清单中的一条记录"""
+
+    def __init__(self, source_path: str, content_hash: str, document_id: str, size: int):
+        self.source_path = source_path
+        self.content_hash = content_hash
+        self.document_id = document_id
+        self.size = size
+
+
+async def load_manifest(dataset_id: str) -> Dict[str, ManifestEntry]:
+    """读取数据集的完整清单，按源文件路径索引"""
+    async with get_engine().connect() as conn:
+        rows = (await conn.execute(
+            select(
+                knowledge_manifest.c.source_path,
+                knowledge_manifest.c.content_hash,
+                knowledge_manifest.c.document_id,
+                knowledge_manifest.c.size,
+            ).where(knowledge_manifest.c.dataset_id == dataset_id)
+        )).all()
+    return {
+        row.source_path: ManifestEntry(row.source_path, row.content_hash, row.document_id, row.size)
+        for row in rows
+    }
+
+
+async def upsert_entry(dataset_id: str, entry: ManifestEntry):
+    """新增或更新一条记录"""
+    values = {
+        "dataset_id": dataset_id,
+        "source_path": entry.source_path,
+        "content_hash": entry.content_hash,
+        "document_id": entry.document_id,
+        "size": entry.size,
+        "updated_at": int(time.time()),
+    }
+    statement = sqlite_insert(knowledge_manifest).values(**values)
+    statement = statement.on_conflict_do_update(
+        index_elements=["dataset_id", "source_path"],
+        set_={k: statement.excluded[k] for k in ("content_hash", "document_id", "size", "updated_at")},
+    )
+    async with get_engine().begin() as conn:
+        await conn.execute(statement)
+
+
+async def remove_paths(dataset_id: str, source_paths: Iterable[str]):
+    """删除指定源文件路径的记录"""
+    paths = list(source_paths)
+    if not paths:
+        return
+    async with get_engine().begin() as conn:
+        await conn.execute(delete(knowledge_manifest).where(
+            knowledge_manifest.c.dataset_id == dataset_id,
+            knowledge_manifest.c.source_path.in_(paths),
+        ))
+
+
+async def forget_document(dataset_id: str, document_id: str):
+    """文档在 Dify 中被删除后移除对应记录，下次同步会重新上传"""
+    async with get_engine().begin() as conn:
+        await conn.execute(delete(knowledge_manifest).where(
+            knowledge_manifest.c.dataset_id == dataset_id,
+            knowledge_manifest.c.document_id == document_id,
+        ))
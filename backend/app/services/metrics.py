@@ -0,0 +1,260 @@
+"""
+运行指标
+轻量的 Prometheus 文本格式指标（计数器、仪表、直方图），不依赖 prometheus_client
+
+每组标签对应的子指标首次使用时创建并缓存，直方图的桶在创建时一次性分配，
+记录一次观测只是一次二分查找加几次整数累加，可以在生产环境常开
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+# 默认延迟桶（秒）：覆盖毫秒级本地调用到分钟级远程命令
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    TYPE = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} 需要标签 {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        for values, child in list(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values: Tuple[str, ...], child) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class _Value:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    TYPE = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    TYPE = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self.labels().dec(amount)
+
+    @contextmanager
+    def track(self, *values: str) -> Iterator[None]:
+        """进入时 +1，退出时 -1"""
+        child = self.labels(*values)
+        child.inc()
+        try:
+            yield
+        finally:
+            child.dec()
+
+
+class _HistogramValue:
+    __slots__ = ("upper_bounds", "counts", "sum", "_lock")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self.upper_bounds = upper_bounds
+        # 最后一个桶为 +Inf
+        self.counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.upper_bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    TYPE = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float, *values: str):
+        self.labels(*values).observe(value)
+
+    @contextmanager
+    def time(self, *values: str) -> Iterator[None]:
+        """记录代码块耗时（异常时同样记录）"""
+        child = self.labels(*values)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            child.observe(time.perf_counter() - started)
+
+    def _render_child(self, values: Tuple[str, ...], child: _HistogramValue) -> List[str]:
+        with child._lock:
+            counts = list(child.counts)
+            total = child.sum
+        lines = []
+        cumulative = 0
+        for upper, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, f'le="{_format_value(upper)}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+
+def render() -> str:
+    """导出全部指标（Prometheus 文本格式 0.0.4）"""
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------- HTTP ----------
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP 请求数", ("method", "route", "status"),
+)
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP 请求耗时（至响应结束）", ("method", "route"),
+)
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "处理中的 HTTP 请求数",
+)
+HTTP_COMPRESSION_BYTES = Counter(
+    "http_compression_bytes_total", "压缩响应体的字节数：stage=in 为压缩前，out 为压缩后", ("encoding", "stage"),
+)
+
+# ---------- SSH ----------
+
+SSH_PHASE_LATENCY = Histogram(
+    "ssh_phase_duration_seconds",
+    "SSH 各阶段耗时：connect=TCP 连接，auth=握手与认证，exec=打开通道并发送命令，read=读取输出直至退出",
+    ("phase",),
+)
+SSH_PHASE_ERRORS = Counter(
+    "ssh_phase_errors_total", "SSH 各阶段失败次数", ("phase",),
+)
+SSH_SESSIONS_IN_FLIGHT = Gauge(
+    "ssh_sessions_in_flight", "进行中的 SSH 会话数",
+)
+SSH_CANCELLED = Counter(
+    "ssh_operations_cancelled_total",
+    "被取消的 SSH 操作数：disconnect=客户端断开，deadline=超过期限，cancelled=请求任务被取消",
+    ("reason",),
+)
+SSH_ORPHANED = Gauge(
+    "ssh_orphaned_operations", "调用方已取消、仍占用工作线程的 SSH 操作数",
+)
+SSH_ORPHANS_RECLAIMED = Counter(
+    "ssh_orphans_reclaimed_total", "调用方取消后释放的工作线程数",
+)
+SSH_RECLAIM_LATENCY = Histogram(
+    "ssh_orphan_reclaim_seconds", "从调用方取消到工作线程释放的耗时",
+)
+SSH_HOST_FAST_FAILS = Counter(
+    "ssh_host_fast_failures_total", "主机处于连接失败退避期、未发起连接直接失败的请求数",
+)
+
+# ---------- Dify ----------
+
+DIFY_LATENCY = Histogram(
+    "dify_request_duration_seconds", "Dify 非流式请求耗时（含重试）", ("endpoint", "outcome"),
+)
+DIFY_TTFB = Histogram(
+    "dify_ttfb_seconds", "Dify 流式请求首字节（响应头）耗时", ("endpoint",),
+)
+DIFY_FIRST_TOKEN = Histogram(
+    "dify_first_token_seconds", "对话流式请求首个事件耗时", ("endpoint",),
+)
+DIFY_IN_FLIGHT = Gauge(
+    "dify_requests_in_flight", "进行中的 Dify 请求数", ("endpoint",),
+)
+
+# ---------- 准入控制 ----------
+
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total", "因过载被拒绝的请求数", ("resource", "priority"),
+)
@@ -0,0 +1,267 @@
+"""
+采样剖析
+由独立线程定时读取 sys._current_frames() 采集调用栈，输出折叠栈格式
+（每行 `帧;帧;帧 次数`，可直接交给 flamegraph.pl / speedscope 生成火焰图）
+
+两种模式：
+- 进程模式：在限定时长内采样所有线程
+- 请求模式：只采样匹配路由的后续 N 个请求在事件循环上执行的调用栈。
+  剖析期间临时安装 task factory，把请求派生的子任务（如流式响应）一并归属到该请求
+
+未在剖析时只有中间件中的一次属性判断，没有采样线程
+"""
+import asyncio
+import sys
+import threading
+import time
+import uuid
+import weakref
+from collections import Counter
+from contextvars import ContextVar
+from types import CodeType, FrameType
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from loguru import logger
+from starlette.routing import compile_path
+
+_MAX_DEPTH = 128
+
+# 阻塞等待中的线程（调用栈叶子帧），默认不计入；
+# 使用 uvloop 时事件循环本身没有 Python 帧，空闲时叶子帧停在 asyncio.run
+_IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("runners.py", "run"),
+    ("thread.py", "_worker"),
+    ("queue.py", "get"),
+}
+
+_labels: Dict[CodeType, str] = {}
+
+
+def _frame_label(code: CodeType) -> str:
+    label = _labels.get(code)
+    if label is None:
+        filename = code.co_filename.replace("\\", "/")
+        short = "/".join(filename.rsplit("/", 2)[-2:])
+        label = f"{code.co_name} ({short}:{code.co_firstlineno})"
+        _labels[code] = label
+    return label
+
+
+def _walk(frame: Optional[FrameType]) -> Tuple[str, ...]:
+    """从叶子帧向上遍历，返回根在前的帧标签"""
+    stack = []
+    while frame is not None and len(stack) < _MAX_DEPTH:
+        stack.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+def _is_idle(frame: FrameType) -> bool:
+    code = frame.f_code
+    return (code.co_filename.rsplit("/", 1)[-1], code.co_name) in _IDLE_LEAVES
+
+
+class Sampler:
+    """采样线程基类"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.ticks = 0
+        self.samples = 0
+        self.started_at = time.time()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.ticks += 1
+            try:
+                self.collect(sys._current_frames(), own)
+            except Exception as e:
+                logger.warning(f"采样失败: {e}")
+
+    def collect(self, frames: Dict[int, FrameType], own: int):
+        raise NotImplementedError
+
+    def collapsed(self) -> str:
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ProcessSampler(Sampler):
+    """采样所有线程，栈根为线程名"""
+
+    def __init__(self, interval: float, include_idle: bool = False):
+        super().__init__(interval)
+        self.include_idle = include_idle
+
+    def collect(self, frames: Dict[int, FrameType], own: int):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in frames.items():
+            if ident == own or (not self.include_idle and _is_idle(frame)):
+                continue
+            self.stacks[(names.get(ident, str(ident)),) + _walk(frame)] += 1
+            self.samples += 1
+
+
+# 请求模式下标记当前上下文属于哪个被剖析的请求，子任务创建时据此登记
+_request_label: ContextVar[Optional[str]] = ContextVar("profile_request", default=None)
+
+
+class RequestSession(Sampler):
+    """剖析匹配路由的后续 N 个请求"""
+
+    def __init__(self, route: str, count: int, timeout: float, interval: float, loop: asyncio.AbstractEventLoop):
+        super().__init__(interval)
+        self.id = uuid.uuid4().hex[:12]
+        self.route = route
+        self.count = count
+        self.deadline = time.monotonic() + timeout
+        self.claimed = 0
+        self.completed = 0
+        self.state = "running"
+        self._regex = compile_path(route)[0]
+        self._loop = loop
+        self._loop_thread = threading.get_ident()
+        self._tasks: "weakref.WeakKeyDictionary[asyncio.Task, str]" = weakref.WeakKeyDictionary()
+        self._previous_factory = loop.get_task_factory()
+        self.on_finish: Optional[Callable[["RequestSession"], None]] = None
+
+    def start(self):
+        self._loop.set_task_factory(self._task_factory)
+        super().start()
+
+    def _task_factory(self, loop, coro, **kwargs):
+        if self._previous_factory is not None:
+            task = self._previous_factory(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        label = _request_label.get()
+        if label is not None:
+            self._tasks[task] = label
+        return task
+
+    def claim(self, scope: Dict[str, Any]) -> Optional[str]:
+        """请求到达时调用，匹配且名额未满时返回标签"""
+        if self.state != "running" or self.claimed >= self.count:
+            return None
+        if not self._regex.match(scope["path"]):
+            return None
+        self.claimed += 1
+        return f"{scope['method']} {scope['path']}"
+
+    def enter(self, label: str):
+        task = asyncio.current_task()
+        if task is not None:
+            self._tasks[task] = label
+        return _request_label.set(label)
+
+    def exit(self, token):
+        _request_label.reset(token)
+        task = asyncio.current_task()
+        if task is not None:
+            self._tasks.pop(task, None)
+        self.completed += 1
+        if self.completed >= self.count:
+            self.finish("completed")
+
+    def collect(self, frames: Dict[int, FrameType], own: int):
+        if time.monotonic() > self.deadline:
+            self._loop.call_soon_threadsafe(self.finish, "timeout")
+            self._stop.set()
+            return
+        task = asyncio.tasks._current_tasks.get(self._loop)
+        label = self._tasks.get(task) if task is not None else None
+        frame = frames.get(self._loop_thread)
+        if label is None or frame is None:
+            return
+        self.stacks[(label,) + _walk(frame)] += 1
+        self.samples += 1
+
+    def finish(self, state: str):
+        """结束剖析（在事件循环线程调用）"""
+        if self.state != "running":
+            return
+        self.state = state
+        if self._loop.get_task_factory() == self._task_factory:
+            self._loop.set_task_factory(self._previous_factory)
+        self.stop()
+        if self.on_finish is not None:
+            self.on_finish(self)
+        logger.info(f"请求剖析结束 | {self.route} | 状态: {state} | 请求: {self.completed} | 样本: {self.samples}")
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "route": self.route,
+            "state": self.state,
+            "count": self.count,
+            "claimed": self.claimed,
+            "completed": self.completed,
+            "samples": self.samples,
+            "interval_ms": round(self.interval * 1000, 2),
+            "started_at": self.started_at,
+        }
+
+
+class Profiler:
+    """同一时间只允许一个剖析任务"""
+
+    def __init__(self):
+        # 进行中的请求剖析，中间件只判断该属性
+        self.session: Optional[RequestSession] = None
+        # 最近一次请求剖析（含已结束的），用于查询结果
+        self.last: Optional[RequestSession] = None
+        self._process_running = False
+
+    @property
+    def busy(self) -> bool:
+        return self._process_running or self.session is not None
+
+    async def profile_process(self, seconds: float, interval: float, include_idle: bool) -> ProcessSampler:
+        if self.busy:
+            raise RuntimeError("已有剖析任务在进行")
+        self._process_running = True
+        sampler = ProcessSampler(interval, include_idle)
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            sampler.stop()
+            self._process_running = False
+        return sampler
+
+    def start_requests(self, route: str, count: int, timeout: float, interval: float) -> RequestSession:
+        if self.busy:
+            raise RuntimeError("已有剖析任务在进行")
+        session = RequestSession(route, count, timeout, interval, asyncio.get_running_loop())
+        session.on_finish = self._on_finish
+        session.start()
+        self.session = session
+        self.last = session
+        logger.info(f"请求剖析开始 | {route} | 请求数: {count}")
+        return session
+
+    def stop_requests(self) -> Optional[RequestSession]:
+        if self.session is not None:
+            self.session.finish("stopped")
+        return self.last
+
+    def _on_finish(self, session: RequestSession):
+        if self.session is session:
+            self.session = None
+
+
+profiler = Profiler()
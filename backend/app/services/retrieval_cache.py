@@ -0,0 +1,86 @@
+"""
+知识库检索缓存
+缓存 Dify retrieve 结果，按数据集维护版本号，文档上传或删除后该数据集的旧结果立即失效
+"""
+import time
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from app.config import settings
+from app.services.answer_cache import normalize_query
+from app.services.cache import SingleFlight
+from app.services.shared_state import SharedCache
+
+
+class RetrievalCache:
+    """检索结果缓存（LRU + TTL + single-flight）"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        # 按数据集维护版本号；递增后旧条目不会再被命中，随 LRU / TTL 自然淘汰
+        self._cache = SharedCache("retrieval", maxsize=maxsize, ttl=ttl)
+        self._flight = SingleFlight()
+        self.invalidations = 0
+        self.latency_saved = 0.0
+
+    @staticmethod
+    def make_key(dataset_id: str, query: str, top_k: int, score_threshold: float) -> Tuple:
+        """缓存 key = 数据集 + 规范化查询 + top_k + 阈值"""
+        return (
+            dataset_id,
+            normalize_query(query),
+            top_k,
+            round(score_threshold, 4),
+        )
+
+    async def get_or_fetch(
+        self,
+        dataset_id: str,
+        query: str,
+        top_k: int,
+        score_threshold: float,
+        fetch: Callable[[], Awaitable[Any]],
+    ) -> Tuple[Any, bool]:
+        """
+        读取缓存，未命中时调用 fetch 并回填
+
+        Returns:
+            (value, hit)
+        """
+        key = self.make_key(dataset_id, query, top_k, score_threshold)
+        cached, generation = await self._cache.lookup(key, scope=dataset_id)
+        if cached is not None:
+            value, fetch_seconds = cached
+            self.latency_saved += fetch_seconds
+            return value, True
+
+        async def load():
+            started = time.perf_counter()
+            result = await fetch()
+            # 请求期间数据集发生变更时，以旧版本号写入的结果不会被命中
+            await self._cache.set(key, (result, time.perf_counter() - started), generation, scope=dataset_id)
+            return result
+
+        return await self._flight.do((generation, key), load), False
+
+    async def invalidate(self, dataset_id: str):
+        """数据集内容变化时调用"""
+        self.invalidations += 1
+        await self._cache.invalidate(dataset_id)
+
+    async def clear(self):
+        await self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": settings.RETRIEVAL_CACHE_ENABLED,
+            **self._cache.stats(),
+            "coalesced": self._flight.coalesced,
+            "in_flight": self._flight.in_flight,
+            "invalidations": self.invalidations,
+            "latency_saved_ms": round(self.latency_saved * 1000, 1),
+        }
+
+
+retrieval_cache = RetrievalCache(
+    maxsize=settings.RETRIEVAL_CACHE_MAX_ENTRIES,
+    ttl=settings.RETRIEVAL_CACHE_TTL,
+)
@@ -0,0 +1,299 @@
+"""
+共享运行时状态
+未配置 REDIS_URL 时保存在进程内（单 worker）；配置后存放在 Redis，多个 uvicorn worker 共享缓存与任务进度
+
+- SharedCache：带版本号的 LRU + TTL 缓存（答案、检索结果、列表）。条目写入时记录版本号，
+  读取时与当前版本号在同一次往返中比对，任一 worker 失效后其他 worker 立即不再命中旧条目
+- SharedRegistry：任务 / 上传进度登记。对象由创建它的 worker 持有并更新，
+  配置 Redis 时定期发布 snapshot()，其他 worker 读取发布的快照
+
+Redis 不可用时缓存按未命中处理、进度查询只能查到本 worker 的记录，请求本身不受影响。
+缓存值以 JSON 序列化，只能存放 JSON 结构的数据（元组读回后为列表）。
+"""
+import asyncio
+import hashlib
+import json
+import time
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from loguru import logger
+
+from app.config import settings
+from app.services.cache import TTLCache
+
+# 进度快照发布间隔（秒），即其他 worker 看到的进度最大延迟
+_PUBLISH_INTERVAL = 1.0
+_SCAN_BATCH = 500
+
+
+class RedisBackend:
+    """Redis 连接（首次使用时创建），key 统一加前缀"""
+
+    def __init__(self, url: str, prefix: str):
+        self.url = url
+        self.prefix = prefix
+        self.errors = 0
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            # 与 paramiko 相同，单 worker 部署不需要导入 redis
+            import redis.asyncio as redis
+
+            self._client = redis.Redis.from_url(
+                self.url,
+                socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+            )
+        return self._client
+
+    def key(self, *parts: str) -> str:
+        return ":".join((self.prefix, *parts))
+
+    def failed(self, action: str, error: Exception):
+        self.errors += 1
+        logger.warning(f"Redis {action}失败: {type(error).__name__}: {error}")
+
+    async def delete_pattern(self, pattern: str):
+        batch: List[bytes] = []
+        async for key in self.client.scan_iter(match=pattern, count=_SCAN_BATCH):
+            batch.append(key)
+            if len(batch) >= _SCAN_BATCH:
+                await self.client.unlink(*batch)
+                batch = []
+        if batch:
+            await self.client.unlink(*batch)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+redis_backend: Optional[RedisBackend] = (
+    RedisBackend(settings.REDIS_URL, settings.REDIS_KEY_PREFIX) if settings.REDIS_URL else None
+)
+
+
+def backend_name() -> str:
+    return "redis" if redis_backend is not None else "memory"
+
+
+def _key_string(key: Hashable) -> str:
+    if isinstance(key, str):
+        return key
+    raw = json.dumps(key, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SharedCache:
+    """
+    带版本号的 LRU + TTL 缓存
+
+    版本号按 scope（如数据集 ID）维护，invalidate(scope) 后该 scope 的旧条目不再命中，
+    随 LRU / TTL（Redis 模式下为 key 过期时间）自然淘汰。Redis 模式下容量由 Redis 的 maxmemory 策略限制。
+    """
+
+    def __init__(self, namespace: str, maxsize: int, ttl: float):
+        self.namespace = namespace
+        self.ttl = ttl
+        self._local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._generations: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _value_key(self, key: Hashable) -> str:
+        return redis_backend.key(self.namespace, "v", _key_string(key))
+
+    def _generation_key(self, scope: str) -> str:
+        return redis_backend.key(self.namespace, "gen", scope)
+
+    async def lookup(self, key: Hashable, scope: str = "") -> Tuple[Any, int]:
+        """
+        读取缓存
+
+        Returns:
+            (value, generation)：未命中时 value 为 None，generation 用于回填 set()
+        """
+        if redis_backend is None:
+            generation = self._generations.get(scope, 0)
+            item = self._local.get(key)
+            value = item[1] if item is not None and item[0] == generation else None
+        else:
+            generation, value = 0, None
+            try:
+                raw, raw_generation = await redis_backend.client.mget(
+                    self._value_key(key), self._generation_key(scope)
+                )
+                generation = int(raw_generation or 0)
+                if raw is not None:
+                    stored_generation, stored = json.loads(raw)
+                    if stored_generation == generation:
+                        value = stored
+            except Exception as e:
+                redis_backend.failed("读取缓存", e)
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value, generation
+
+    async def set(self, key: Hashable, value: Any, generation: int, scope: str = ""):
+        """回填缓存；generation 为 lookup() 时的版本号，期间发生失效时写入的条目不会被命中"""
+        if redis_backend is None:
+            # 期间发生变更时不回填
+            if generation == self._generations.get(scope, 0):
+                self._local.set(key, (generation, value))
+            return
+        try:
+            await redis_backend.client.set(
+                self._value_key(key),
+                json.dumps([generation, value], ensure_ascii=False, separators=(",", ":")),
+                px=int(self.ttl * 1000),
+            )
+        except Exception as e:
+            redis_backend.failed("写入缓存", e)
+
+    async def invalidate(self, *scopes: str):
+        """递增版本号，scope 下的旧条目立即失效"""
+        scopes = scopes or ("",)
+        if redis_backend is None:
+            for scope in scopes:
+                self._generations[scope] = self._generations.get(scope, 0) + 1
+            return
+        try:
+            async with redis_backend.client.pipeline(transaction=False) as pipe:
+                for scope in scopes:
+                    pipe.incr(self._generation_key(scope))
+                await pipe.execute()
+        except Exception as e:
+            redis_backend.failed("失效缓存", e)
+
+    async def clear(self):
+        """删除全部条目（版本号保留）"""
+        if redis_backend is None:
+            self._local.clear()
+            return
+        try:
+            await redis_backend.delete_pattern(redis_backend.key(self.namespace, "v", "*"))
+        except Exception as e:
+            redis_backend.failed("清空缓存", e)
+
+    def stats(self) -> Dict[str, Any]:
+        """命中统计为本 worker 的计数"""
+        lookups = self.hits + self.misses
+        if redis_backend is None:
+            data = self._local.stats()
+        else:
+            data = {"ttl": self.ttl, "errors": redis_backend.errors}
+        return {
+            "backend": backend_name(),
+            **data,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class SharedRegistry:
+    """
+    进度登记（批量导入任务、文档上传）
+
+    登记的对象需提供 snapshot() 与 finished_at。本 worker 的对象直接读取实时状态；
+    配置 Redis 时，未结束的对象每 _PUBLISH_INTERVAL 秒发布一次快照，结束后再发布最后一次
+    """
+
+    def __init__(self, namespace: str, maxsize: int, ttl: float):
+        self.namespace = namespace
+        self.ttl = ttl
+        self._local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._active: Dict[str, Any] = {}
+        self._publisher: Optional[asyncio.Task] = None
+
+    def register(self, item_id: str, item: Any):
+        self._local.set(item_id, item)
+        if redis_backend is None:
+            return
+        self._active[item_id] = item
+        if self._publisher is None or self._publisher.done():
+            self._publisher = asyncio.get_running_loop().create_task(self._publish_loop())
+
+    async def snapshot(self, item_id: str) -> Optional[Dict[str, Any]]:
+        """本 worker 的实时快照，或其他 worker 发布的快照"""
+        item = self._local.get(item_id)
+        if item is not None:
+            return item.snapshot()
+        if redis_backend is None:
+            return None
+        try:
+            raw = await redis_backend.client.get(redis_backend.key(self.namespace, item_id))
+        except Exception as e:
+            redis_backend.failed("读取进度", e)
+            return None
+        return json.loads(raw) if raw is not None else None
+
+    async def _publish(self) -> int:
+        async with redis_backend.client.pipeline(transaction=False) as pipe:
+            for item_id, item in list(self._active.items()):
+                pipe.set(
+                    redis_backend.key(self.namespace, item_id),
+                    json.dumps(item.snapshot(), ensure_ascii=False),
+                    ex=int(self.ttl),
+                )
+                if item.finished_at is not None:
+                    del self._active[item_id]
+            await pipe.execute()
+        return len(self._active)
+
+    async def _publish_loop(self):
+        while True:
+            try:
+                if not await self._publish():
+                    return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                redis_backend.failed("发布进度", e)
+            await asyncio.sleep(_PUBLISH_INTERVAL)
+
+    async def flush(self):
+        """关闭前发布未结束对象的最新快照"""
+        if self._publisher is not None:
+            self._publisher.cancel()
+            self._publisher = None
+        if redis_backend is None or not self._active:
+            return
+        try:
+            await self._publish()
+        except Exception as e:
+            redis_backend.failed("发布进度", e)
+
+
+_registries: List[SharedRegistry] = []
+
+
+def create_registry(namespace: str, maxsize: int, ttl: float) -> SharedRegistry:
+    registry = SharedRegistry(namespace, maxsize, ttl)
+    _registries.append(registry)
+    return registry
+
+
+async def ping() -> Dict[str, Any]:
+    """共享状态后端状态（/ready 使用）；Redis 不可用时缓存降级，不影响就绪"""
+    if redis_backend is None:
+        return {"backend": "memory"}
+    started = time.perf_counter()
+    try:
+        await redis_backend.client.ping()
+    except Exception as e:
+        return {"backend": "redis", "ok": False, "error": f"{type(e).__name__}: {e}"}
+    return {"backend": "redis", "ok": True, "latency_ms": round((time.perf_counter() - started) * 1000, 2)}
+
+
+async def close():
+    for registry in _registries:
+        await registry.flush()
+    if redis_backend is not None:
+        await redis_backend.close()
@@ -1,12 +1,26 @@
 """
 SSH 服务
 提供 SSH 连接和命令执行功能
+
+操作在线程池中执行。调用方（请求）被取消时在事件循环中调用 cancel()：
+向远程命令发送 TERM 信号并关闭通道与连接，阻塞在读取上的工作线程随即返回，
+尚未开始的操作不再建立连接
 """
-import paramiko
-from typing import Dict, Any, Optional
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Any, Iterator, Optional, Set, Tuple
+
 from loguru import logger
 
 from app.config import settings
+from app.services import tracing
+from app.services.host_health import HostUnavailableError, host_health
+from app.services.metrics import SSH_CANCELLED, SSH_PHASE_ERRORS, SSH_PHASE_LATENCY, SSH_SESSIONS_IN_FLIGHT
+
+if TYPE_CHECKING:
+    import paramiko
 
 
 class SSHConnectionError(Exception):
@@ -19,11 +33,98 @@ class CommandExecutionError(Exception):
     pass
 
 
+class CommandCancelledError(Exception):
+    """操作已取消（客户端断开或超过期限）"""
+
+    def __init__(self, reason: str):
+        self.reason = reason
+        super().__init__("命令执行超时，已取消" if reason == "deadline" else "操作已取消")
+
+
+def _send_signal(channel: "paramiko.Channel", name: str):
+    """
+    向远程进程发送信号（RFC 4254 6.9 "signal" 请求，OpenSSH 7.9 起支持）
+
+    paramiko 客户端没有提供对应接口，直接构造通道请求；服务端不支持时忽略，
+    随后关闭通道，远程进程在写输出时收到 SIGPIPE
+    """
+    from paramiko.common import cMSG_CHANNEL_REQUEST
+    from paramiko.message import Message
+
+    message = Message()
+    message.add_byte(cMSG_CHANNEL_REQUEST)
+    message.add_int(channel.remote_chanid)
+    message.add_string("signal")
+    message.add_boolean(False)
+    message.add_string(name)
+    channel.transport._send_user_message(message)
+
+
+@contextmanager
+def _phase(name: str) -> Iterator[None]:
+    """记录 SSH 阶段耗时与失败次数，同时计入当前请求的追踪"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        SSH_PHASE_ERRORS.labels(name).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        SSH_PHASE_LATENCY.observe(elapsed, name)
+        tracing.record(name, started, elapsed)
+
+
 class SSHService:
     """SSH 服务类"""
     
     def __init__(self):
         self.default_timeout = settings.SSH_TIMEOUT
+        # 取消状态：cancel() 在事件循环中调用，连接与通道在工作线程中登记
+        self._lock = threading.Lock()
+        self._cancelled: Optional[str] = None
+        self._clients: Set["paramiko.SSHClient"] = set()
+        self._channels: Set["paramiko.Channel"] = set()
+    
+    def cancel(self, reason: str):
+        """
+        取消进行中与尚未开始的操作（可在任意线程调用）
+        
+        关闭连接需要等待 paramiko 传输线程退出，在独立线程中执行，不阻塞事件循环
+        """
+        with self._lock:
+            if self._cancelled is not None:
+                return
+            self._cancelled = reason
+            channels, clients = list(self._channels), list(self._clients)
+        SSH_CANCELLED.labels(reason).inc()
+        if channels or clients:
+            logger.info(f"取消 SSH 操作 | 原因: {reason} | 通道: {len(channels)}")
+            threading.Thread(target=self._abort, args=(channels, clients), daemon=True).start()
+    
+    @staticmethod
+    def _abort(channels, clients):
+        for channel in channels:
+            try:
+                _send_signal(channel, "TERM")
+            except Exception as e:
+                logger.debug(f"发送信号失败: {e}")
+            channel.close()
+        for client in clients:
+            client.close()
+    
+    def _check_cancelled(self):
+        if self._cancelled is not None:
+            raise CommandCancelledError(self._cancelled)
+    
+    def _track(self, resources: set, resource) -> None:
+        """登记连接 / 通道；已取消时立即关闭并中止"""
+        with self._lock:
+            if self._cancelled is None:
+                resources.add(resource)
+                return
+        resource.close()
+        raise CommandCancelledError(self._cancelled)
     
     def _create_client(
         self,
@@ -31,30 +132,103 @@ class SSHService:
         port: int,
         username: str,
         password: str,
-    ) -> paramiko.SSHClient:
-        """创建 SSH 客户端连接"""
+    ) -> "paramiko.SSHClient":
+        """
+        创建 SSH 客户端连接
+        
+        先单独建立 TCP 连接再交给 paramiko 握手认证，以便分别统计两个阶段的耗时。
+        TCP 连接超时按主机的历史连接耗时调整，失败结果计入主机健康（见 host_health）
+        """
+        # paramiko 及其加密库导入较慢，延迟到首次 SSH 调用（或启动预热）时加载
+        import paramiko
+        
+        # 排队期间调用方已取消时不再建立连接；已知不可达的主机直接失败
+        self._check_cancelled()
+        host_health.check(host, port)
+        connect_timeout = host_health.connect_timeout(host, port)
+        
+        def unreachable(message: str) -> SSHConnectionError:
+            host_health.record_failure(host, port, message)
+            return SSHConnectionError(message)
+        
+        started = time.perf_counter()
+        try:
+            with _phase("connect"):
+                sock = socket.create_connection((host, port), timeout=connect_timeout)
+        except TimeoutError:
+            raise unreachable(f"连接超时（{connect_timeout:g} 秒）: {host}:{port}")
+        except Exception as e:
+            raise unreachable(f"连接失败: {str(e)}")
+        host_health.record_connect(host, port, time.perf_counter() - started)
+        
         client = paramiko.SSHClient()
         client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         
         try:
-            client.connect(
-                hostname=host,
-                port=port,
-                username=username,
-                password=password,
-                timeout=self.default_timeout,
-                look_for_keys=False,
-                allow_agent=False,
-            )
-            return client
-        except paramiko.AuthenticationException:
-            raise SSHConnectionError(f"认证失败: {username}@{host}")
-        except paramiko.SSHException as e:
-            raise SSHConnectionError(f"SSH 连接错误: {str(e)}")
-        except TimeoutError:
-            raise SSHConnectionError(f"连接超时: {host}:{port}")
+            with _phase("auth"):
+                client.connect(
+                    hostname=host,
+                    port=port,
+                    username=username,
+                    password=password,
+                    timeout=self.default_timeout,
+                    look_for_keys=False,
+                    allow_agent=False,
+                    sock=sock,
+                )
         except Exception as e:
-            raise SSHConnectionError(f"连接失败: {str(e)}")
+            client.close()
+            sock.close()
+            if isinstance(e, paramiko.AuthenticationException):
+                # 主机可达，不进入退避
+                host_health.record_success(host, port)
+                raise SSHConnectionError(f"认证失败: {username}@{host}")
+            if isinstance(e, paramiko.SSHException):
+                raise unreachable(f"SSH 连接错误: {str(e)}")
+            if isinstance(e, TimeoutError):
+                raise unreachable(f"连接超时: {host}:{port}")
+            raise unreachable(f"连接失败: {str(e)}")
+        host_health.record_success(host, port)
+        
+        SSH_SESSIONS_IN_FLIGHT.inc()
+        try:
+            self._track(self._clients, client)
+        except CommandCancelledError:
+            SSH_SESSIONS_IN_FLIGHT.dec()
+            raise
+        return client
+    
+    def _close(self, client: Optional["paramiko.SSHClient"]):
+        if client:
+            with self._lock:
+                self._clients.discard(client)
+            client.close()
+            SSH_SESSIONS_IN_FLIGHT.dec()
+    
+    def _run(self, client: "paramiko.SSHClient", command: str, timeout: int) -> Tuple[str, str, int]:
+        """
+        执行命令并读取完整输出
+        
+        timeout 为读取的空闲超时；总时长由调用方的期限控制，超过后 cancel() 关闭通道，读取立即返回
+        
+        Returns:
+            (stdout, stderr, exit_code)
+        """
+        with _phase("exec"):
+            stdin, stdout, stderr = client.exec_command(command, timeout=timeout)
+        channel = stdout.channel
+        self._track(self._channels, channel)
+        try:
+            with _phase("read"):
+                stdout_text = stdout.read().decode('utf-8', errors='replace')
+                stderr_text = stderr.read().decode('utf-8', errors='replace')
+                exit_code = channel.recv_exit_status()
+        finally:
+            with self._lock:
+                self._channels.discard(channel)
+        # 通道被 cancel() 关闭时读取正常返回，输出不完整
+        self._check_cancelled()
+        return stdout_text, stderr_text, exit_code
     
     def test_connection(
         self,
@@ -66,7 +240,7 @@ class SSHService:
         """测试 SSH 连接"""
         try:
             client = self._create_client(host, port, username, password)
-            client.close()
+            self._close(client)
             return True
         except SSHConnectionError:
             return False
@@ -90,16 +264,8 @@ class SSHService:
         try:
             client = self._create_client(host, port, username, password)
             
-            # 执行命令
-            stdin, stdout, stderr = client.exec_command(
-                command,
-                timeout=timeout,
-            )
-            
-            # 获取结果
-            stdout_text = stdout.read().decode('utf-8', errors='replace')
-            stderr_text = stderr.read().decode('utf-8', errors='replace')
-            exit_code = stdout.channel.recv_exit_status()
+            # 执行命令并获取结果
+            stdout_text, stderr_text, exit_code = self._run(client, command, timeout)
             
             return {
                 'stdout': stdout_text,
@@ -107,14 +273,15 @@ class SSHService:
                 'exit_code': exit_code,
             }
             
-        except SSHConnectionError:
+        except (SSHConnectionError, CommandCancelledError, HostUnavailableError):
             raise
         except Exception as e:
+            if self._cancelled is not None:
+                raise CommandCancelledError(self._cancelled)
             logger.exception(f"命令执行失败: {command}")
             raise CommandExecutionError(f"命令执行失败: {str(e)}")
         finally:
-            if client:
-                client.close()
+            self._close(client)
     
     def get_server_status(
         self,
@@ -140,17 +307,17 @@ class SSHService:
             
             for key, cmd in commands.items():
                 try:
-                    stdin, stdout, stderr = client.exec_command(cmd, timeout=10)
-                    result = stdout.read().decode('utf-8', errors='replace').strip()
+                    result = self._run(client, cmd, 10)[0].strip()
                     status[key] = result if result else "N/A"
+                except CommandCancelledError:
+                    raise
                 except Exception:
                     status[key] = "N/A"
             
             return status
             
         finally:
-            if client:
-                client.close()
+            self._close(client)
     
     def check_service_status(
         self,
@@ -173,11 +340,11 @@ class SSHService:
             client = self._create_client(host, port, username, password)
             
             for key, cmd in commands.items():
-                stdin, stdout, stderr = client.exec_command(cmd, timeout=15)
+                stdout_text, stderr_text, exit_code = self._run(client, cmd, 15)
                 results[key] = {
-                    'stdout': stdout.read().decode('utf-8', errors='replace'),
-                    'stderr': stderr.read().decode('utf-8', errors='replace'),
-                    'exit_code': stdout.channel.recv_exit_status(),
+                    'stdout': stdout_text,
+                    'stderr': stderr_text,
+                    'exit_code': exit_code,
                 }
             
             # 判断服务是否活跃
@@ -190,8 +357,7 @@ class SSHService:
             }
             
         finally:
-            if client:
-                client.close()
+            self._close(client)
     
     def get_container_status(
         self,
@@ -211,9 +377,7 @@ class SSHService:
         try:
             client = self._create_client(host, port, username, password)
             
-            stdin, stdout, stderr = client.exec_command(cmd, timeout=15)
-            output = stdout.read().decode('utf-8', errors='replace')
-            error = stderr.read().decode('utf-8', errors='replace')
+            output, error, _ = self._run(client, cmd, 15)
             
             if error:
                 return {'error': error, 'containers': []}
@@ -233,8 +397,7 @@ class SSHService:
             return {'containers': containers}
             
         finally:
-            if client:
-                client.close()
+            self._close(client)
     
     def get_kubernetes_pods(
         self,
@@ -251,9 +414,7 @@ class SSHService:
         try:
             client = self._create_client(host, port, username, password)
             
-            stdin, stdout, stderr = client.exec_command(cmd, timeout=30)
-            output = stdout.read().decode('utf-8', errors='replace')
-            error = stderr.read().decode('utf-8', errors='replace')
+            output, error, _ = self._run(client, cmd, 30)
             
             return {
                 'namespace': namespace,
@@ -262,5 +423,4 @@ class SSHService:
             }
             
         finally:
-            if client:
-                client.close()
+            self._close(client)
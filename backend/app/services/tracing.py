@@ -0,0 +1,82 @@
+"""
+请求追踪
+每个 HTTP 请求一个 Trace，通过 contextvar 传递；asyncio.to_thread 会复制上下文，
+线程池中的 SSH 调用记录的阶段同样归属到发起它的请求
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+class Trace:
+    """一次请求内记录的阶段（名称、起始偏移、耗时，单位毫秒）"""
+
+    __slots__ = ("started", "spans")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: List[Tuple[str, float, float]] = []
+
+    def add(self, name: str, started: float, duration: float):
+        # list.append 是原子操作，线程池与事件循环可以同时写入
+        self.spans.append((name, (started - self.started) * 1000, duration * 1000))
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def breakdown(self) -> Dict[str, float]:
+        """按阶段名汇总耗时（同名阶段累加，保持首次出现的顺序）"""
+        totals: Dict[str, float] = {}
+        for name, _, duration in list(self.spans):
+            totals[name] = totals.get(name, 0.0) + duration
+        return {name: round(duration, 2) for name, duration in totals.items()}
+
+    def server_timing(self) -> str:
+        """生成 Server-Timing 头，附带截至响应头发出时的总耗时"""
+        parts = [f"{name};dur={duration}" for name, duration in self.breakdown().items()]
+        parts.append(f"total;dur={self.elapsed_ms():.2f}")
+        return ", ".join(parts)
+
+    def to_record(self) -> Dict[str, Any]:
+        return {
+            "total_ms": round(self.elapsed_ms(), 2),
+            "spans": [
+                {"name": name, "offset_ms": round(offset, 2), "duration_ms": round(duration, 2)}
+                for name, offset, duration in list(self.spans)
+            ],
+        }
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+def start() -> Tuple[Trace, Any]:
+    """开始一个新的 Trace，返回 (trace, token)，结束时调用 finish(token)"""
+    trace = Trace()
+    return trace, _current.set(trace)
+
+
+def finish(token: Any):
+    _current.reset(token)
+
+
+def record(name: str, started: float, duration: float):
+    """向当前请求记录一个阶段（不在请求上下文中时忽略）"""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, started, duration)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """记录代码块耗时为当前请求的一个阶段"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, started, time.perf_counter() - started)
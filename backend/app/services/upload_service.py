@@ -0,0 +1,186 @@
+"""
+文档上传服务
+以固定大小的分块把文件流式上传到 Dify，内存占用与文件大小无关
+"""
+import json
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+import httpx
+from loguru import logger
+
+from app.services.dify_client import dify_request
+from app.services.shared_state import create_registry
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# 支持的文档类型: PDF, DOCX, TXT, MD
+ALLOWED_CONTENT_TYPES = [
+    "application/pdf",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "text/plain",
+    "text/markdown",
+]
+
+EXTENSION_CONTENT_TYPES = {
+    ".pdf": "application/pdf",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".txt": "text/plain",
+    ".md": "text/markdown",
+    ".markdown": "text/markdown",
+}
+
+# 按块读取文件的异步函数，参数为最大读取字节数
+ChunkReader = Callable[[int], Awaitable[bytes]]
+
+
+class UploadProgress:
+    """单个文件的上传进度"""
+
+    def __init__(self, upload_id: str, filename: str, total_bytes: int):
+        self.upload_id = upload_id
+        self.filename = filename
+        self.total_bytes = total_bytes
+        self.bytes_sent = 0
+        self.status = "pending"
+        self.error: Optional[str] = None
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    def finish(self, status: str, error: Optional[str] = None):
+        self.status = status
+        self.error = error
+        self.finished_at = time.time()
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return {
+            "upload_id": self.upload_id,
+            "filename": self.filename,
+            "status": self.status,
+            "bytes_sent": self.bytes_sent,
+            "total_bytes": self.total_bytes,
+            "percent": round(self.bytes_sent * 100 / self.total_bytes, 1) if self.total_bytes else 100.0,
+            "throughput_mb_s": round(self.bytes_sent / elapsed / 1024 / 1024, 2) if elapsed > 0 else 0.0,
+            "error": self.error,
+        }
+
+
+# 进度记录保留一小时，供客户端轮询
+upload_tracker = create_registry("uploads", maxsize=4096, ttl=3600)
+
+
+def _quote(value: str) -> str:
+    """multipart 头部参数转义（与浏览器行为一致）"""
+    return value.replace("\\", "\\\\").replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+
+
+class MultipartFileStream:
+    """
+    流式 multipart/form-data 请求体
+
+    普通字段一次性编码，文件内容按块读取；预先计算 Content-Length，避免分块传输编码
+    """
+
+    def __init__(
+        self,
+        fields: Dict[str, str],
+        filename: str,
+        content_type: str,
+        reader: ChunkReader,
+        size: int,
+        progress: Optional[UploadProgress] = None,
+        chunk_size: int = UPLOAD_CHUNK_SIZE,
+    ):
+        self.boundary = uuid.uuid4().hex
+        self.reader = reader
+        self.size = size
+        self.progress = progress
+        self.chunk_size = chunk_size
+
+        parts = []
+        for name, value in fields.items():
+            parts.append(
+                f"--{self.boundary}\r\n"
+                f'Content-Disposition: form-data; name="{_quote(name)}"\r\n\r\n'
+                f"{value}\r\n"
+            )
+        parts.append(
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{_quote(filename)}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        )
+        self._head = "".join(parts).encode("utf-8")
+        self._tail = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {
+            "Content-Type": f"multipart/form-data; boundary={self.boundary}",
+            "Content-Length": str(len(self._head) + self.size + len(self._tail)),
+        }
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        yield self._head
+        remaining = self.size
+        while remaining > 0:
+            chunk = await self.reader(min(self.chunk_size, remaining))
+            if not chunk:
+                raise IOError(f"文件在上传过程中被截断，剩余 {remaining} 字节")
+            remaining -= len(chunk)
+            if self.progress:
+                self.progress.bytes_sent += len(chunk)
+            yield chunk
+        yield self._tail
+
+
+async def upload_file_to_dify(
+    dataset_id: str,
+    filename: str,
+    content_type: str,
+    reader: ChunkReader,
+    size: int,
+    indexing_technique: str = "high_quality",
+    progress: Optional[UploadProgress] = None,
+) -> httpx.Response:
+    """
+    流式上传文件到 Dify create_by_file 接口
+
+    Returns:
+        Dify 原始响应，由调用方检查状态码
+    """
+    data = {
+        "indexing_technique": indexing_technique,
+        "process_rule": {
+            "mode": "automatic"
+        }
+    }
+    body = MultipartFileStream(
+        fields={"data": json.dumps(data)},
+        filename=filename,
+        content_type=content_type,
+        reader=reader,
+        size=size,
+        progress=progress,
+    )
+
+    if progress:
+        progress.status = "uploading"
+    started = time.perf_counter()
+
+    response = await dify_request(
+        "POST",
+        f"/datasets/{dataset_id}/document/create_by_file",
+        endpoint="datasets",
+        timeout=120.0,
+        content=body,
+        headers=body.headers,
+    )
+
+    elapsed = time.perf_counter() - started
+    logger.info(
+        f"文档上传完成 | {filename} | {size / 1024 / 1024:.1f} MB | "
+        f"{elapsed:.1f}s | HTTP {response.status_code}"
+    )
+    return response
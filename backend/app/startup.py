@@ -0,0 +1,188 @@
+"""
+启动计时与预热
+
+- 记录导入、生命周期各阶段与预热步骤的耗时，通过 GET /api/admin/startup 查看
+- 预热在端口打开后于后台执行：加载 paramiko、本地关键词索引与 OpenAPI 文档，
+  不阻塞 /health 的首次响应
+- 导入耗时报告：
+
+    python -m app.startup            # 按包汇总 import 耗时
+    python -m app.startup --serve    # 同时测量从进程启动到 /health 首次返回的时间
+"""
+import argparse
+import asyncio
+import importlib
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+
+def _process_age_ms() -> Optional[float]:
+    """进程已运行的时间（读取 /proc，非 Linux 平台返回 None）"""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round((uptime - start_ticks / os.sysconf("SC_CLK_TCK")) * 1000, 1)
+
+
+class StartupReport:
+    """启动各阶段耗时（毫秒）"""
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.warmup: Dict[str, Any] = {}
+        self.ready_after_ms: Optional[float] = None
+        self.warmed_after_ms: Optional[float] = None
+
+    def record(self, name: str, elapsed_ms: float):
+        self.phases[name] = round(elapsed_ms, 1)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - started) * 1000)
+
+    def mark_ready(self):
+        """生命周期启动阶段结束，随后 uvicorn 开始监听端口"""
+        self.ready_after_ms = _process_age_ms()
+        summary = " | ".join(f"{name}: {ms:.0f}ms" for name, ms in self.phases.items())
+        ready = f"{self.ready_after_ms:.0f}ms" if self.ready_after_ms is not None else "未知"
+        logger.info(f"启动完成 | 进程启动至就绪: {ready} | {summary}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "process_age_ms": _process_age_ms(),
+            "ready_after_ms": self.ready_after_ms,
+            "phases": self.phases,
+            "warmup": self.warmup,
+            "warmed_after_ms": self.warmed_after_ms,
+        }
+
+
+startup_report = StartupReport()
+
+
+async def warm_up(steps: List[Tuple[str, Callable[[], Awaitable[Any]]]]):
+    """依次执行预热步骤，单步失败不影响其余步骤"""
+    for name, step in steps:
+        started = time.perf_counter()
+        try:
+            await step()
+            status = "ok"
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            status = f"error: {e}"
+            logger.warning(f"预热失败 | {name} | {e}")
+        startup_report.warmup[name] = {"ms": round((time.perf_counter() - started) * 1000, 1), "status": status}
+    startup_report.warmed_after_ms = _process_age_ms()
+    summary = ", ".join(f"{name}: {step['ms']:.0f}ms" for name, step in startup_report.warmup.items())
+    logger.info(f"预热完成 | {summary}")
+
+
+def import_module_in_thread(name: str) -> Callable[[], Awaitable[Any]]:
+    return lambda: asyncio.to_thread(importlib.import_module, name)
+
+
+# ---------- 导入耗时报告 ----------
+
+def _parse_importtime(output: str) -> List[Tuple[int, int, str]]:
+    """解析 -X importtime 输出，返回 (自身微秒, 累计微秒, 模块名)"""
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_part, cumulative_part, raw = line[len("import time:"):].split("|", 2)
+        try:
+            self_us, cumulative_us = int(self_part), int(cumulative_part)
+        except ValueError:
+            continue  # 表头
+        rows.append((self_us, cumulative_us, raw.strip()))
+    return rows
+
+
+def import_report(top: int = 20) -> str:
+    """在子进程中导入 app.main，按顶层包汇总自身导入耗时"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        capture_output=True,
+        text=True,
+    )
+    rows = _parse_importtime(result.stderr)
+    total = next((cumulative for _, cumulative, name in rows if name == "app.main"), 0)
+
+    packages: Dict[str, int] = {}
+    for self_us, _, name in rows:
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+    app_modules = sorted(
+        ((cumulative, name) for _, cumulative, name in rows if name.startswith("app.") and name != "app.main"),
+        reverse=True,
+    )
+
+    lines = [f"导入 app.main 共 {total / 1000:.1f} ms", "", f"按顶层包汇总（自身耗时，前 {top}）:"]
+    for package, self_us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]:
+        lines.append(f"  {self_us / 1000:8.1f} ms  {package}")
+    lines += ["", f"应用模块（累计耗时，含其导入的依赖，前 {top}）:"]
+    for cumulative, name in app_modules[:top]:
+        lines.append(f"  {cumulative / 1000:8.1f} ms  {name}")
+    return "\n".join(lines)
+
+
+def measure_time_to_healthy(timeout: float = 60.0) -> Optional[float]:
+    """启动 uvicorn 子进程，测量从启动到 /health 首次返回 200 的时间（毫秒）"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    request = "GET /health HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n".encode()
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with socket.create_connection(("127.0.0.1", port), timeout=1) as conn:
+                    conn.sendall(request)
+                    if conn.recv(64).startswith(b"HTTP/1.1 200"):
+                        return (time.perf_counter() - started) * 1000
+            except OSError:
+                time.sleep(0.01)
+        return None
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动耗时报告")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--serve", action="store_true", help="测量从进程启动到 /health 首次返回的时间")
+    args = parser.parse_args()
+
+    print(import_report(args.top))
+    if args.serve:
+        elapsed = measure_time_to_healthy()
+        print()
+        print(f"进程启动至 /health 首次返回: {elapsed:.0f} ms" if elapsed else "等待 /health 超时")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,4 @@
+"""
+端到端基准测试
+在本地启动 SSH 与 Dify 替身服务，以子进程运行真实的后端应用并施加并发负载
+"""
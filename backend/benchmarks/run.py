@@ -0,0 +1,413 @@
+"""
+端到端基准测试
+
+启动替身服务（benchmarks.standins）与被测应用（uvicorn 子进程），按场景以固定并发施加负载，
+报告吞吐、p50/p99 延迟、错误数以及被测进程的峰值 RSS 与线程数，并可与基线文件对比
+
+    cd backend
+    python -m benchmarks.run                                  # 全部场景
+    python -m benchmarks.run --scenarios ssh,chat_stream -c 32 -d 20
+    python -m benchmarks.run --save-baseline                  # 写入基线
+    python -m benchmarks.run --check                          # 与基线对比，退化时退出码为 1
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(BACKEND_DIR, "benchmarks", "baseline.json")
+
+_SSH_TARGET: Dict[str, Any] = {}
+_UPLOAD_BODY = ("# 基准测试文档\n\n" + "nginx 反向代理配置与排障说明。\n" * 200).encode("utf-8")
+
+
+# ---------- 场景 ----------
+
+async def _ssh_execute(client: httpx.AsyncClient, i: int) -> httpx.Response:
+    return await client.post("/api/ssh/execute", json={**_SSH_TARGET, "command": "df -h"})
+
+
+async def _ssh_server_status(client: httpx.AsyncClient, i: int) -> httpx.Response:
+    return await client.post("/api/ssh/server-status", json=_SSH_TARGET)
+
+
+async def _chat_send(client: httpx.AsyncClient, i: int) -> httpx.Response:
+    return await client.post("/api/chat/send", json={"message": f"基准测试问题 {i}", "user_id": "bench"})
+
+
+async def _chat_stream(client: httpx.AsyncClient, i: int) -> httpx.Response:
+    payload = {"message": f"基准测试问题 {i}", "user_id": "bench"}
+    async with client.stream("POST", "/api/chat/stream", json=payload) as response:
+        async for _ in response.aiter_lines():
+            pass
+    return response
+
+
+async def _knowledge_retrieve(client: httpx.AsyncClient, i: int) -> httpx.Response:
+    # 每次查询不同，测量的是未命中缓存的检索路径
+    return await client.post("/api/knowledge/datasets/bench/retrieve", params={"query": f"nginx 502 排查 {i}"})
+
+
+async def _knowledge_list(client: httpx.AsyncClient, i: int) -> httpx.Response:
+    return await client.get("/api/knowledge/datasets", params={"page": 1, "limit": 20})
+
+
+async def _knowledge_upload(client: httpx.AsyncClient, i: int) -> httpx.Response:
+    files = {"file": (f"bench-{i}.md", _UPLOAD_BODY, "text/markdown")}
+    return await client.post("/api/knowledge/datasets/bench/documents/upload", files=files)
+
+
+SCENARIOS: Dict[str, Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]]] = {
+    "ssh_execute": _ssh_execute,
+    "ssh_server_status": _ssh_server_status,
+    "chat_send": _chat_send,
+    "chat_stream": _chat_stream,
+    "knowledge_retrieve": _knowledge_retrieve,
+    "knowledge_list": _knowledge_list,
+    "knowledge_upload": _knowledge_upload,
+}
+
+
+def select_scenarios(spec: str) -> List[str]:
+    """逗号分隔的场景名或前缀（ssh / chat / knowledge）"""
+    if not spec or spec == "all":
+        return list(SCENARIOS)
+    selected: List[str] = []
+    for item in (part.strip() for part in spec.split(",")):
+        matched = [name for name in SCENARIOS if name == item or name.startswith(item + "_")]
+        if not matched:
+            raise SystemExit(f"未知场景: {item}（可选: {', '.join(SCENARIOS)}）")
+        selected.extend(name for name in matched if name not in selected)
+    return selected
+
+
+# ---------- 进程与资源 ----------
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_port(port: int, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit(f"端口 {port} 在 {timeout} 秒内未就绪")
+
+
+def _process_tree(pid: int) -> List[int]:
+    """进程及其全部子进程（多 worker 时 uvicorn 主进程派生 worker 子进程）"""
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        return pids
+    for child in children:
+        pids.extend(_process_tree(child))
+    return pids
+
+
+def process_usage(pid: int) -> Optional[Dict[str, float]]:
+    """读取 /proc 中进程树的 RSS（MB）与线程数之和，非 Linux 平台返回 None"""
+    rss_kb = threads = 0
+    for member in _process_tree(pid):
+        try:
+            with open(f"/proc/{member}/status") as f:
+                fields = dict(line.split(":", 1) for line in f if ":" in line)
+        except OSError:
+            if member == pid:
+                return None
+            continue
+        if "VmRSS" not in fields:
+            continue  # 已退出、尚未回收的进程
+        rss_kb += int(fields["VmRSS"].split()[0])
+        threads += int(fields["Threads"])
+    return {"rss_mb": rss_kb / 1024, "threads": threads}
+
+
+class _ResourceSampler:
+    """压测期间定时采样被测进程的资源占用，记录峰值"""
+
+    def __init__(self, pid: int, interval: float = 0.25):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss_mb = 0.0
+        self.peak_threads = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            usage = process_usage(self.pid)
+            if usage:
+                self.peak_rss_mb = max(self.peak_rss_mb, usage["rss_mb"])
+                self.peak_threads = max(self.peak_threads, int(usage["threads"]))
+            await asyncio.sleep(self.interval)
+
+    def __enter__(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+
+# ---------- 压测 ----------
+
+def _percentile(sorted_values: List[float], percent: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(percent / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run_scenario(
+    name: str,
+    base_url: str,
+    pid: int,
+    concurrency: int,
+    duration: float,
+    warmup: int,
+) -> Dict[str, Any]:
+    scenario = SCENARIOS[name]
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0, limits=limits) as client:
+        for i in range(warmup):
+            await scenario(client, -1 - i)
+
+        latencies: List[float] = []
+        errors: Dict[str, int] = {}
+        counter = iter(range(10 ** 9))
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                i = next(counter)
+                started = time.perf_counter()
+                try:
+                    response = await scenario(client, i)
+                    ok = response.status_code < 400
+                    key = f"HTTP {response.status_code}"
+                except Exception as e:
+                    ok = False
+                    key = type(e).__name__
+                if ok:
+                    latencies.append((time.perf_counter() - started) * 1000)
+                else:
+                    errors[key] = errors.get(key, 0) + 1
+
+        started = time.perf_counter()
+        with _ResourceSampler(pid) as sampler:
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": sum(errors.values()),
+        "error_kinds": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(_percentile(latencies, 50), 2),
+        "p99_ms": round(_percentile(latencies, 99), 2),
+        "max_ms": round(latencies[-1], 2) if latencies else 0.0,
+        "peak_rss_mb": round(sampler.peak_rss_mb, 1),
+        "peak_threads": sampler.peak_threads,
+    }
+
+
+# ---------- 基线 ----------
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """与基线对比，返回退化说明（吞吐下降或 p99 上升超过容差）"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        if previous["throughput_rps"] and current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: 吞吐 {previous['throughput_rps']} -> {current['throughput_rps']} req/s"
+            )
+        if previous["p99_ms"] and current["p99_ms"] > previous["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {previous['p99_ms']} -> {current['p99_ms']} ms")
+    return regressions
+
+
+def _delta(current: float, previous: Optional[float]) -> str:
+    if not previous:
+        return ""
+    return f" ({(current - previous) / previous * 100:+.0f}%)"
+
+
+def print_report(results: Dict[str, Dict[str, Any]], baseline: Optional[Dict[str, Any]]):
+    previous_results = (baseline or {}).get("results", {})
+    header = f"{'scenario':<20}{'requests':>10}{'errors':>8}{'req/s':>18}{'p50 ms':>12}{'p99 ms':>20}{'RSS MB':>10}{'threads':>9}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results.items():
+        previous = previous_results.get(name, {})
+        print(
+            f"{name:<20}{r['requests']:>10}{r['errors']:>8}"
+            f"{str(r['throughput_rps']) + _delta(r['throughput_rps'], previous.get('throughput_rps')):>18}"
+            f"{r['p50_ms']:>12}"
+            f"{str(r['p99_ms']) + _delta(r['p99_ms'], previous.get('p99_ms')):>20}"
+            f"{r['peak_rss_mb']:>10}{r['peak_threads']:>9}"
+        )
+        if r["error_kinds"]:
+            print(f"{'':<20}错误: {r['error_kinds']}")
+
+
+# ---------- 主流程 ----------
+
+def _start_processes(args, workdir: str):
+    ssh_port, dify_port, app_port = _free_port(), _free_port(), _free_port()
+    redis_port = _free_port() if args.workers > 1 else 0
+    standins = subprocess.Popen(
+        [
+            sys.executable, "-m", "benchmarks.standins",
+            "--ssh-port", str(ssh_port), "--ssh-latency", str(args.ssh_latency),
+            "--ssh-output-bytes", str(args.ssh_output_bytes),
+            "--dify-port", str(dify_port), "--dify-latency", str(args.dify_latency),
+            "--tokens", str(args.tokens), "--token-interval", str(args.token_interval),
+            "--redis-port", str(redis_port),
+        ],
+        cwd=BACKEND_DIR,
+    )
+    env = {
+        **os.environ,
+        "DIFY_API_BASE_URL": f"http://127.0.0.1:{dify_port}/v1",
+        "DIFY_API_KEY": "benchmark",
+        "DATABASE_URL": f"sqlite+aiosqlite:///{os.path.join(workdir, 'bench.db')}",
+        "LEXICAL_INDEX_DIR": os.path.join(workdir, "lexical_index"),
+        "DEBUG": "false",
+    }
+    if redis_port:
+        # 多 worker 时共享状态存放在 Redis 替身中；本地关键词索引不支持多进程写入
+        env["REDIS_URL"] = f"redis://127.0.0.1:{redis_port}/0"
+        env["LEXICAL_INDEX_ENABLED"] = "false"
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    log = open(os.path.join(workdir, "app.log"), "w")
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(app_port),
+         "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    _wait_port(ssh_port)
+    _wait_port(dify_port)
+    if redis_port:
+        _wait_port(redis_port)
+    _wait_port(app_port)
+    _SSH_TARGET.update({"host": "127.0.0.1", "port": ssh_port, "username": "bench", "password": "bench"})
+    return standins, app, app_port
+
+
+async def _run_all(args, scenarios: List[str], app: subprocess.Popen, app_port: int) -> Dict[str, Dict[str, Any]]:
+    results = {}
+    for name in scenarios:
+        print(f"运行 {name}（并发 {args.concurrency}，{args.duration} 秒）...", file=sys.stderr)
+        results[name] = await run_scenario(
+            name, f"http://127.0.0.1:{app_port}", app.pid, args.concurrency, args.duration, args.warmup,
+        )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端基准测试")
+    parser.add_argument("--scenarios", default="all", help=f"场景或前缀，逗号分隔（{', '.join(SCENARIOS)}）")
+    parser.add_argument("-c", "--concurrency", type=int, default=16)
+    parser.add_argument("-d", "--duration", type=float, default=10.0, help="每个场景的压测时长（秒）")
+    parser.add_argument("--warmup", type=int, default=3, help="每个场景的预热请求数")
+    parser.add_argument("--workers", type=int, default=1, help="被测应用的 worker 数，大于 1 时共享状态使用 Redis 替身")
+    parser.add_argument("--ssh-latency", type=float, default=0.05)
+    parser.add_argument("--ssh-output-bytes", type=int, default=4096)
+    parser.add_argument("--dify-latency", type=float, default=0.05)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--token-interval", type=float, default=0.01)
+    parser.add_argument("--env", action="append", default=[], help="传给被测应用的配置，KEY=VALUE，可多次指定")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基线文件路径")
+    parser.add_argument("--save-baseline", action="store_true", help="将本次结果写入基线文件")
+    parser.add_argument("--check", action="store_true", help="与基线对比，退化时以退出码 1 结束")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="允许的退化比例")
+    parser.add_argument("--json", help="将结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    scenarios = select_scenarios(args.scenarios)
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    with tempfile.TemporaryDirectory(prefix="ops-bench-") as workdir:
+        standins, app, app_port = _start_processes(args, workdir)
+        try:
+            idle = process_usage(app.pid)
+            results = asyncio.run(_run_all(args, scenarios, app, app_port))
+        finally:
+            for process in (app, standins):
+                process.terminate()
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    if idle:
+        print(f"被测进程空闲时 RSS {idle['rss_mb']:.1f} MB，线程 {int(idle['threads'])}")
+    print_report(results, baseline)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {
+            key: getattr(args, key)
+            for key in ("concurrency", "workers", "duration", "ssh_latency", "ssh_output_bytes",
+                        "dify_latency", "tokens", "token_interval", "env")
+        },
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"基线已写入 {args.baseline}")
+
+    if args.check:
+        if baseline is None:
+            raise SystemExit(f"基线文件不存在: {args.baseline}")
+        if baseline.get("config") != report["config"]:
+            print("警告：本次配置与基线不同，对比结果仅供参考", file=sys.stderr)
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"退化: {line}")
+        if regressions:
+            sys.exit(1)
+        print("与基线相比无明显退化")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""
+SSH 与 Dify 替身服务
+在独立进程中运行，避免与压测客户端、被测应用争用 CPU
+
+- SSH：paramiko 服务端模式，接受任意密码，exec 请求在等待 --ssh-latency 秒后输出 --ssh-output-bytes 字节
+- Dify：阻塞 / SSE 流式对话、停止生成、知识库检索、文件与文本上传、列表、索引状态
+- Redis：RESP 协议的内存实现，只支持共享状态用到的命令（GET / SET / MGET / INCRBY / UNLINK / SCAN 等），
+  用于多 worker 模式（--workers）
+
+    python -m benchmarks.standins --ssh-port 2222 --dify-port 9001 --redis-port 6390
+"""
+import argparse
+import asyncio
+import fnmatch
+import json
+import logging
+import socket
+import threading
+import time
+import uuid
+
+import paramiko
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+
+class _SSHServer(paramiko.ServerInterface):
+    def __init__(self, latency: float, output: bytes):
+        self.latency = latency
+        self.output = output
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self._run, args=(channel,), daemon=True).start()
+        return True
+
+    def _run(self, channel):
+        try:
+            time.sleep(self.latency)
+            channel.sendall(self.output)
+            channel.send_exit_status(0)
+        finally:
+            channel.close()
+
+
+def _serve_ssh(port: int, latency: float, output_bytes: int):
+    host_key = paramiko.RSAKey.generate(2048)
+    line = b"benchmark output line ........................................\n"
+    output = (line * (output_bytes // len(line) + 1))[:output_bytes]
+
+    def handle(conn: socket.socket):
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(host_key)
+        try:
+            transport.start_server(server=_SSHServer(latency, output))
+            while transport.is_active():
+                time.sleep(0.1)
+        except Exception:
+            transport.close()
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("127.0.0.1", port))
+    server.listen(256)
+    while True:
+        conn, _ = server.accept()
+        threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+
+class _RedisStandIn:
+    """单线程事件循环中运行的最小 Redis（RESP2），数据只保存在内存"""
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+
+    def _alive(self, key: bytes) -> bool:
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self.data.pop(key, None)
+            del self.expires[key]
+        return key in self.data
+
+    def execute(self, command: list):
+        name = command[0].upper()
+        args = command[1:]
+        if name == b"PING":
+            return "PONG"
+        if name in (b"CLIENT", b"SELECT", b"FLUSHALL"):
+            if name == b"FLUSHALL":
+                self.data.clear()
+                self.expires.clear()
+            return "OK"
+        if name == b"GET":
+            return self.data[args[0]] if self._alive(args[0]) else None
+        if name == b"MGET":
+            return [self.data[key] if self._alive(key) else None for key in args]
+        if name == b"SET":
+            key, value = args[0], args[1]
+            self.data[key] = value
+            self.expires.pop(key, None)
+            options = [arg.upper() for arg in args[2:]]
+            for option, unit in ((b"PX", 0.001), (b"EX", 1.0)):
+                if option in options:
+                    self.expires[key] = time.monotonic() + int(args[2 + options.index(option) + 1]) * unit
+            return "OK"
+        if name in (b"INCR", b"INCRBY"):
+            amount = int(args[1]) if name == b"INCRBY" else 1
+            value = (int(self.data[args[0]]) if self._alive(args[0]) else 0) + amount
+            self.data[args[0]] = str(value).encode()
+            return value
+        if name in (b"DEL", b"UNLINK"):
+            removed = 0
+            for key in args:
+                if self._alive(key):
+                    del self.data[key]
+                    self.expires.pop(key, None)
+                    removed += 1
+            return removed
+        if name == b"SCAN":
+            # 一次返回全部匹配的 key，游标固定为 0
+            options = [arg.upper() for arg in args[1:]]
+            pattern = args[1 + options.index(b"MATCH") + 1].decode() if b"MATCH" in options else "*"
+            keys = [key for key in list(self.data) if self._alive(key) and fnmatch.fnmatchcase(key.decode(), pattern)]
+            return [b"0", keys]
+        return RuntimeError(f"ERR unknown command '{name.decode()}'")
+
+    @staticmethod
+    def encode(value) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, RuntimeError):
+            return f"-{value}\r\n".encode()
+        if isinstance(value, str):
+            return f"+{value}\r\n".encode()
+        if isinstance(value, int):
+            return f":{value}\r\n".encode()
+        if isinstance(value, bytes):
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        return b"*%d\r\n" % len(value) + b"".join(_RedisStandIn.encode(item) for item in value)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                header = await reader.readline()
+                if not header:
+                    break
+                command = []
+                for _ in range(int(header[1:])):
+                    length = int((await reader.readline())[1:])
+                    command.append((await reader.readexactly(length + 2))[:-2])
+                writer.write(self.encode(self.execute(command)))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def _serve_redis(port: int):
+    async def serve():
+        server = await asyncio.start_server(_RedisStandIn().handle, "127.0.0.1", port)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+def create_dify_app(latency: float, tokens: int, token_interval: float) -> FastAPI:
+    """Dify API 替身，所有接口在 --dify-latency 秒后返回"""
+    app = FastAPI()
+
+    @app.post("/v1/chat-messages")
+    async def chat(request: Request):
+        body = await request.json()
+        conversation_id = body.get("conversation_id") or uuid.uuid4().hex
+        message_id = uuid.uuid4().hex
+        await asyncio.sleep(latency)
+        if body.get("response_mode") == "blocking":
+            return {
+                "answer": "基准测试回答 " * tokens,
+                "conversation_id": conversation_id,
+                "message_id": message_id,
+                "metadata": {"usage": {"total_tokens": tokens}},
+            }
+
+        async def events():
+            base = {"task_id": message_id, "conversation_id": conversation_id, "message_id": message_id}
+            for _ in range(tokens):
+                yield f"data: {json.dumps({'event': 'message', 'answer': '基准 ', **base})}\n\n"
+                if token_interval:
+                    await asyncio.sleep(token_interval)
+            yield f"data: {json.dumps({'event': 'message_end', **base})}\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/v1/chat-messages/{task_id}/stop")
+    async def stop(task_id: str):
+        return {"result": "success"}
+
+    @app.get("/v1/messages")
+    async def messages(limit: int = 20):
+        return {"data": [], "has_more": False, "limit": limit}
+
+    @app.post("/v1/datasets/{dataset_id}/retrieve")
+    async def retrieve(dataset_id: str, request: Request):
+        body = await request.json()
+        await asyncio.sleep(latency)
+        return {
+            "query": {"content": body.get("query")},
+            "records": [
+                {
+                    "segment": {
+                        "id": f"{dataset_id}-{i}",
+                        "content": f"片段 {i}：{body.get('query')}",
+                        "document": {"id": f"doc-{i}", "name": f"doc-{i}.md"},
+                    },
+                    "score": 0.95 - i * 0.05,
+                }
+                for i in range(body.get("top_k") or 5)
+            ],
+        }
+
+    def _document(name: str):
+        document_id = uuid.uuid4().hex
+        return {"document": {"id": document_id, "name": name}, "batch": f"batch-{document_id}"}
+
+    @app.post("/v1/datasets/{dataset_id}/document/create_by_file")
+    async def create_by_file(dataset_id: str, request: Request):
+        form = await request.form()
+        upload = form["file"]
+        await upload.read()
+        await asyncio.sleep(latency)
+        return _document(upload.filename)
+
+    @app.post("/v1/datasets/{dataset_id}/document/create_by_text")
+    async def create_by_text(dataset_id: str, request: Request):
+        body = await request.json()
+        await asyncio.sleep(latency)
+        return _document(body.get("name"))
+
+    @app.get("/v1/datasets/{dataset_id}/documents/{batch}/indexing-status")
+    async def indexing_status(dataset_id: str, batch: str):
+        return {"data": [{"id": batch[len("batch-"):], "indexing_status": "completed",
+                          "completed_segments": 1, "total_segments": 1, "error": None}]}
+
+    @app.get("/v1/datasets")
+    async def datasets(page: int = 1, limit: int = 20):
+        await asyncio.sleep(latency)
+        total = 50
+        data = [{"id": f"ds-{i}", "name": f"dataset-{i}", "document_count": 10}
+                for i in range((page - 1) * limit, min(page * limit, total))]
+        return {"data": data, "has_more": page * limit < total, "limit": limit, "total": total, "page": page}
+
+    @app.get("/v1/datasets/{dataset_id}/documents")
+    async def documents(dataset_id: str, page: int = 1, limit: int = 20):
+        await asyncio.sleep(latency)
+        total = 200
+        data = [{"id": f"doc-{i}", "name": f"doc-{i}.md", "indexing_status": "completed"}
+                for i in range((page - 1) * limit, min(page * limit, total))]
+        return {"data": data, "has_more": page * limit < total, "limit": limit, "total": total, "page": page}
+
+    @app.delete("/v1/datasets/{dataset_id}/documents/{document_id}")
+    async def delete_document(dataset_id: str, document_id: str):
+        return {"result": "success"}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SSH 与 Dify 替身服务")
+    parser.add_argument("--ssh-port", type=int, default=2222)
+    parser.add_argument("--ssh-latency", type=float, default=0.05, help="命令执行耗时（秒）")
+    parser.add_argument("--ssh-output-bytes", type=int, default=4096, help="命令输出大小")
+    parser.add_argument("--dify-port", type=int, default=9001)
+    parser.add_argument("--dify-latency", type=float, default=0.05, help="Dify 接口响应耗时（秒）")
+    parser.add_argument("--tokens", type=int, default=50, help="每个回答的事件数")
+    parser.add_argument("--token-interval", type=float, default=0.01, help="流式事件间隔（秒）")
+    parser.add_argument("--redis-port", type=int, default=0, help="Redis 替身端口，0 表示不启动")
+    args = parser.parse_args()
+    # 客户端断开连接时 paramiko 会记录错误日志，压测中属于正常情况
+    logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+
+    threading.Thread(
+        target=_serve_ssh,
+        args=(args.ssh_port, args.ssh_latency, args.ssh_output_bytes),
+        daemon=True,
+    ).start()
+    if args.redis_port:
+        threading.Thread(target=_serve_redis, args=(args.redis_port,), daemon=True).start()
+    app = create_dify_app(args.dify_latency, args.tokens, args.token_interval)
+    uvicorn.run(app, host="127.0.0.1", port=args.dify_port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""准入控制：Dify 流式会话与代理请求名额"""
+import asyncio
+
+import httpx
+import pytest
+
+from app.api import chat
+from app.config import settings
+from app.services.admission import OverloadedError, admission
+
+
+@pytest.fixture(autouse=True)
+def stream_limit(monkeypatch):
+    monkeypatch.setattr(settings, "ADMISSION_ENABLED", True)
+    monkeypatch.setattr(settings, "ADMISSION_MAX_DIFY_STREAMS", 2)
+    assert admission.streams_in_flight == 0
+    yield
+    assert admission.streams_in_flight == 0
+
+
+def test_admit_stream_reserves_slot():
+    first = admission.admit_stream(chat.HIGH)
+    second = admission.admit_stream(chat.HIGH)
+    with pytest.raises(OverloadedError):
+        admission.admit_stream(chat.HIGH)
+    first.release()
+    first.release()
+    assert admission.streams_in_flight == 1
+    second.release()
+
+
+def test_sse_slot_released_when_generator_never_starts():
+    async def run():
+        response = await chat.stream_message(chat.ChatRequest(message="hi"))
+        assert admission.streams_in_flight == 1
+
+        async def receive():
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            raise OSError("client gone")
+
+        with pytest.raises(Exception):
+            await response({"type": "http", "asgi": {"spec_version": "2.3"}}, receive, send)
+
+    asyncio.run(run())
+
+
+def test_websocket_slot_released_when_task_cancelled_before_start():
+    async def run():
+        socket = chat._ChatSocket(websocket=None)
+        await socket._handle({"type": "chat", "id": "s1", "message": "hi"})
+        assert admission.streams_in_flight == 1
+        task = socket.streams["s1"]
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+
+
+def test_dify_proxy_routes_admitted(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from app.api import knowledge
+    from app.main import app
+
+    async def dify_request(method, path, **kwargs):
+        assert admission.dify_in_flight == 1
+        return httpx.Response(200, json={"data": []})
+
+    monkeypatch.setattr(settings, "ADMISSION_MAX_DIFY_REQUESTS", 1)
+    monkeypatch.setattr(knowledge, "dify_request", dify_request)
+    client = TestClient(app)
+
+    response = client.get("/api/knowledge/datasets")
+    assert response.status_code == 200
+    assert admission.dify_in_flight == 0
+
+    with admission.track_dify(chat.HIGH):
+        response = client.get("/api/knowledge/datasets")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == str(settings.ADMISSION_RETRY_AFTER)
@@ -0,0 +1,54 @@
+"""批量评测：单条请求的重试与错误"""
+import asyncio
+
+import httpx
+
+from app.api import chat
+
+
+def _run(monkeypatch, responses, queries, concurrency=1):
+    calls = []
+
+    async def fake_request(method, path, **kwargs):
+        query = kwargs["json"]["query"]
+        calls.append(query)
+        return responses[query].pop(0)
+
+    monkeypatch.setattr(chat, "dify_request", fake_request)
+    monkeypatch.setattr(chat.random, "uniform", lambda a, b: 0.1)
+
+    async def run():
+        semaphore = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*(
+            chat._run_batch_item(semaphore, i, chat.ChatRequest(message=query), max_retries=2)
+            for i, query in enumerate(queries)
+        ))
+
+    return asyncio.run(run()), calls
+
+
+def test_invalid_json_recorded_as_item_error(monkeypatch):
+    results, calls = _run(monkeypatch, {"a": [httpx.Response(200, content=b"<html>")]}, ["a"])
+    assert results[0]["status"] == "error"
+    assert results[0]["attempts"] == 1
+    assert "无法解析" in results[0]["error"]
+
+
+def test_backoff_releases_semaphore(monkeypatch):
+    ok = httpx.Response(200, json={"answer": "ok", "metadata": {}})
+    responses = {"a": [httpx.Response(503, text="busy"), ok], "b": [ok]}
+    results, calls = _run(monkeypatch, responses, ["a", "b"])
+    # a 退避期间 b 拿到并发名额
+    assert calls == ["a", "b", "a"]
+    assert [result["status"] for result in results] == ["ok", "ok"]
+    assert results[0]["attempts"] == 2
+
+
+def test_unexpected_error_only_fails_that_item(monkeypatch):
+    ok = httpx.Response(200, json={"answer": "ok", "metadata": {"usage": {"total_tokens": 3}}})
+    responses = {"a": [httpx.Response(200, json={"answer": "x", "metadata": ["not", "a", "dict"]})], "b": [ok]}
+    results, calls = _run(monkeypatch, responses, ["a", "b"])
+    assert results[0]["status"] == "error"
+    assert "AttributeError" in results[0]["error"]
+    assert results[1]["status"] == "ok"
+    assert results[1]["usage"] == {"total_tokens": 3}
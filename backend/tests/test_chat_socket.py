@@ -0,0 +1,42 @@
+"""WebSocket 对话：帧校验"""
+import asyncio
+import json
+
+import pytest
+
+from app.api.chat import _ChatSocket, _StreamWindow
+
+
+def _handle(frames):
+    async def run():
+        socket = _ChatSocket(websocket=None)
+        socket.windows["s1"] = _StreamWindow(1)
+        for frame in frames:
+            await socket._handle(frame)
+        sent = []
+        while not socket.outbox.empty():
+            sent.append(json.loads(socket.outbox.get_nowait()))
+        return socket, sent
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("window", [0, -1, "abc", 10 ** 9])
+def test_invalid_window_rejected(window):
+    socket, sent = _handle([{"type": "chat", "id": "s2", "message": "hi", "window": window}])
+    assert [frame["type"] for frame in sent] == ["error"]
+    assert sent[0]["id"] == "s2"
+    assert "s2" not in socket.streams and "s2" not in socket.windows
+
+
+@pytest.mark.parametrize("credits", [0, -5, "abc", None, 10 ** 9])
+def test_invalid_credits_rejected(credits):
+    socket, sent = _handle([{"type": "ack", "id": "s1", "credits": credits}])
+    assert [(frame["id"], frame["type"]) for frame in sent] == [("s1", "error")]
+    assert socket.windows["s1"].credits == 1
+
+
+def test_ack_grants_credits():
+    socket, sent = _handle([{"type": "ack", "id": "s1", "credits": "3"}, {"type": "ack", "id": "s1"}])
+    assert sent == []
+    assert socket.windows["s1"].credits == 5
@@ -0,0 +1,45 @@
+"""本地文本提取：提取失败时回退上传原文件"""
+import asyncio
+import io
+
+from app.services import extract_service
+
+
+def test_extraction_error_falls_back_to_raw_upload(monkeypatch):
+    uploads = []
+
+    async def broken_extract(path, content_type):
+        raise RuntimeError("worker crashed")
+
+    async def upload_file_to_dify(dataset_id, filename, content_type, reader, size, indexing_technique, progress):
+        uploads.append((dataset_id, filename, await reader(size)))
+        return "raw-upload"
+
+    monkeypatch.setattr(extract_service, "extract_document", broken_extract)
+    monkeypatch.setattr(extract_service, "upload_file_to_dify", upload_file_to_dify)
+    monkeypatch.setitem(extract_service.stats, "fallbacks", 0)
+
+    result, chunks = asyncio.run(extract_service.upload_extracted(
+        "ds-1", "broken.pdf", "application/pdf", io.BytesIO(b"%PDF-broken"), 11,
+    ))
+    assert result == "raw-upload"
+    assert chunks == []
+    assert uploads == [("ds-1", "broken.pdf", b"%PDF-broken")]
+    assert extract_service.stats["fallbacks"] == 1
+
+
+def test_chunking_runs_in_process(monkeypatch, tmp_path):
+    class NoChunkPool:
+        def submit(self, fn, *args):
+            assert fn is not extract_service.chunk_text, "分段不应提交到进程池"
+            from concurrent.futures import Future
+            future = Future()
+            future.set_result(fn(*args))
+            return future
+
+    monkeypatch.setattr(extract_service, "get_pool", lambda: NoChunkPool())
+    path = tmp_path / "notes.txt"
+    path.write_text("第一段。\n\n第二段。", encoding="utf-8")
+
+    chunks = asyncio.run(extract_service.extract_document(str(path), extract_service.TEXT_TYPE))
+    assert chunks == ["第一段。\n\n第二段。"]
@@ -0,0 +1,120 @@
+"""对话历史镜像：未镜像的问答使会话回退到 Dify"""
+import asyncio
+import json
+from contextlib import aclosing, asynccontextmanager
+
+import httpx
+import pytest
+
+from app import database
+from app.api import chat
+from app.config import settings
+from app.services import history_service
+
+
+@pytest.fixture(autouse=True)
+def mirror_db(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "DATABASE_URL", f"sqlite+aiosqlite:///{tmp_path}/history.db")
+    monkeypatch.setattr(settings, "CHAT_HISTORY_MIRROR", True)
+    monkeypatch.setattr(settings, "DIFY_STOP_ON_DISCONNECT", False)
+    monkeypatch.setattr(database, "_engine", None)
+
+
+def _run(body):
+    async def run():
+        await database.init_db()
+        try:
+            await history_service.record_message("conv-1", "msg-1", "u1", "第一问", "第一答", new_conversation=True)
+            assert await history_service.is_mirrored("conv-1", "u1")
+            return await body()
+        finally:
+            await database.close_db()
+
+    return asyncio.run(run())
+
+
+def _fake_stream(monkeypatch, events):
+    class Upstream:
+        async def aiter_lines(self):
+            for event in events:
+                yield "data: " + json.dumps(event)
+
+    @asynccontextmanager
+    async def dify_stream(*args, **kwargs):
+        yield Upstream()
+
+    monkeypatch.setattr(chat, "dify_stream", dify_stream)
+
+
+def test_upstream_error_marks_incomplete(monkeypatch):
+    _fake_stream(monkeypatch, [
+        {"event": "message", "conversation_id": "conv-1", "message_id": "msg-2", "answer": "部分"},
+        {"event": "error", "conversation_id": "conv-1", "message": "quota exceeded"},
+    ])
+
+    async def body():
+        request = chat.ChatRequest(message="第二问", conversation_id="conv-1", user_id="u1")
+        async with aclosing(chat._relay_dify_stream(request)) as events:
+            assert len([event async for event in events]) == 2
+        return await history_service.is_mirrored("conv-1", "u1")
+
+    assert _run(body) is False
+
+
+def test_aborted_stream_marks_incomplete(monkeypatch):
+    _fake_stream(monkeypatch, [
+        {"event": "message", "conversation_id": "conv-1", "message_id": "msg-2", "answer": "部分"},
+        {"event": "message_end", "conversation_id": "conv-1", "message_id": "msg-2"},
+    ])
+
+    async def body():
+        request = chat.ChatRequest(message="第二问", conversation_id="conv-1", user_id="u1")
+        async with aclosing(chat._relay_dify_stream(request)) as events:
+            async for _ in events:
+                break
+        await asyncio.gather(*chat._background_tasks)
+        return await history_service.is_mirrored("conv-1", "u1")
+
+    assert _run(body) is False
+
+
+def test_completed_stream_stays_mirrored(monkeypatch):
+    _fake_stream(monkeypatch, [
+        {"event": "message", "conversation_id": "conv-1", "message_id": "msg-2", "answer": "第二答"},
+        {"event": "message_end", "conversation_id": "conv-1", "message_id": "msg-2"},
+    ])
+
+    async def body():
+        request = chat.ChatRequest(message="第二问", conversation_id="conv-1", user_id="u1")
+        async with aclosing(chat._relay_dify_stream(request)) as events:
+            [event async for event in events]
+        assert await history_service.is_mirrored("conv-1", "u1")
+        return await history_service.list_messages("conv-1")
+
+    assert [message["answer"] for message in _run(body)["data"]] == ["第一答", "第二答"]
+
+
+def test_failed_mirror_write_marks_incomplete():
+    async def body():
+        # 消息 ID 重复，写入失败
+        await history_service.record_message("conv-1", "msg-1", "u1", "第二问", "第二答", new_conversation=False)
+        return await history_service.is_mirrored("conv-1", "u1")
+
+    assert _run(body) is False
+
+
+def test_mirror_read_error_falls_back_to_dify(monkeypatch):
+    async def broken(*args, **kwargs):
+        raise RuntimeError("database is locked")
+
+    async def dify_request(method, path, **kwargs):
+        return httpx.Response(200, json={"limit": 20, "has_more": False, "data": [{"id": "msg-1"}]})
+
+    monkeypatch.setattr(chat, "dify_request", dify_request)
+
+    async def body():
+        monkeypatch.setattr(history_service, "is_mirrored", broken)
+        response = await chat.get_conversation_messages("conv-1", user_id="u1")
+        return json.loads(response.body)
+
+    assert _run(body)["data"] == [{"id": "msg-1"}]
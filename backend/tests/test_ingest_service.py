@@ -0,0 +1,157 @@
+"""批量导入与增量同步：清单、同步计划与删除"""
+import asyncio
+import hashlib
+import io
+import zipfile
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from app.config import settings
+from app.services import ingest_service
+from app.services.ingest_service import IngestJob, IngestSource
+from app.services.manifest_service import ManifestEntry
+
+
+def _hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+@pytest.fixture
+def sync_env(monkeypatch):
+    """3 个文档的清单，记录上传与删除调用"""
+    manifest = {
+        f"doc{i}.md": ManifestEntry(f"doc{i}.md", _hash(f"content {i}".encode()), f"id-{i}", 9)
+        for i in range(3)
+    }
+    deleted = []
+    uploaded = []
+
+    async def load_manifest(dataset_id):
+        return dict(manifest)
+
+    async def delete_document(dataset_id, document_id):
+        deleted.append(document_id)
+
+    async def remove_paths(dataset_id, paths):
+        pass
+
+    async def upsert_entry(dataset_id, entry):
+        manifest[entry.source_path] = entry
+
+    async def upload_file_to_dify(dataset_id, filename, **kwargs):
+        uploaded.append(filename)
+        return httpx.Response(200, json={"document": {"id": f"new-{len(uploaded)}"}, "batch": "b"})
+
+    monkeypatch.setattr(ingest_service.manifest_service, "load_manifest", load_manifest)
+    monkeypatch.setattr(ingest_service.manifest_service, "remove_paths", remove_paths)
+    monkeypatch.setattr(ingest_service.manifest_service, "upsert_entry", upsert_entry)
+    monkeypatch.setattr(ingest_service.document_service, "delete_document", delete_document)
+    monkeypatch.setattr(ingest_service, "upload_file_to_dify", upload_file_to_dify)
+    monkeypatch.setattr(ingest_service.indexing_tracker, "track", lambda *args: None)
+    monkeypatch.setattr(settings, "KNOWLEDGE_LOCAL_EXTRACT", False)
+    monkeypatch.setattr(settings, "LEXICAL_INDEX_ENABLED", False)
+    return SimpleNamespace(manifest=manifest, deleted=deleted, uploaded=uploaded)
+
+
+def _run(job: IngestJob, sources):
+    asyncio.run(ingest_service._run_job(job, sources))
+
+
+def test_corrupt_archive_skips_delete_missing(sync_env):
+    job = IngestJob("ds-1", "economy", sync=True)
+    _run(job, [IngestSource("docs.zip", "application/zip", io.BytesIO(b"not a zip file"))])
+
+    assert sync_env.deleted == []
+    assert job.status == "partial"
+    assert len(job.source_errors) == 1
+    assert "跳过删除" in job.error
+    assert job.snapshot()["counts"] == {"skipped": 1}
+
+
+def test_readable_archive_deletes_missing(sync_env):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("doc0.md", b"content 0")
+    buffer.seek(0)
+
+    job = IngestJob("ds-1", "economy", sync=True)
+    _run(job, [IngestSource("docs.zip", "application/zip", buffer)])
+
+    assert sorted(sync_env.deleted) == ["id-1", "id-2"]
+    assert job.status == "completed"
+    assert job.snapshot()["counts"] == {"unchanged": 1, "deleted": 2}
+
+
+def test_sync_following_plan_keeps_unchanged(sync_env):
+    plan = asyncio.run(ingest_service.plan_sync("ds-1", {
+        "./doc0.md": _hash(b"content 0"),
+        "doc1.md": _hash(b"content 1"),
+        "runbooks/new.md": _hash(b"new"),
+    }))
+    assert plan == {
+        "upload": ["runbooks/new.md"],
+        "unchanged": ["doc0.md", "doc1.md"],
+        "delete": [{"path": "doc2.md", "document_id": "id-2"}],
+    }
+
+    async def sync():
+        job = ingest_service.start_ingest_job(
+            "ds-1",
+            [IngestSource("runbooks/new.md", "text/markdown", io.BytesIO(b"new"))],
+            "economy",
+            sync=True,
+            unchanged=plan["unchanged"],
+        )
+        await asyncio.gather(*ingest_service._running)
+        return job
+
+    job = asyncio.run(sync())
+    assert sync_env.deleted == ["id-2"]
+    assert sync_env.uploaded == ["runbooks/new.md"]
+    assert job.snapshot()["counts"] == {"completed": 1, "deleted": 1}
+
+
+def test_bulk_records_manifest_by_relative_path(sync_env):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("a/readme.md", b"first")
+        archive.writestr("./b/readme.md", b"second")
+    buffer.seek(0)
+
+    job = IngestJob("ds-1", "economy")
+    _run(job, [IngestSource("docs.zip", "application/zip", buffer)])
+
+    assert job.status == "completed"
+    assert sync_env.deleted == []
+    assert sync_env.manifest["a/readme.md"].content_hash == _hash(b"first")
+    assert sync_env.manifest["b/readme.md"].content_hash == _hash(b"second")
+
+    plan = asyncio.run(ingest_service.plan_sync("ds-1", {"a/readme.md": _hash(b"first")}, delete_missing=False))
+    assert plan["unchanged"] == ["a/readme.md"]
+
+
+def test_local_extract_chunks_reused_for_keyword_index(sync_env, monkeypatch):
+    extracted = []
+    indexed = []
+
+    async def extract_document(path, content_type):
+        extracted.append(content_type)
+        return ["nginx reload", "upstream timeout"]
+
+    async def dify_request(method, path, **kwargs):
+        return httpx.Response(200, json={"document": {"id": "doc-new"}, "batch": "b"})
+
+    monkeypatch.setattr(settings, "KNOWLEDGE_LOCAL_EXTRACT", True)
+    monkeypatch.setattr(settings, "LEXICAL_INDEX_ENABLED", True)
+    monkeypatch.setattr(ingest_service.extract_service, "extract_document", extract_document)
+    monkeypatch.setattr(ingest_service.extract_service, "dify_request", dify_request)
+    monkeypatch.setattr(ingest_service.lexical_index, "index_chunks", lambda *args: indexed.append(args))
+
+    job = IngestJob("ds-1", "economy")
+    _run(job, [IngestSource("runbooks/gateway.md", "text/markdown", io.BytesIO(b"# nginx"))])
+
+    assert job.status == "completed"
+    assert extracted == ["text/markdown"]
+    assert indexed == [("ds-1", "doc-new", "runbooks/gateway.md", ["nginx reload", "upstream timeout"])]
@@ -0,0 +1,61 @@
+"""本地关键词索引：内存段删除文档"""
+import asyncio
+import io
+
+from app.config import settings
+from app.services import extract_service
+from app.services.lexical_index import DatasetIndex, LexicalIndex, _analyze
+
+
+def _index(documents):
+    index = DatasetIndex("ds-1", "/nonexistent/ds-1.idx")
+    for document_id, chunks in documents.items():
+        index.add(document_id, f"{document_id}.md", _analyze(chunks))
+    return index
+
+
+def test_remove_from_memory_segment_matches_rebuild():
+    documents = {
+        "a": ["nginx reload 配置", "nginx upstream timeout"],
+        "b": ["redis maxmemory 策略", "nginx access log"],
+        "c": ["kubectl get pods", "nginx ingress"],
+    }
+    index = _index(documents)
+    assert index.remove("b")
+
+    expected = _index({key: value for key, value in documents.items() if key != "b"})
+    for query in ("nginx", "redis", "kubectl pods", "配置"):
+        assert index.search(query, 10) == expected.search(query, 10)
+    assert not index.contains("b")
+    assert index.live_stats() == expected.live_stats()
+
+
+def test_failed_load_does_not_block_writes(tmp_path):
+    blocker = tmp_path / "not-a-directory"
+    blocker.write_text("")
+    index = LexicalIndex(str(blocker / "index"))
+
+    async def run():
+        await index.load()
+        await asyncio.wait_for(index.add_document("ds-1", "a", "a.md", ["nginx reload"]), timeout=5)
+        index._flush_task.cancel()
+
+    asyncio.run(run())
+    assert index.has_dataset("ds-1")
+
+
+def test_remove_document_noop_when_disabled(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "LEXICAL_INDEX_ENABLED", False)
+    index = LexicalIndex(str(tmp_path))
+    index.remove_document("ds-1", "a")
+    assert index._pending_removals == []
+
+
+def test_index_upload_failure_is_logged_not_raised(monkeypatch, tmp_path):
+    def broken_copy(fileobj, suffix):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(extract_service, "copy_to_named_file", broken_copy)
+    index = LexicalIndex(str(tmp_path))
+    asyncio.run(index.index_upload("ds-1", "a", "a.pdf", "application/pdf", io.BytesIO(b"%PDF")))
+    assert index.index_failures == 1
@@ -0,0 +1,91 @@
+"""共享运行时状态：Redis 模式（使用 benchmarks 中的 Redis 替身）"""
+import asyncio
+
+from app.services import shared_state
+from app.services.shared_state import SharedCache, SharedRegistry
+from benchmarks.standins import _RedisStandIn
+
+
+def _with_redis(monkeypatch, body):
+    async def run():
+        server = await asyncio.start_server(_RedisStandIn().handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        backend = shared_state.RedisBackend(f"redis://127.0.0.1:{port}/0", "test")
+        monkeypatch.setattr(shared_state, "redis_backend", backend)
+        try:
+            await body()
+            assert backend.errors == 0
+        finally:
+            await backend.close()
+            server.close()
+
+    asyncio.run(run())
+
+
+def test_cache_shared_between_workers(monkeypatch):
+    async def body():
+        worker_a = SharedCache("answer", maxsize=10, ttl=60)
+        worker_b = SharedCache("answer", maxsize=10, ttl=60)
+
+        value, generation = await worker_a.lookup("q", scope="ds-1")
+        assert value is None and generation == 0
+        await worker_a.set("q", ("user-1", {"answer": "好的"}), generation, scope="ds-1")
+
+        value, _ = await worker_b.lookup("q", scope="ds-1")
+        assert value == ["user-1", {"answer": "好的"}]
+        assert worker_b.hits == 1 and worker_a.misses == 1
+
+    _with_redis(monkeypatch, body)
+
+
+def test_cache_invalidate_and_stale_generation(monkeypatch):
+    async def body():
+        worker_a = SharedCache("retrieval", maxsize=10, ttl=60)
+        worker_b = SharedCache("retrieval", maxsize=10, ttl=60)
+
+        _, generation = await worker_a.lookup("k", scope="ds-1")
+        await worker_a.set("k", {"records": []}, generation, scope="ds-1")
+        await worker_b.invalidate("ds-1")
+        value, new_generation = await worker_a.lookup("k", scope="ds-1")
+        assert value is None and new_generation == generation + 1
+
+        # 以失效前的版本号回填的结果不会被命中
+        await worker_a.set("k", {"records": ["stale"]}, generation, scope="ds-1")
+        assert (await worker_b.lookup("k", scope="ds-1"))[0] is None
+
+        # 其他 scope 不受影响
+        _, other = await worker_a.lookup("k2", scope="ds-2")
+        await worker_a.set("k2", [1, 2], other, scope="ds-2")
+        assert (await worker_b.lookup("k2", scope="ds-2"))[0] == [1, 2]
+
+        await worker_b.clear()
+        assert (await worker_a.lookup("k2", scope="ds-2"))[0] is None
+
+    _with_redis(monkeypatch, body)
+
+
+class _Job:
+    def __init__(self):
+        self.processed = 0
+        self.finished_at = None
+
+    def snapshot(self):
+        return {"processed": self.processed, "finished": self.finished_at is not None}
+
+
+def test_registry_publishes_snapshots(monkeypatch):
+    async def body():
+        worker_a = SharedRegistry("jobs", maxsize=10, ttl=60)
+        worker_b = SharedRegistry("jobs", maxsize=10, ttl=60)
+        job = _Job()
+
+        worker_a.register("job-1", job)
+        job.processed = 3
+        job.finished_at = 1.0
+        await worker_a.flush()
+
+        assert await worker_b.snapshot("job-1") == {"processed": 3, "finished": True}
+        assert await worker_b.snapshot("job-2") is None
+        assert not worker_a._active
+
+    _with_redis(monkeypatch, body)
@@ -0,0 +1,44 @@
+"""服务诊断：主机不可达时的返回"""
+import asyncio
+
+import pytest
+
+from app.api import ssh
+from app.services.host_health import HostUnavailableError, host_health
+
+
+@pytest.fixture(autouse=True)
+def reset_hosts():
+    host_health.reset()
+    yield
+    host_health.reset()
+
+
+def test_host_down_mid_diagnosis_reports_remaining_checks(monkeypatch):
+    calls = []
+
+    async def fake_run_ssh(request, ssh_service, priority, func, deadline, **kwargs):
+        calls.append(kwargs["command"])
+        if len(calls) == 1:
+            return {"exit_code": 0, "stdout": "active (running)", "stderr": ""}
+        raise HostUnavailableError(kwargs["host"], kwargs["port"], 2, 1, "timed out")
+
+    monkeypatch.setattr(ssh, "_run_ssh", fake_run_ssh)
+    result = asyncio.run(ssh.diagnose_service(None, host="10.0.0.1", service_name="nginx", accept=None))
+
+    diagnostics = result["diagnostics"]
+    assert diagnostics["service_status"] == {"success": True, "output": "active (running)"}
+    for name in ("recent_logs", "process_check"):
+        assert diagnostics[name]["success"] is False
+        assert diagnostics[name]["host_down"] is True
+    assert len(calls) == 3
+
+
+def test_host_already_down_returns_unavailable(monkeypatch):
+    async def fake_run_ssh(*args, **kwargs):
+        raise AssertionError("退避期内不应发起连接")
+
+    monkeypatch.setattr(ssh, "_run_ssh", fake_run_ssh)
+    host_health.record_failure("10.0.0.1", 22, "timed out")
+    with pytest.raises(HostUnavailableError):
+        asyncio.run(ssh.diagnose_service(None, host="10.0.0.1", service_name="nginx", accept=None))